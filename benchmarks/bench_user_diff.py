@@ -0,0 +1,150 @@
+"""
+Mongo User Diff Benchmark
+-------------------------
+Compares the in-Python dict diff ("memory") with the warehouse-side diff
+("warehouse") used by cdc/extract_mongo.py, at several collection sizes.
+
+For each size the benchmark seeds a scratch Mongo collection and
+analytics.raw_users, marks a fraction of the warehouse hashes stale, and
+then times each strategy in its own subprocess so that peak RSS is
+isolated. Strategy runs are rolled back, so every strategy sees the same
+state.
+
+Run against the local docker-compose warehouse and a local Mongo only:
+
+    python benchmarks/bench_user_diff.py --sizes 1000000 10000000 --output diff_bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+
+from bench_utils import peak_rss_mb, require_local
+
+import extract_mongo  # noqa: E402
+from hashing import RecordHasher  # noqa: E402
+
+FIRST_NAMES = ["Ada", "Bola", "Chidi", "Dayo", "Emeka", "Funmi", "Gbenga", "Halima"]
+LAST_NAMES = ["Adeyemi", "Bello", "Chukwu", "Danjuma", "Eze", "Fashola", "Garba", "Ibrahim"]
+OCCUPATIONS = ["Trader", "Teacher", "Doctor", "Banker", "Student", "Farmer"]
+STATES = ["Lagos", "Kano", "Rivers", "Oyo", "Abuja", "Enugu"]
+
+
+def seed(size: int, stale_ratio: float, batch_size: int = 10_000):
+    """Seed the scratch collection and raw_users with size users."""
+    rng = random.Random(size)
+    client = extract_mongo.get_mongo_client()
+    coll = extract_mongo.get_users_collection(client)
+    coll.drop()
+
+    for start in range(0, size, batch_size):
+        coll.insert_many(
+            [
+                {
+                    "Uid": f"user_{i:09d}",
+                    "firstName": rng.choice(FIRST_NAMES),
+                    "lastName": rng.choice(LAST_NAMES),
+                    "occupation": rng.choice(OCCUPATIONS),
+                    "state": rng.choice(STATES),
+                }
+                for i in range(start, min(start + batch_size, size))
+            ],
+            ordered=False,
+        )
+    coll.create_index("Uid")
+
+    conn = extract_mongo.get_pg_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE analytics.raw_users")
+        extract_mongo.diff_in_warehouse(conn, coll, RecordHasher(), batch_size)
+        conn.commit()
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE analytics.raw_users SET record_hash = 'stale' WHERE random() < %s",
+                (stale_ratio,),
+            )
+            cur.execute("ANALYZE analytics.raw_users")
+        conn.commit()
+    finally:
+        conn.close()
+        client.close()
+
+
+def run_strategy(strategy: str) -> dict:
+    """Time one diff strategy and roll its changes back."""
+    client = extract_mongo.get_mongo_client()
+    coll = extract_mongo.get_users_collection(client)
+    conn = extract_mongo.get_pg_connection()
+    try:
+        hasher = RecordHasher()
+        started = time.perf_counter()
+        if strategy == "warehouse":
+            counts = extract_mongo.diff_in_warehouse(conn, coll, hasher)
+        else:
+            counts = extract_mongo.diff_in_memory(conn, extract_mongo.fetch_mongo_users(coll), hasher)
+        seconds = time.perf_counter() - started
+        conn.rollback()
+    finally:
+        conn.close()
+        client.close()
+
+    return {
+        "strategy": strategy,
+        "seconds": round(seconds, 3),
+        "users_per_second": round(counts["seen"] / seconds) if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "counts": counts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Mongo user diff strategies")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--strategies", nargs="+", default=["memory", "warehouse"])
+    parser.add_argument("--stale-ratio", type=float, default=0.01)
+    parser.add_argument("--collection", default="bench_users")
+    parser.add_argument("--output", default="bench_user_diff.json")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="allow a non-local PG_HOST or MONGO_URI (truncates raw_users)")
+    parser.add_argument("--run-strategy", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ["MONGO_COLLECTION"] = args.collection
+
+    if args.run_strategy:
+        print(json.dumps(run_strategy(args.run_strategy)))
+        return
+
+    require_local(args.allow_remote, "truncate analytics.raw_users")
+
+    results = []
+    for size in args.sizes:
+        print(f"Seeding {size:,} users...")
+        seed(size, args.stale_ratio)
+        for strategy in args.strategies:
+            out = subprocess.run(
+                [sys.executable, __file__, "--collection", args.collection, "--run-strategy", strategy],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            result["size"] = size
+            results.append(result)
+            print(
+                f"{size:>12,} {strategy:<10} {result['seconds']:>9.2f}s "
+                f"{result['peak_rss_mb']:>9.1f} MiB  {result['counts']['upserted']:,} changed"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump({"stale_ratio": args.stale_ratio, "results": results}, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Shared helpers for the CDC benchmarks: import paths, the local-only guard,
+peak RSS, and database round-trip counters for Postgres and MongoDB.
+"""
+
+import os
+import sys
+import resource
+from collections import Counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(ROOT, "cdc"))
+sys.path.insert(0, os.path.join(ROOT, "data"))
+
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1", "postgres_warehouse"}
+
+ROUND_TRIPS = Counter()
+
+
+def mongo_hosts(uri: str) -> set:
+    """Hosts named in a MongoDB URI; an SRV URI counts as remote."""
+    if not uri or uri.startswith("mongodb+srv://"):
+        return {None}
+    nodes = uri.split("://", 1)[-1].split("/", 1)[0].split("?", 1)[0].rsplit("@", 1)[-1]
+    return {node[1:node.index("]")] if node.startswith("[") else node.split(":", 1)[0]
+            for node in nodes.split(",")}
+
+
+def require_local(allow_remote: bool, what: str):
+    """Exit unless PG_HOST and MONGO_URI both point at local servers."""
+    if allow_remote:
+        return
+    if os.getenv("PG_HOST") not in LOCAL_HOSTS:
+        sys.exit(f"Refusing to {what} on a non-local PG_HOST; pass --allow-remote.")
+    if not mongo_hosts(os.getenv("MONGO_URI")) <= LOCAL_HOSTS:
+        sys.exit(f"Refusing to {what} on a non-local MONGO_URI; pass --allow-remote.")
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB (Linux reports KiB)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def install_round_trip_counters():
+    """Count Postgres statements and MongoDB commands issued by this process.
+
+    Postgres connections opened through psycopg2.connect get a connection
+    class whose cursors count execute, executemany and copy_expert, plus
+    every fetch and iteration page on server-side (named) cursors. MongoDB
+    commands are counted with a pymongo command listener, so this must run
+    before clients are created.
+    """
+    import psycopg2
+    from psycopg2 import extensions
+    from pymongo import monitoring
+
+    cursor_classes = {}
+
+    def counting_cursor(factory):
+        if factory not in cursor_classes:
+            class CountingCursor(factory):
+                def execute(self, *args, **kwargs):
+                    ROUND_TRIPS["postgres"] += 1
+                    return super().execute(*args, **kwargs)
+
+                def executemany(self, *args, **kwargs):
+                    ROUND_TRIPS["postgres"] += 1
+                    return super().executemany(*args, **kwargs)
+
+                def copy_expert(self, *args, **kwargs):
+                    ROUND_TRIPS["postgres"] += 1
+                    return super().copy_expert(*args, **kwargs)
+
+                # On named (server-side) cursors every fetch is a FETCH statement.
+                def fetchone(self):
+                    if self.name is not None:
+                        ROUND_TRIPS["postgres"] += 1
+                    return super().fetchone()
+
+                def fetchmany(self, *args, **kwargs):
+                    if self.name is not None:
+                        ROUND_TRIPS["postgres"] += 1
+                    return super().fetchmany(*args, **kwargs)
+
+                def fetchall(self):
+                    if self.name is not None:
+                        ROUND_TRIPS["postgres"] += 1
+                    return super().fetchall()
+
+                def __iter__(self):
+                    if self.name is None:
+                        return super().__iter__()
+                    return self._iter_named()
+
+                def _iter_named(self):
+                    # Same FETCH FORWARD itersize pages as psycopg2's own iteration.
+                    while True:
+                        rows = self.fetchmany(self.itersize)
+                        if not rows:
+                            return
+                        yield from rows
+
+            cursor_classes[factory] = CountingCursor
+        return cursor_classes[factory]
+
+    class CountingConnection(extensions.connection):
+        def cursor(self, *args, **kwargs):
+            factory = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+            kwargs["cursor_factory"] = counting_cursor(factory)
+            return super().cursor(*args, **kwargs)
+
+    real_connect = psycopg2.connect
+
+    def counting_connect(*args, **kwargs):
+        kwargs.setdefault("connection_factory", CountingConnection)
+        return real_connect(*args, **kwargs)
+
+    psycopg2.connect = counting_connect
+
+    class CommandCounter(monitoring.CommandListener):
+        def started(self, event):
+            ROUND_TRIPS["mongodb"] += 1
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+    monitoring.register(CommandCounter())
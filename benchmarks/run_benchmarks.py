@@ -0,0 +1,240 @@
+"""
+End-to-End CDC Benchmark
+------------------------
+Seeds the local sources at several sizes, then runs the Postgres and Mongo
+CDC jobs through a full backfill and an incremental pass after a given
+fraction of rows changed. Every stage runs in its own subprocess and
+records wall time, rows/s, peak RSS and Postgres/MongoDB round trips.
+
+Results go to a JSON report tagged with the current git commit; pass
+--compare with an earlier report to print per-stage deltas.
+
+Intended for the docker-compose warehouse and a local Mongo standing in for
+Aiven and Atlas (it truncates the raw layer and reseeds the sources):
+
+    python benchmarks/run_benchmarks.py --sizes 10000 1000000 10000000 \\
+        --change-ratios 0.01 0.1 --output bench_report.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+from datetime import datetime
+
+from bench_utils import ROOT, ROUND_TRIPS, install_round_trip_counters, peak_rss_mb, require_local
+
+STAGES = ("postgres_backfill", "mongo_backfill", "postgres_incremental", "mongo_incremental")
+
+
+def reset_warehouse():
+    """Empty the raw layer and rewind every CDC watermark."""
+    import extract_postgres
+
+    conn = extract_postgres.get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "TRUNCATE analytics.raw_users, analytics.raw_savings_plan, analytics.raw_savingstransaction"
+            )
+            cur.execute(
+                """
+                UPDATE analytics.cdc_metadata
+                SET last_extracted_timestamp = '1970-01-01',
+                    last_extracted_key = NULL,
+                    last_lsn = NULL,
+                    resume_token = NULL,
+                    last_extraction_status = 'never_run',
+                    records_extracted = 0
+                """
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def seed_sources(size: int, seed: int, workers: int):
+    """Seed the sources with size transactions and proportional users/plans.
+
+    Users land in the collection the CDC job reads (MONGO_URI, MONGO_DB,
+    MONGO_COLLECTION), never the generator's default.
+    """
+    import extract_mongo
+    import generate_sample_data
+
+    client = extract_mongo.get_mongo_client()
+    try:
+        coll = extract_mongo.get_users_collection(client)
+        mongo_db, mongo_collection = coll.database.name, coll.name
+    finally:
+        client.close()
+
+    generate_sample_data.generate_at_scale(
+        users=max(size // 10, 100),
+        plans=max(size // 5, 100),
+        transactions=size,
+        seed=seed,
+        workers=workers,
+        mongo_uri=os.environ["MONGO_URI"],
+        mongo_db=mongo_db,
+        mongo_collection=mongo_collection,
+    )
+
+
+def apply_changes(ratio: float, seed: int):
+    """Touch roughly ratio of every source's rows so the next run has work."""
+    import extract_mongo
+    import generate_sample_data
+    import psycopg2
+
+    conn = psycopg2.connect(generate_sample_data.POSTGRES_SOURCE_URI)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT setseed(%s)", (seed / 2**31,))
+            for table in ("savings_plan", "savingstransaction"):
+                cur.execute(
+                    f"UPDATE {table} SET amount = amount + 1, updated_at = now() WHERE random() < %s",
+                    (ratio,),
+                )
+        conn.commit()
+    finally:
+        conn.close()
+
+    rng = random.Random(seed)
+    client = extract_mongo.get_mongo_client()
+    try:
+        coll = extract_mongo.get_users_collection(client)
+        count = int(coll.estimated_document_count() * ratio)
+        if not count:
+            return
+        sample = coll.aggregate([{"$sample": {"size": count}}, {"$project": {"_id": 1}}])
+        ids = [d["_id"] for d in sample]
+        for start in range(0, len(ids), 10_000):
+            coll.update_many(
+                {"_id": {"$in": ids[start:start + 10_000]}},
+                {"$set": {"occupation": rng.choice(generate_sample_data.OCCUPATIONS)}},
+            )
+    finally:
+        client.close()
+
+
+def run_stage(stage: str) -> dict:
+    """Run one CDC stage in this process and measure it."""
+    install_round_trip_counters()
+    import extract_mongo
+    import extract_postgres
+
+    started = time.perf_counter()
+    if stage.startswith("postgres"):
+        rows = sum(s["rows"] for s in extract_postgres.run_postgres_cdc())
+    else:
+        rows = extract_mongo.sync_users("snapshot") or 0
+    seconds = time.perf_counter() - started
+
+    return {
+        "stage": stage,
+        "seconds": round(seconds, 3),
+        "rows": rows,
+        "rows_per_second": round(rows / seconds) if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "postgres_round_trips": ROUND_TRIPS["postgres"],
+        "mongodb_round_trips": ROUND_TRIPS["mongodb"],
+    }
+
+
+def _spawn_stage(stage: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-stage", stage],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report: dict, baseline_path: str):
+    """Print per-stage wall-time and round-trip deltas against a baseline report."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(r):
+        return r["size"], r["change_ratio"], r["stage"]
+
+    before = {key(r): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline.get('commit', '?')}:")
+    for r in report["results"]:
+        old = before.get(key(r))
+        if not old or not old["seconds"]:
+            continue
+        delta = (r["seconds"] - old["seconds"]) / old["seconds"] * 100
+        print(
+            f"{r['size']:>12,} {r['change_ratio']:>6} {r['stage']:<22} "
+            f"{old['seconds']:>9.2f}s -> {r['seconds']:>9.2f}s ({delta:+.1f}%)  "
+            f"pg trips {old['postgres_round_trips']} -> {r['postgres_round_trips']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end CDC benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--change-ratios", type=float, nargs="+", default=[0.01, 0.1])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--seed-workers", type=int, default=4)
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--compare", help="earlier report to diff against")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="allow a non-local PG_HOST or MONGO_URI (truncates the raw layer, reseeds sources)")
+    parser.add_argument("--run-stage", choices=STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        print(json.dumps(run_stage(args.run_stage)))
+        return
+
+    require_local(args.allow_remote, "reseed sources and truncate the raw layer")
+
+    report = {
+        "commit": _git_commit(),
+        "started_at": datetime.utcnow().isoformat(),
+        "results": [],
+    }
+    for size in args.sizes:
+        for ratio in args.change_ratios:
+            print(f"Seeding {size:,} transactions (change ratio {ratio})...")
+            seed_sources(size, args.seed, args.seed_workers)
+            reset_warehouse()
+
+            for stage in STAGES:
+                if stage == "postgres_incremental":
+                    apply_changes(ratio, args.seed)
+                result = _spawn_stage(stage)
+                result.update(size=size, change_ratio=ratio)
+                report["results"].append(result)
+                print(
+                    f"{size:>12,} {ratio:>6} {stage:<22} {result['seconds']:>9.2f}s "
+                    f"{result['rows']:>11,} rows {result['peak_rss_mb']:>8.1f} MiB "
+                    f"pg {result['postgres_round_trips']:>7} mongo {result['mongodb_round_trips']:>6}"
+                )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Long-Running CDC Daemon
+-----------------------
+Runs the Postgres and MongoDB CDC jobs continuously instead of once per
+cron invocation.
+
+Every source gets its own worker thread. The thread keeps its connections
+open between polls: Postgres tables draw from a persistent pool, tables on
+the logical engine keep one replication stream each, and MongoDB keeps one
+client and one warehouse connection. After each poll the wait
+adapts. It drops to the minimum while changes are flowing, and grows by
+the backoff factor up to the maximum while the source is idle or failing.
+When a poll stopped at the batch cap with work left, the next poll starts
+immediately.
+
+A poll commits at most batch-size rows per transaction and stops draining
+after max-batch-seconds, so freshly committed data is never held back
+behind a long backlog. SIGINT/SIGTERM let each worker commit the batch in
+flight, then the daemon closes its connections and exits.
+
+    python cdc/daemon.py --min-interval 1 --max-interval 60
+"""
+
+import os
+import time
+import signal
+import argparse
+import logging
+import threading
+
+import instrumentation
+import extract_mongo
+import extract_postgres
+from hashing import RecordHasher
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(threadName)s - %(levelname)s - %(message)s",
+    force=True,
+)
+logger = logging.getLogger("cdc_daemon")
+
+MIN_INTERVAL = float(os.getenv("CDC_DAEMON_MIN_INTERVAL", "1"))
+MAX_INTERVAL = float(os.getenv("CDC_DAEMON_MAX_INTERVAL", "60"))
+BACKOFF = float(os.getenv("CDC_DAEMON_BACKOFF", "2"))
+MAX_BATCH_SECONDS = float(os.getenv("CDC_DAEMON_MAX_BATCH_SECONDS", "30"))
+MONGO_MODE = os.getenv("CDC_DAEMON_MONGO_MODE", "changestream")
+# Longest idle wait on a logical table's replication stream. It only answers
+# keepalives while polled, so this stays below wal_sender_timeout (60s default).
+LOGICAL_MAX_INTERVAL = float(os.getenv("CDC_DAEMON_LOGICAL_MAX_INTERVAL", "30"))
+
+
+class AdaptiveInterval:
+    """Poll interval that tightens while changes flow and backs off when idle."""
+
+    def __init__(self, minimum: float = MIN_INTERVAL, maximum: float = MAX_INTERVAL, backoff: float = BACKOFF):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.current = minimum
+
+    def next(self, rows: int, capped: bool = False) -> float:
+        """Return the wait before the next poll given the last poll's outcome."""
+        if rows or capped:
+            self.current = self.minimum
+            return 0.0 if capped else self.current
+        self.current = min(self.current * self.backoff, self.maximum)
+        return self.current
+
+
+class CdcDaemon:
+    """Poll the configured CDC sources until stopped."""
+
+    def __init__(self, tables=None, mongo: bool = True, mongo_mode: str = MONGO_MODE,
+                 diff_strategy: str = extract_mongo.DIFF_STRATEGY,
+                 chunk_size: int = extract_postgres.CHUNK_SIZE,
+                 change_batch_size: int = extract_mongo.CHANGE_BATCH_SIZE,
+                 max_batch_seconds: float = MAX_BATCH_SECONDS,
+                 min_interval: float = MIN_INTERVAL, max_interval: float = MAX_INTERVAL,
+                 backoff: float = BACKOFF, snapshot_workers: int = extract_mongo.SNAPSHOT_WORKERS):
+        names = extract_postgres.TABLES_CONFIG if tables is None else tables
+        self.tables = {name: extract_postgres.TABLES_CONFIG[name] for name in names}
+        self.mongo = mongo
+        self.mongo_mode = mongo_mode
+        self.diff_strategy = diff_strategy
+        self.chunk_size = chunk_size
+        self.change_batch_size = change_batch_size
+        self.snapshot_workers = snapshot_workers
+        self.max_batch_seconds = max_batch_seconds
+        self.intervals = (min_interval, max_interval, backoff)
+        self.stop = threading.Event()
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def request_stop(self, signum=None, frame=None):
+        if not self.stop.is_set():
+            logger.info("Shutdown requested; finishing in-flight batches")
+        self.stop.set()
+
+    def _stop_when(self):
+        deadline = time.monotonic() + self.max_batch_seconds
+
+        def stop_when():
+            return self.stop.is_set() or time.monotonic() >= deadline
+
+        return stop_when, deadline
+
+    def _publish(self, stats):
+        """Export the latest run of every source as one metrics file."""
+        with self._lock:
+            self._latest[stats.source_name] = stats
+            runs = list(self._latest.values())
+        try:
+            instrumentation.export_metrics("daemon", runs)
+        except OSError as exc:
+            logger.warning("Could not export metrics: %s", exc)
+
+    def poll_postgres(self, pool, name: str, cfg: dict):
+        """Worker loop for one Postgres table.
+
+        A logical table keeps one replication stream open for the daemon's
+        lifetime and returns as soon as it has drained, leaving the wait to
+        AdaptiveInterval, capped at LOGICAL_MAX_INTERVAL so the source does
+        not drop the idle stream.
+        """
+        minimum, maximum, backoff = self.intervals
+        if cfg.get("engine", "polling") == "logical":
+            maximum = min(maximum, LOGICAL_MAX_INTERVAL)
+        interval = AdaptiveInterval(min(minimum, maximum), maximum, backoff)
+        streams = {}
+        try:
+            while not self.stop.is_set():
+                stop_when, deadline = self._stop_when()
+                try:
+                    summary = extract_postgres.run_table(
+                        pool, name, cfg, self.chunk_size, stop_when=stop_when, record_idle=False,
+                        streams=streams, idle_timeout=0,
+                    )
+                except Exception as exc:
+                    logger.error("Postgres poll of %s failed; retrying: %s", name, exc, exc_info=True)
+                    self.stop.wait(interval.next(0))
+                    continue
+                self._publish(summary["stats"])
+
+                ok = summary["status"] == "success"
+                capped = ok and time.monotonic() >= deadline
+                wait = interval.next(summary["rows"] if ok else 0, capped)
+                self.stop.wait(wait)
+        finally:
+            for stream in streams.values():
+                stream.close()
+
+    def poll_mongo(self):
+        """Worker loop for the MongoDB users collection."""
+        interval = AdaptiveInterval(*self.intervals)
+        hasher = RecordHasher()
+        client = conn = coll = None
+        try:
+            while not self.stop.is_set():
+                stop_when, deadline = self._stop_when()
+                rows, ok = 0, True
+                try:
+                    with instrumentation.track_run(extract_mongo.METADATA_NAME, "mongodb") as stats:
+                        if conn is None:
+                            with instrumentation.stage("connect"):
+                                client = extract_mongo.get_mongo_client()
+                                coll = extract_mongo.get_users_collection(client)
+                                conn = extract_mongo.get_pg_connection()
+                                conn.autocommit = False
+                        rows = extract_mongo.run_sync(
+                            conn, coll, self.mongo_mode, self.diff_strategy, hasher,
+                            self.change_batch_size, stop_when, self.snapshot_workers,
+                        )
+                except Exception as exc:
+                    ok = False
+                    logger.error("MongoDB poll failed; reconnecting on next poll: %s", exc, exc_info=True)
+
+                if rows or not ok:
+                    _record_mongo_run(conn, stats, failed=not ok)
+                    instrumentation.log_run(stats)
+                if not ok:
+                    client, conn = _close_mongo(client, conn)
+                self._publish(stats)
+
+                capped = ok and time.monotonic() >= deadline
+                self.stop.wait(interval.next(rows, capped))
+        finally:
+            _close_mongo(client, conn)
+            hasher.close()
+
+    def run(self):
+        """Start one worker per source and block until they have all stopped."""
+        pool = None
+        threads = []
+        if self.tables:
+            pool = extract_postgres.create_pool(len(self.tables), persistent=True)
+            threads += [
+                threading.Thread(target=self.poll_postgres, args=(pool, name, cfg), name=f"cdc-{name}")
+                for name, cfg in self.tables.items()
+            ]
+        if self.mongo:
+            threads.append(threading.Thread(target=self.poll_mongo, name="cdc-mongodb"))
+
+        logger.info(
+            "CDC daemon polling %d source(s) every %.1f-%.1fs (batch cap %.0fs)",
+            len(threads), self.intervals[0], self.intervals[1], self.max_batch_seconds,
+        )
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                # Join with a timeout so the main thread keeps handling signals.
+                while thread.is_alive():
+                    thread.join(1.0)
+        finally:
+            self.stop.set()
+            if pool is not None:
+                pool.closeall()
+        logger.info("CDC daemon stopped")
+
+
+def _record_mongo_run(conn, stats, failed: bool):
+    """Record a Mongo poll in cdc_run_history before its connections are closed.
+
+    A failed poll's transaction is rolled back first. When the warehouse
+    connection was never opened or is unusable, the run is recorded on a
+    fresh one.
+    """
+    fresh = None
+    try:
+        if failed and conn is not None and not conn.closed:
+            conn.rollback()
+    except Exception as exc:
+        logger.debug("Could not roll back the failed MongoDB poll: %s", exc)
+        conn = None
+    try:
+        if conn is None or conn.closed:
+            conn = fresh = extract_mongo.get_pg_connection()
+        extract_mongo.record_run(conn, stats)
+    except Exception as exc:
+        logger.warning("Could not record run history: %s", exc)
+    finally:
+        if fresh is not None:
+            fresh.close()
+
+
+def _close_mongo(client, conn):
+    """Close the Mongo worker's connections, ignoring errors; returns (None, None)."""
+    for resource in (conn, client):
+        if resource is None:
+            continue
+        try:
+            resource.close()
+        except Exception as exc:
+            logger.debug("Error closing %r: %s", resource, exc)
+    return None, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Continuous CDC daemon for Postgres and MongoDB sources")
+    parser.add_argument("--tables", nargs="*", choices=list(extract_postgres.TABLES_CONFIG),
+                        help="Postgres tables to poll (default: all configured)")
+    parser.add_argument("--no-mongo", action="store_true", help="do not poll the MongoDB users collection")
+    parser.add_argument("--mongo-mode", choices=["snapshot", "changestream"], default=MONGO_MODE)
+    parser.add_argument("--diff-strategy", choices=extract_mongo.DIFF_STRATEGIES,
+                        default=extract_mongo.DIFF_STRATEGY)
+    parser.add_argument("--batch-size", type=int, default=extract_postgres.CHUNK_SIZE,
+                        help="max Postgres rows per committed micro-batch")
+    parser.add_argument("--change-batch-size", type=int, default=extract_mongo.CHANGE_BATCH_SIZE,
+                        help="max Mongo change events per committed micro-batch")
+    parser.add_argument("--snapshot-workers", type=int, default=extract_mongo.SNAPSHOT_WORKERS,
+                        help="read Mongo snapshots on this many parallel Uid-range cursors")
+    parser.add_argument("--max-batch-seconds", type=float, default=MAX_BATCH_SECONDS,
+                        help="stop draining a source after this long and commit")
+    parser.add_argument("--min-interval", type=float, default=MIN_INTERVAL)
+    parser.add_argument("--max-interval", type=float, default=MAX_INTERVAL)
+    parser.add_argument("--backoff", type=float, default=BACKOFF)
+    args = parser.parse_args()
+
+    daemon = CdcDaemon(
+        tables=args.tables,
+        mongo=not args.no_mongo,
+        mongo_mode=args.mongo_mode,
+        diff_strategy=args.diff_strategy,
+        chunk_size=args.batch_size,
+        change_batch_size=args.change_batch_size,
+        max_batch_seconds=args.max_batch_seconds,
+        min_interval=args.min_interval,
+        max_interval=args.max_interval,
+        backoff=args.backoff,
+        snapshot_workers=args.snapshot_workers,
+    )
+    signal.signal(signal.SIGINT, daemon.request_stop)
+    signal.signal(signal.SIGTERM, daemon.request_stop)
+    daemon.run()
@@ -1,20 +1,51 @@
 """
 MongoDB to Aiven Postgres CDC (Users)
 -------------------------------------
-Syncs users from MongoDB Atlas to analytics.raw_users on Aiven Postgres
-using hash-based change detection.
+Syncs users from MongoDB Atlas to analytics.raw_users on Aiven Postgres.
+
+Two modes are available:
+  snapshot     - read the whole collection and use hash-based change detection,
+                 with one of the DIFF_STRATEGIES below
+  changestream - tail inserts, updates, replaces and deletes from a change
+                 stream, resuming from the token stored in cdc_metadata and
+                 falling back to a snapshot when the token has expired
+
+Snapshot diff strategies:
+  memory - load existing hashes into a dict and diff all documents at once;
+           does not detect users deleted from Mongo
+  stream - merge-join a Uid-sorted Mongo cursor against a uid-sorted
+           server-side cursor over raw_users in constant memory; also flags
+           users that no longer exist in Mongo
+  warehouse - COPY (uid, hash) pairs into a temp table and let Postgres
+              return only new, changed and missing uids; only those
+              documents are re-read from Mongo and upserted
+
+Every snapshot reads the collection in Uid ranges cut at split points from
+a $sample, each on its own cursor in a pool of SNAPSHOT_WORKERS threads.
+Ranges are handed to the diff in Uid order, at most SNAPSHOT_WORKERS ahead
+of it. Documents whose Uid is not a string (or is missing) are read as one
+extra range ahead of all the string ranges.
 """
 
 import os
-import json
-import hashlib
+import argparse
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from bson import json_util
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import OperationFailure
 import psycopg2
 from psycopg2.extras import execute_values
 
+import instrumentation
+import hash_cache
+import parquet_sink
+from hashing import ALGORITHMS, CHANGED, REHASH, HASH_ALGORITHM, HASH_FULL_DOCUMENT, HASH_WORKERS, RecordHasher
+from loader import copy_rows, copy_upsert
+
 load_dotenv()
 
 logging.basicConfig(
@@ -23,6 +54,56 @@ logging.basicConfig(
 )
 logger = logging.getLogger("mongodb_cdc")
 
+METADATA_NAME = "mongodb_users"
+CDC_MODE = os.getenv("MONGO_CDC_MODE", "snapshot")
+CHANGE_BATCH_SIZE = int(os.getenv("MONGO_CHANGE_BATCH_SIZE", "1000"))
+DIFF_STRATEGY = os.getenv("MONGO_DIFF_STRATEGY", "memory")
+DIFF_STRATEGIES = ("memory", "stream", "warehouse")
+SNAPSHOT_BATCH_SIZE = int(os.getenv("MONGO_SNAPSHOT_BATCH_SIZE", "5000"))
+# Largest fraction of live raw_users rows one snapshot may mark deleted; an
+# empty or truncated read beyond it is logged and its deletes are skipped.
+MAX_DELETE_FRACTION = float(os.getenv("MONGO_MAX_DELETE_FRACTION", "0.5"))
+# Parallel snapshot cursors, and the target number of documents per Uid range.
+SNAPSHOT_WORKERS = int(os.getenv("MONGO_SNAPSHOT_WORKERS", "4"))
+SNAPSHOT_RANGE_SIZE = int(os.getenv("MONGO_SNAPSHOT_RANGE_SIZE", "100000"))
+# Sampled Uids per range when choosing split points.
+SPLIT_OVERSAMPLE = 10
+# Range standing for every document whose Uid is not a string (or is missing).
+NON_STRING_UIDS = ("non-string", "non-string")
+
+# Document fields loaded into analytics.raw_users; _id is returned as well.
+MAPPED_FIELDS = ["Uid", "firstName", "lastName", "occupation", "state"]
+USER_PROJECTION = {field: 1 for field in MAPPED_FIELDS}
+
+# Live rows whose stored hash covers the whole document (legacy MD5 or "-full");
+# matches the partial index ix_raw_users_full_document_hash.
+FULL_DOCUMENT_HASH_SQL = """
+    deleted_at IS NULL
+    AND source_id IS NOT NULL
+    AND (record_hash NOT LIKE '%:%' OR record_hash LIKE '%-full:%')
+"""
+
+# Server error codes meaning the stored resume token can no longer be used.
+RESUME_TOKEN_LOST_CODES = {
+    260,  # InvalidResumeToken
+    280,  # ChangeStreamFatalError
+    286,  # ChangeStreamHistoryLost
+}
+
+RAW_USER_TYPES = {
+    "uid": "text",
+    "first_name": "text",
+    "last_name": "text",
+    "occupation": "text",
+    "state": "text",
+    "record_hash": "text",
+    "extracted_at": "timestamp with time zone",
+    "updated_at": "timestamp with time zone",
+    "source_id": "text",
+    "deleted_at": "timestamp with time zone",
+}
+RAW_USER_COLUMNS = list(RAW_USER_TYPES)
+
 
 def get_mongo_client():
     """Return a MongoDB client using environment variables."""
@@ -32,6 +113,12 @@ def get_mongo_client():
     return MongoClient(uri)
 
 
+def get_users_collection(client):
+    """Return the users collection configured in the environment."""
+    db = client[os.getenv("MONGO_DB", "nomba_users")]
+    return db[os.getenv("MONGO_COLLECTION", "nomba")]
+
+
 def get_pg_connection():
     """Connect to Aiven Postgres."""
     return psycopg2.connect(
@@ -44,129 +131,907 @@ def get_pg_connection():
     )
 
 
-def calculate_record_hash(document: dict) -> str:
-    """Return MD5 hash of document excluding _id."""
-    doc_copy = {k: v for k, v in document.items() if k != "_id"}
-    doc_string = json.dumps(doc_copy, sort_keys=True, default=str)
-    return hashlib.md5(doc_string.encode()).hexdigest()
+def project_user(doc: dict) -> dict:
+    """Reduce a full document to _id and MAPPED_FIELDS, as USER_PROJECTION does."""
+    return {k: v for k, v in doc.items() if k == "_id" or k in USER_PROJECTION}
+
+
+def full_document_hashes_remain(conn) -> bool:
+    """True while live raw_users rows still hold hashes of the whole document.
+
+    Legacy untagged MD5s and "-full" hashes can only be verified against
+    the full document, not the projected one.
+    """
+    with instrumentation.stage("extract"), conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT EXISTS (
+                SELECT 1 FROM analytics.raw_users
+                WHERE {FULL_DOCUMENT_HASH_SQL}
+            )
+            """
+        )
+        return cur.fetchone()[0]
+
+
+def user_projection(hasher: RecordHasher, conn=None):
+    """Return the Mongo projection to read; None reads whole documents.
+
+    Full-document hashing needs every field. So does comparing against
+    stored full-document hashes, checked on conn when it is given, until
+    they have all been rewritten in the current format.
+    """
+    if hasher.full_document:
+        return None
+    if conn is not None and full_document_hashes_remain(conn):
+        logger.info("Stored full-document hashes remain; reading whole user documents to verify them")
+        return None
+    return USER_PROJECTION
+
+
+def user_row(doc: dict, record_hash: str, now: datetime) -> tuple:
+    """Map a Mongo user document onto RAW_USER_COLUMNS; uid is the Uid as text."""
+    uid = doc.get("Uid")
+    return (
+        None if uid is None else str(uid),
+        doc.get("firstName"),
+        doc.get("lastName"),
+        doc.get("occupation"),
+        doc.get("state"),
+        record_hash,
+        now,
+        now,
+        str(doc["_id"]),
+        None,
+    )
+
+
+def land_users(rows: list, ops, watermark: str):
+    """Write loaded user rows to the Parquet landing zone, if enabled."""
+    parquet_sink.land(METADATA_NAME, RAW_USER_TYPES, RAW_USER_COLUMNS, rows, ops, watermark)
+
+
+def land_deletes(keys: list, key_column: str, watermark: str):
+    """Write deleted user keys to the Parquet landing zone, if enabled."""
+    rows = [(key,) for key in keys]
+    parquet_sink.land(METADATA_NAME, RAW_USER_TYPES, [key_column], rows, "delete", watermark)
+
+
+def snapshot_watermark() -> str:
+    """Watermark for snapshot diffs, which have no source position."""
+    return f"snapshot:{datetime.utcnow().isoformat()}"
 
 
 def fetch_existing_hashes(conn) -> dict:
-    """Return {uid: record_hash} from analytics.raw_users."""
-    with conn.cursor() as cur:
-        cur.execute("SELECT uid, record_hash FROM analytics.raw_users")
+    """Return {uid: record_hash} from analytics.raw_users.
+
+    Soft-deleted rows report no hash, so a user back in Mongo is restored.
+    """
+    with instrumentation.stage("extract"), conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT uid,
+                   CASE WHEN deleted_at IS NULL THEN record_hash END
+            FROM analytics.raw_users
+            """
+        )
         rows = cur.fetchall()
     return {row[0]: row[1] for row in rows}
 
 
-def fetch_mongo_users():
+def snapshot_ranges(coll, range_size: int = SNAPSHOT_RANGE_SIZE) -> list:
+    """Cut the collection into [lo, hi) Uid ranges of about range_size documents.
+
+    Split points are evenly spaced Uids from a $sample; None is unbounded.
+    String bounds only match string Uids, so the first range is
+    NON_STRING_UIDS, which reads every document whose Uid is not a string.
+    """
+    parts = -(-coll.estimated_document_count() // range_size)
+    if parts <= 1:
+        return [NON_STRING_UIDS, (None, None)]
+
+    sample = coll.aggregate([
+        {"$sample": {"size": parts * SPLIT_OVERSAMPLE}},
+        {"$project": {"_id": 0, "Uid": 1}},
+    ])
+    uids = sorted({doc["Uid"] for doc in sample if isinstance(doc.get("Uid"), str)})
+    points = sorted({uids[i * len(uids) // parts] for i in range(1, parts)}) if uids else []
+    edges = [None, *points, None]
+    return [NON_STRING_UIDS, *zip(edges, edges[1:])]
+
+
+def read_range_cursor(coll, lo, hi, projection=USER_PROJECTION, batch_size: int = SNAPSHOT_BATCH_SIZE,
+                      ordered: bool = False):
+    """Return a cursor over the documents with a string Uid in [lo, hi).
+
+    (lo, hi) == NON_STRING_UIDS selects the documents whose Uid is not a
+    string instead.
+    """
+    if (lo, hi) == NON_STRING_UIDS:
+        condition = {"$not": {"$type": "string"}}
+    else:
+        condition = {"$type": "string"}
+        if lo is not None:
+            condition["$gte"] = lo
+        if hi is not None:
+            condition["$lt"] = hi
+    cursor = coll.find({"Uid": condition}, projection).batch_size(batch_size)
+    if ordered:
+        cursor = cursor.sort("Uid", ASCENDING).allow_disk_use(True)
+    return cursor
+
+
+def read_range(coll, lo, hi, projection=USER_PROJECTION, batch_size: int = SNAPSHOT_BATCH_SIZE,
+               ordered: bool = False) -> list:
+    """Read one range of read_range_cursor() on a cursor of its own."""
+    return list(read_range_cursor(coll, lo, hi, projection, batch_size, ordered))
+
+
+def iter_snapshot(coll, projection=USER_PROJECTION, batch_size: int = SNAPSHOT_BATCH_SIZE,
+                  ordered: bool = False, workers: int = None):
+    """Yield every document, reading Uid ranges on parallel cursors.
+
+    Ranges come back in Uid order (sorted within each range when ordered)
+    with at most workers ranges in flight, which bounds memory to about
+    workers * SNAPSHOT_RANGE_SIZE documents. workers defaults to
+    SNAPSHOT_WORKERS; 1 reads the collection on a single cursor.
+    """
+    workers = SNAPSHOT_WORKERS if workers is None else workers
+    ranges = snapshot_ranges(coll) if workers > 1 else [NON_STRING_UIDS, (None, None)]
+    if len(ranges) == 2:
+        for bounds in ranges:
+            yield from read_range_cursor(coll, *bounds, projection, batch_size, ordered)
+        return
+
+    logger.info("Reading snapshot in %d Uid ranges on %d cursors", len(ranges), workers)
+    remaining = iter(ranges)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mongo-snapshot") as executor:
+        in_flight = deque()
+
+        def submit():
+            bounds = next(remaining, None)
+            if bounds is not None:
+                in_flight.append(executor.submit(read_range, coll, *bounds, projection, batch_size, ordered))
+
+        for _ in range(workers):
+            submit()
+        while in_flight:
+            docs = in_flight.popleft().result()
+            submit()
+            yield from docs
+
+
+def fetch_mongo_users(coll=None, projection=USER_PROJECTION, workers: int = None):
     """Fetch all users from MongoDB."""
-    client = get_mongo_client()
-    db = client[os.getenv("MONGO_DB", "nomba_users")]
-    coll = db[os.getenv("MONGO_COLLECTION", "nomba")]
-    users = list(coll.find())
-    client.close()
+    client = None
+    if coll is None:
+        client = get_mongo_client()
+        coll = get_users_collection(client)
+    with instrumentation.stage("extract"):
+        users = list(iter_snapshot(coll, projection, workers=workers))
+    if client is not None:
+        client.close()
+    instrumentation.count("rows_extracted", len(users))
     logger.info("Fetched %d users from MongoDB", len(users))
     return users
 
 
-def sync_users():
-    """Insert new, update changed, skip unchanged, and update metadata."""
-    start_time = datetime.now()
-    logger.info("Starting MongoDB to Postgres CDC")
+def load_users(conn, rows) -> int:
+    """Upsert user rows into analytics.raw_users."""
+    return copy_upsert(
+        conn,
+        "analytics.raw_users",
+        RAW_USER_COLUMNS,
+        rows,
+        "uid",
+        update_columns=[c for c in RAW_USER_COLUMNS if c not in ("uid", "extracted_at")],
+    )
 
-    users = fetch_mongo_users()
-    if not users:
-        logger.info("No users found in MongoDB.")
-        return
 
-    conn = get_pg_connection()
-    conn.autocommit = False
+def mark_users_deleted(conn, keys: list, deleted_at: datetime, key_column: str = "source_id") -> int:
+    """Flag raw_users rows whose Mongo documents were deleted.
 
-    try:
-        existing_hashes = fetch_existing_hashes(conn)
-        inserts, updates, unchanged = [], [], 0
+    keys are matched against key_column, either source_id or uid.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            UPDATE analytics.raw_users
+            SET deleted_at = %s,
+                updated_at = %s
+            WHERE {key_column} = ANY(%s)
+              AND deleted_at IS NULL
+            """,
+            (deleted_at, deleted_at, keys),
+        )
+        return cur.rowcount
 
-        for doc in users:
-            uid = doc.get("Uid")
-            if not uid:
-                continue
-            current_hash = calculate_record_hash(doc)
-            first_name = doc.get("firstName")
-            last_name = doc.get("lastName")
-            occupation = doc.get("occupation")
-            state = doc.get("state")
-
-            if uid not in existing_hashes:
-                inserts.append(
-                    (uid, first_name, last_name, occupation, state,
-                     current_hash, datetime.utcnow(), datetime.utcnow())
-                )
-            elif existing_hashes[uid] != current_hash:
-                updates.append(
-                    (uid, first_name, last_name, occupation, state,
-                     current_hash, datetime.utcnow(), datetime.utcnow())
-                )
-            else:
-                unchanged += 1
 
-        with conn.cursor() as cur:
-            if inserts or updates:
-                all_records = inserts + updates
-                logger.info("Upserting %d users into analytics.raw_users", len(all_records))
+def update_metadata(conn, record_count: int, status: str = "success", resume_token=None, rows_loaded: int = None):
+    """Update analytics.cdc_metadata for the Mongo users source.
+
+    rows_loaded defaults to record_count; snapshots pass the rows they
+    actually wrote, since record_count is every user read.
+    """
+    if rows_loaded is None:
+        rows_loaded = record_count
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE analytics.cdc_metadata
+            SET last_extracted_timestamp = %s,
+                last_extraction_status = %s,
+                records_extracted = %s,
+                last_loaded_at = CASE WHEN %s > 0 THEN now() ELSE last_loaded_at END,
+                rows_last_run = %s,
+                max_lag_seconds = COALESCE(%s, max_lag_seconds),
+                resume_token = COALESCE(%s, resume_token),
+                updated_at = %s
+            WHERE source_name = %s
+            """,
+            (
+                datetime.utcnow(),
+                status,
+                record_count,
+                rows_loaded,
+                rows_loaded,
+                instrumentation.max_lag(),
+                json_util.dumps(resume_token) if resume_token is not None else None,
+                datetime.utcnow(),
+                METADATA_NAME,
+            ),
+        )
+
+
+def backfill_source_ids(conn, coll, batch_size: int = SNAPSHOT_BATCH_SIZE) -> int:
+    """Fill in source_id on raw_users rows loaded before the column existed.
+
+    Only the Mongo _id is written; record_hash and updated_at are left
+    alone, so the rows are neither rewritten nor re-versioned downstream.
+    This is a one-time migration: the pass is recorded in
+    cdc_metadata.source_ids_backfilled_at and later runs skip it. Rows with
+    no matching Mongo document keep a NULL source_id; the stream and
+    warehouse diffs soft-delete them by uid.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT source_ids_backfilled_at FROM analytics.cdc_metadata WHERE source_name = %s",
+            (METADATA_NAME,),
+        )
+        row = cur.fetchone()
+    if row is None or row[0] is not None:
+        return 0
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT uid FROM analytics.raw_users WHERE source_id IS NULL AND deleted_at IS NULL")
+        missing = [row[0] for row in cur.fetchall()]
+
+    filled = 0
+    if missing:
+        logger.info("Backfilling the Mongo _id of %d raw_users rows", len(missing))
+        # raw_users.uid is the text of the Uid, so non-string Uids are matched by their text.
+        source_ids = {
+            str(doc["Uid"]): str(doc["_id"])
+            for doc in read_range_cursor(coll, *NON_STRING_UIDS, {"Uid": 1})
+            if doc.get("Uid") is not None
+        }
+        for batch in _batched(missing, batch_size):
+            pairs = [(uid, source_ids[uid]) for uid in batch if uid in source_ids]
+            pairs += [(doc["Uid"], str(doc["_id"])) for doc in coll.find({"Uid": {"$in": batch}}, {"Uid": 1})]
+            if not pairs:
+                continue
+            with conn.cursor() as cur:
                 execute_values(
                     cur,
                     """
-                    INSERT INTO analytics.raw_users (
-                        uid, first_name, last_name, occupation, state,
-                        record_hash, extracted_at, updated_at
-                    )
-                    VALUES %s
-                    ON CONFLICT (uid)
-                    DO UPDATE SET
-                        first_name = EXCLUDED.first_name,
-                        last_name = EXCLUDED.last_name,
-                        occupation = EXCLUDED.occupation,
-                        state = EXCLUDED.state,
-                        record_hash = EXCLUDED.record_hash,
-                        updated_at = EXCLUDED.updated_at;
+                    UPDATE analytics.raw_users r
+                    SET source_id = v.source_id
+                    FROM (VALUES %s) AS v (uid, source_id)
+                    WHERE r.uid = v.uid AND r.source_id IS NULL
                     """,
-                    all_records,
+                    pairs,
                 )
+                filled += cur.rowcount
+        logger.info("Backfilled source_id on %d raw_users rows", filled)
+        if filled < len(missing):
+            logger.warning(
+                "%d raw_users rows have no matching Mongo document and keep no source_id",
+                len(missing) - filled,
+            )
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE analytics.cdc_metadata SET source_ids_backfilled_at = now() WHERE source_name = %s",
+            (METADATA_NAME,),
+        )
+    instrumentation.commit(conn)
+    return filled
+
+
+def rewrite_hashes(conn, pairs: list) -> int:
+    """Rewrite record_hash for unchanged users migrated to the current hash format.
+
+    updated_at is left alone: the user's content did not change.
+    """
+    if not pairs:
+        return 0
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            UPDATE analytics.raw_users r
+            SET record_hash = v.record_hash
+            FROM (VALUES %s) AS v (uid, record_hash)
+            WHERE r.uid = v.uid
+            """,
+            pairs,
+        )
+        return cur.rowcount
+
+
+def record_run(conn, stats):
+    """Append stats to analytics.cdc_run_history without failing the sync."""
+    try:
+        instrumentation.record_run(conn, stats)
+    except psycopg2.Error as exc:
+        conn.rollback()
+        logger.warning("Could not record run history: %s", exc)
+
+
+def get_resume_token(conn):
+    """Return the stored change-stream resume token, or None."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT resume_token FROM analytics.cdc_metadata WHERE source_name = %s",
+            (METADATA_NAME,),
+        )
+        row = cur.fetchone()
+    if row and row[0]:
+        return json_util.loads(row[0])
+    return None
+
+
+_MISSING = object()
+
 
+def diff_in_memory(conn, users: list, hasher: RecordHasher) -> dict:
+    """Upsert new and changed users by comparing against the stored hashes.
+
+    Users deleted from Mongo are not detected; the stream and warehouse
+    diffs and change streams mark them deleted.
+
+    The hashes come from the local hash cache when one is configured,
+    otherwise from a full read of raw_users.
+    """
+    users = [doc for doc in users if doc.get("Uid")]
+    # raw_users.uid is text; non-string Uids are stored in their str() form.
+    uids = [str(doc["Uid"]) for doc in users]
+    cache = hash_cache.get_cache()
+    if cache is not None:
+        cache.refresh(conn)
+        stored_hashes = cache.get_many(uids, default=_MISSING)
+    else:
+        existing_hashes = fetch_existing_hashes(conn)
+        stored_hashes = [existing_hashes.get(uid, _MISSING) for uid in uids]
+    inserts, updates, rehashed, unchanged = [], [], [], 0
+
+    with instrumentation.stage("transform"):
+        for doc, uid, current_hash, stored_hash in zip(users, uids, hasher.hash_many(users), stored_hashes):
+            if stored_hash is _MISSING:
+                inserts.append(user_row(doc, current_hash, datetime.utcnow()))
+                continue
+
+            status = hasher.compare(doc, stored_hash, current_hash)
+            if status == CHANGED:
+                updates.append(user_row(doc, current_hash, datetime.utcnow()))
+            else:
+                unchanged += 1
+                if status == REHASH:
+                    rehashed.append((uid, current_hash))
+
+    if inserts or updates:
+        all_records = inserts + updates
+        logger.info("Upserting %d users into analytics.raw_users", len(all_records))
+        load_users(conn, all_records)
+        watermark = snapshot_watermark()
+        land_users(inserts, "insert", watermark)
+        land_users(updates, "update", watermark)
+    rewrite_hashes(conn, rehashed)
+    if cache is not None:
+        # Hash rewrites leave updated_at alone, so the next refresh would miss them.
+        cache.update(rehashed)
+
+    return {
+        "seen": len(users),
+        "upserted": len(inserts) + len(updates),
+        "unchanged": unchanged,
+        "deleted": 0,
+        "rehashed": len(rehashed),
+    }
+
+
+def iter_mongo_users_sorted(coll, batch_size: int = SNAPSHOT_BATCH_SIZE, projection=USER_PROJECTION,
+                            workers: int = None):
+    """Return a Uid-ordered iterator over the mapped user fields."""
+    return iter_snapshot(coll, projection, batch_size, ordered=True, workers=workers)
+
+
+def fetch_stored_hash(conn, uid: str):
+    """Return the live stored hash for one uid, as iter_existing_hashes_sorted would."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT record_hash
+            FROM analytics.raw_users
+            WHERE uid = %s AND deleted_at IS NULL
+            """,
+            (uid,),
+        )
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def iter_existing_hashes_sorted(conn, batch_size: int = SNAPSHOT_BATCH_SIZE):
+    """Yield (uid, record_hash) for live raw_users rows in uid byte order.
+
+    COLLATE "C" orders like Python str comparison and Mongo's default
+    binary string ordering, which the merge join depends on.
+    """
+    with conn.cursor(name="raw_users_hashes") as cur:
+        cur.itersize = batch_size
+        cur.execute(
+            """
+            SELECT uid, record_hash
+            FROM analytics.raw_users
+            WHERE deleted_at IS NULL
+            ORDER BY uid COLLATE "C"
+            """
+        )
+        yield from cur
+
+
+def _batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def count_live_users(conn) -> int:
+    """Return the number of raw_users rows not marked deleted."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM analytics.raw_users WHERE deleted_at IS NULL")
+        return cur.fetchone()[0]
+
+
+def deletes_allowed(seen: int, missing: int, live: int, max_fraction: float = MAX_DELETE_FRACTION) -> bool:
+    """Return whether a snapshot's missing users may be marked deleted.
+
+    A snapshot that read no users, or would delete more than max_fraction
+    of the live rows, is more likely an empty collection, the wrong
+    MONGO_DB/MONGO_COLLECTION or a broken read than real deletes, so its
+    deletes are skipped with an error.
+    """
+    if not missing:
+        return True
+    if not seen:
+        logger.error("Snapshot read no users; not marking %d raw_users rows deleted", missing)
+        return False
+    if missing > max_fraction * live:
+        logger.error(
+            "Snapshot is missing %d of %d live users (more than MONGO_MAX_DELETE_FRACTION=%s); "
+            "not marking them deleted",
+            missing, live, max_fraction,
+        )
+        return False
+    return True
+
+
+def diff_streaming(conn, read_conn, coll, hasher: RecordHasher, batch_size: int = SNAPSHOT_BATCH_SIZE,
+                   workers: int = None) -> dict:
+    """Merge-join sorted Mongo users against raw_users in bounded memory.
+
+    Upserts are flushed and committed every batch_size rows. Uids present
+    in raw_users but missing from Mongo are marked deleted at the end,
+    unless deletes_allowed() rejects the snapshot; only up to its limit of
+    missing uids is held in memory.
+    """
+    counts = {"seen": 0, "upserted": 0, "unchanged": 0, "deleted": 0, "rehashed": 0}
+    pending, pending_ops, missing, rehashed = [], [], [], []
+    non_string = set()
+    watermark = snapshot_watermark()
+    live = count_live_users(read_conn)
+    missing_count = 0
+
+    def flag_missing(uid):
+        nonlocal missing_count
+        missing_count += 1
+        if missing_count <= MAX_DELETE_FRACTION * live:
+            missing.append(uid)
+
+    def flush(force=False):
+        if pending and (force or len(pending) >= batch_size):
+            counts["upserted"] += load_users(conn, pending)
+            land_users(pending, pending_ops, watermark)
+            pending.clear()
+            pending_ops.clear()
+        if rehashed and (force or len(rehashed) >= batch_size):
+            counts["rehashed"] += rewrite_hashes(conn, rehashed)
+            rehashed.clear()
+        instrumentation.commit(conn)
+
+    existing = instrumentation.timed(iter_existing_hashes_sorted(read_conn, batch_size))
+    current = next(existing, None)
+
+    projection = user_projection(hasher, read_conn)
+    docs = instrumentation.timed(iter_mongo_users_sorted(coll, batch_size, projection, workers))
+    for batch in _batched((doc for doc in docs if doc.get("Uid")), batch_size):
+        instrumentation.count("rows_extracted", len(batch))
+        for doc, current_hash in zip(batch, hasher.hash_many(batch)):
+            uid = doc["Uid"]
+            counts["seen"] += 1
+
+            stored_hash = None
+            if not isinstance(uid, str):
+                # Non-string Uids are read before every string one, so they are
+                # all known before the merge below can flag their rows missing.
+                uid = str(uid)
+                non_string.add(uid)
+                stored_hash = fetch_stored_hash(read_conn, uid)
+            else:
+                while current is not None and current[0] < uid:
+                    if current[0] not in non_string:
+                        flag_missing(current[0])
+                    current = next(existing, None)
+
+                if current is not None and current[0] == uid:
+                    stored_hash = current[1]
+                    current = next(existing, None)
+
+            status = hasher.compare(doc, stored_hash, current_hash)
+            if status == CHANGED:
+                pending.append(user_row(doc, current_hash, datetime.utcnow()))
+                pending_ops.append("update" if stored_hash else "insert")
+            else:
+                counts["unchanged"] += 1
+                if status == REHASH:
+                    rehashed.append((uid, current_hash))
+
+        flush()
+
+    while current is not None:
+        if current[0] not in non_string:
+            flag_missing(current[0])
+        current = next(existing, None)
+
+    flush(force=True)
+    if deletes_allowed(counts["seen"], missing_count, live):
+        for batch in _batched(missing, batch_size):
+            counts["deleted"] += mark_users_deleted(conn, batch, datetime.utcnow(), key_column="uid")
+            land_deletes(batch, "uid", watermark)
+            instrumentation.commit(conn)
+    read_conn.rollback()
+    return counts
+
+
+def diff_in_warehouse(conn, coll, hasher: RecordHasher, batch_size: int = SNAPSHOT_BATCH_SIZE,
+                      workers: int = None) -> dict:
+    """Compare Mongo hashes with raw_users inside Postgres.
+
+    Runs in the caller's transaction; the temp hash table is dropped on
+    commit. Live uids missing from the snapshot are marked deleted unless
+    deletes_allowed() rejects it. Uids are staged as text, so the original
+    value of each non-string Uid is kept to re-read its document.
+    """
+    counts = {"seen": 0, "upserted": 0, "unchanged": 0, "deleted": 0, "rehashed": 0}
+    non_string = {}
+    projection = user_projection(hasher)
+    # Only the changed users are compared, so only they need whole documents.
+    compare_projection = user_projection(hasher, conn)
+    watermark = snapshot_watermark()
+    landing = parquet_sink.get_sink() is not None
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE _mongo_user_hashes (
+                uid TEXT,
+                record_hash TEXT
+            ) ON COMMIT DROP
+            """
+        )
+
+        docs = instrumentation.timed(iter_snapshot(coll, projection, batch_size, workers=workers))
+        for batch in _batched((doc for doc in docs if doc.get("Uid")), batch_size):
+            instrumentation.count("rows_extracted", len(batch))
+            uids = [str(doc["Uid"]) for doc in batch]
+            non_string.update(
+                (uid, doc["Uid"]) for uid, doc in zip(uids, batch) if not isinstance(doc["Uid"], str)
+            )
+            pairs = zip(uids, hasher.hash_many(batch))
+            counts["seen"] += copy_rows(cur, "_mongo_user_hashes", ["uid", "record_hash"], pairs)[0]
+
+        cur.execute("ANALYZE _mongo_user_hashes")
+        cur.execute(
+            """
+            SELECT
+                count(*),
+                count(*) FILTER (
+                    WHERE NOT EXISTS (SELECT 1 FROM _mongo_user_hashes m WHERE m.uid = r.uid)
+                )
+            FROM analytics.raw_users r
+            WHERE r.deleted_at IS NULL
+            """
+        )
+        live, missing = cur.fetchone()
+        if deletes_allowed(counts["seen"], missing, live):
+            now = datetime.utcnow()
             cur.execute(
                 """
-                UPDATE analytics.cdc_metadata
-                SET last_extracted_timestamp = %s,
-                    last_extraction_status = %s,
-                    records_extracted = %s,
+                UPDATE analytics.raw_users r
+                SET deleted_at = %s,
                     updated_at = %s
-                WHERE source_name = %s
-                """,
-                (
-                    datetime.utcnow(),
-                    "success",
-                    len(users),
-                    datetime.utcnow(),
-                    "mongodb_users",
-                ),
+                WHERE r.deleted_at IS NULL
+                  AND NOT EXISTS (SELECT 1 FROM _mongo_user_hashes m WHERE m.uid = r.uid)
+                """ + ("RETURNING r.uid" if landing else ""),
+                (now, now),
             )
+            counts["deleted"] = cur.rowcount
+            if landing:
+                land_deletes([row[0] for row in cur.fetchall()], "uid", watermark)
 
-        conn.commit()
-        elapsed = (datetime.now() - start_time).total_seconds()
-        logger.info(
-            "CDC complete: %d inserted/updated, %d unchanged in %.2fs",
-            len(inserts) + len(updates),
-            unchanged,
-            elapsed,
+    # Staged users the changed-uid query does not return are unchanged.
+    counts["unchanged"] = counts["seen"]
+    with conn.cursor(name="changed_user_uids") as changed_cur:
+        changed_cur.itersize = batch_size
+        changed_cur.execute(
+            """
+            SELECT m.uid, r.record_hash
+            FROM _mongo_user_hashes m
+            LEFT JOIN analytics.raw_users r
+                ON r.uid = m.uid
+               AND r.deleted_at IS NULL
+            WHERE r.record_hash IS DISTINCT FROM m.record_hash
+            """
         )
-    except Exception as exc:
+        while True:
+            with instrumentation.stage("extract"):
+                stored = dict(changed_cur.fetchmany(batch_size))
+            if not stored:
+                break
+            counts["unchanged"] -= len(stored)
+            now = datetime.utcnow()
+            rows, ops, rehashed = [], [], []
+            keys = [non_string.get(uid, uid) for uid in stored]
+            changed_docs = instrumentation.timed(coll.find({"Uid": {"$in": keys}}, compare_projection))
+            with instrumentation.stage("transform"):
+                for doc in changed_docs:
+                    uid = str(doc["Uid"])
+                    current_hash = hasher(doc)
+                    status = hasher.compare(doc, stored.get(uid), current_hash)
+                    if status == CHANGED:
+                        rows.append(user_row(doc, current_hash, now))
+                        ops.append("update" if stored.get(uid) else "insert")
+                        continue
+                    counts["unchanged"] += 1
+                    if status == REHASH:
+                        rehashed.append((uid, current_hash))
+            if rows:
+                counts["upserted"] += load_users(conn, rows)
+                land_users(rows, ops, watermark)
+            counts["rehashed"] += rewrite_hashes(conn, rehashed)
+
+    return counts
+
+
+def sync_snapshot(conn, coll, hasher: RecordHasher, strategy: str = DIFF_STRATEGY, resume_token=None,
+                  workers: int = None) -> int:
+    """Diff a full snapshot of the collection into raw_users and update metadata.
+
+    workers is the number of parallel snapshot cursors (SNAPSHOT_WORKERS
+    when None).
+    """
+    if strategy == "stream":
+        read_conn = get_pg_connection()
+        try:
+            counts = diff_streaming(conn, read_conn, coll, hasher, workers=workers)
+        finally:
+            read_conn.close()
+    elif strategy == "warehouse":
+        counts = diff_in_warehouse(conn, coll, hasher, workers=workers)
+    else:
+        users = fetch_mongo_users(coll, user_projection(hasher, conn), workers)
+        counts = diff_in_memory(conn, users, hasher)
+
+    update_metadata(conn, counts["seen"], resume_token=resume_token,
+                    rows_loaded=counts["upserted"] + counts["deleted"])
+    instrumentation.commit(conn)
+    logger.info(
+        "Snapshot complete (%s diff): %d inserted/updated, %d unchanged (%d rehashed), %d deleted",
+        strategy,
+        counts["upserted"],
+        counts["unchanged"],
+        counts["rehashed"],
+        counts["deleted"],
+    )
+    return counts["upserted"] + counts["deleted"]
+
+
+def _apply_change_batch(conn, changes: dict, hasher: RecordHasher, resume_token=None) -> int:
+    """Apply the latest (op, document) change per document; returns rows touched."""
+    now = datetime.utcnow()
+    rows, ops, deleted = [], [], []
+    with instrumentation.stage("transform"):
+        for source_id, (op, doc) in changes.items():
+            if doc is None:
+                deleted.append(source_id)
+            elif doc.get("Uid"):
+                if not hasher.full_document:
+                    doc = project_user(doc)
+                rows.append(user_row(doc, hasher(doc), now))
+                ops.append("insert" if op == "insert" else "update")
+
+    touched = 0
+    watermark = json_util.dumps(resume_token)
+    if rows:
+        touched += load_users(conn, rows)
+        land_users(rows, ops, watermark)
+    if deleted:
+        touched += mark_users_deleted(conn, deleted, now)
+        land_deletes(deleted, "source_id", watermark)
+    return touched
+
+
+def sync_changes(conn, coll, resume_token, hasher: RecordHasher, batch_size: int = CHANGE_BATCH_SIZE,
+                 stop_when=None) -> int:
+    """Drain the change stream from resume_token, committing each batch.
+
+    stop_when, if given, is checked after every change; returning True
+    flushes the pending batch and ends the run. Raises OperationFailure with
+    a RESUME_TOKEN_LOST_CODES code when the token is no longer in the oplog.
+    """
+    processed = 0
+    changes = {}
+    with coll.watch(
+        full_document="updateLookup",
+        resume_after=resume_token,
+        batch_size=batch_size,
+    ) as stream:
+        while stream.alive:
+            with instrumentation.stage("extract"):
+                change = stream.try_next()
+            if change is not None:
+                instrumentation.count("rows_extracted")
+                if change.get("clusterTime"):
+                    instrumentation.observe_lag(change["clusterTime"].as_datetime())
+                op = change["operationType"]
+                source_id = str(change["documentKey"]["_id"])
+                if op == "delete":
+                    changes[source_id] = (op, None)
+                elif op in ("insert", "update", "replace") and change.get("fullDocument"):
+                    changes[source_id] = (op, change["fullDocument"])
+                elif op == "invalidate":
+                    raise OperationFailure("Change stream invalidated", code=280)
+
+            stopping = stop_when is not None and stop_when()
+            if changes and (change is None or stopping or len(changes) >= batch_size):
+                processed += _apply_change_batch(conn, changes, hasher, stream.resume_token)
+                changes = {}
+                update_metadata(conn, processed, status="running", resume_token=stream.resume_token)
+                instrumentation.commit(conn)
+
+            if change is None or stopping:
+                break
+
+        update_metadata(conn, processed, resume_token=stream.resume_token)
+        instrumentation.commit(conn)
+
+    logger.info("Applied %d user changes from change stream", processed)
+    return processed
+
+
+def sync_snapshot_with_token(conn, coll, hasher: RecordHasher, strategy: str = DIFF_STRATEGY,
+                             workers: int = None) -> int:
+    """Take a full snapshot and store a resume token opened just before it.
+
+    Changes made while the snapshot is read are replayed by the next
+    change-stream run; applying them twice is idempotent.
+    """
+    with coll.watch(full_document="updateLookup") as stream:
+        stream.try_next()
+        resume_token = stream.resume_token
+
+    return sync_snapshot(conn, coll, hasher, strategy, resume_token=resume_token, workers=workers)
+
+
+def run_sync(conn, coll, mode: str, strategy: str, hasher: RecordHasher,
+             batch_size: int = CHANGE_BATCH_SIZE, stop_when=None, snapshot_workers: int = None) -> int:
+    """Run one sync on open connections; returns rows inserted, updated or deleted."""
+    backfill_source_ids(conn, coll)
+    if mode != "changestream":
+        return sync_snapshot(conn, coll, hasher, strategy, workers=snapshot_workers)
+
+    resume_token = get_resume_token(conn)
+    if resume_token is None:
+        logger.info("No resume token stored; taking initial snapshot.")
+        return sync_snapshot_with_token(conn, coll, hasher, strategy, snapshot_workers)
+    try:
+        return sync_changes(conn, coll, resume_token, hasher, batch_size, stop_when)
+    except OperationFailure as exc:
+        if exc.code not in RESUME_TOKEN_LOST_CODES:
+            raise
         conn.rollback()
+        logger.warning("Resume token expired (%s); falling back to snapshot.", exc)
+        return sync_snapshot_with_token(conn, coll, hasher, strategy, snapshot_workers)
+
+
+def sync_users(mode: str = CDC_MODE, strategy: str = DIFF_STRATEGY, hasher: RecordHasher = None,
+               snapshot_workers: int = None):
+    """Sync MongoDB users into analytics.raw_users using the given mode."""
+    start_time = datetime.now()
+    logger.info("Starting MongoDB to Postgres CDC (%s mode)", mode)
+
+    hasher = hasher or RecordHasher()
+    client = conn = None
+
+    try:
+        with instrumentation.track_run(METADATA_NAME, "mongodb") as stats:
+            with instrumentation.stage("connect"):
+                client = get_mongo_client()
+                client.admin.command("ping")
+                coll = get_users_collection(client)
+                conn = get_pg_connection()
+                conn.autocommit = False
+
+            processed = run_sync(conn, coll, mode, strategy, hasher, snapshot_workers=snapshot_workers)
+
+        elapsed = (datetime.now() - start_time).total_seconds()
+        logger.info("CDC complete: %d inserted/updated in %.2fs", processed, elapsed)
+        return processed
+    except Exception as exc:
+        if conn is not None:
+            conn.rollback()
         logger.error("MongoDB CDC failed: %s", exc, exc_info=True)
         raise
     finally:
-        conn.close()
+        instrumentation.log_run(stats)
+        instrumentation.export_metrics("mongodb", [stats])
+        if conn is not None:
+            record_run(conn, stats)
+            conn.close()
+        if client is not None:
+            client.close()
+        hasher.close()
 
 
 if __name__ == "__main__":
-    sync_users()
+    parser = argparse.ArgumentParser(description="MongoDB users to analytics CDC")
+    parser.add_argument("--mode", choices=["snapshot", "changestream"], default=CDC_MODE)
+    parser.add_argument("--diff-strategy", choices=DIFF_STRATEGIES, default=DIFF_STRATEGY)
+    parser.add_argument("--hash-algorithm", choices=ALGORITHMS, default=HASH_ALGORITHM)
+    parser.add_argument("--hash-full-document", action="store_true", default=HASH_FULL_DOCUMENT,
+                        help="hash every document field instead of only the loaded ones")
+    parser.add_argument("--hash-workers", type=int, default=HASH_WORKERS,
+                        help="hash snapshot batches in a process pool of this size")
+    parser.add_argument("--snapshot-workers", type=int, default=SNAPSHOT_WORKERS,
+                        help="read snapshots on this many parallel Uid-range cursors")
+    parser.add_argument("--parquet-dir", default=parquet_sink.PARQUET_DIR,
+                        help="also land each change batch as Parquet under this path or URI")
+    parser.add_argument("--hash-cache", default=hash_cache.CACHE_PATH,
+                        help="keep stored hashes for the memory diff in this local file")
+    parser.add_argument("--rebuild-hash-cache", action="store_true",
+                        help="reload the whole hash cache from raw_users before diffing")
+    args = parser.parse_args()
+
+    parquet_sink.configure(args.parquet_dir)
+    hash_cache.configure(args.hash_cache, args.rebuild_hash_cache)
+    sync_users(
+        args.mode,
+        args.diff_strategy,
+        RecordHasher(args.hash_algorithm, args.hash_full_document, args.hash_workers),
+        args.snapshot_workers,
+    )
@@ -3,14 +3,35 @@ Aiven Postgres to Analytics Schema CDC
 --------------------------------------
 Reads changes from public tables and upserts them into analytics schema
 using updated_at and deleted_at as CDC signals.
+
+Changes are read in keyset-paginated pages ordered by (change_ts, primary
+key), where change_ts is the later of updated_at and deleted_at. Each page is
+upserted and committed together with the exact (change_ts, key) of its last
+row, so an interrupted backfill resumes from the last committed page.
+
+Pages are fetched whole on a plain cursor, so memory is bounded by the
+chunk size rather than by the backlog. They replace an earlier single
+named (server-side) cursor over the whole change set: each LIMIT page is
+a short index range scan, and no source snapshot is held open across a
+long backfill.
 """
 
 import os
+import time
+import queue
+import argparse
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 import psycopg2
-from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+import instrumentation
+import parquet_sink
+from loader import copy_upsert
+from logical_replication import IDLE_TIMEOUT, ensure_publication, open_stream, sync_logical_table
 
 load_dotenv()
 
@@ -20,10 +41,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger("postgres_cdc")
 
+CHUNK_SIZE = int(os.getenv("CDC_CHUNK_SIZE", "10000"))
+MAX_PARALLELISM = int(os.getenv("CDC_MAX_PARALLELISM", "4"))
+# Pages buffered between the reader and writer of a pipelined table run;
+# 0 runs extraction and loading sequentially.
+PIPELINE_DEPTH = int(os.getenv("CDC_PIPELINE_DEPTH", "0"))
+PARTITION_MONTHS_AHEAD = int(os.getenv("CDC_PARTITION_MONTHS_AHEAD", "3"))
 
-def get_connection():
-    """Connect to Aiven Postgres."""
-    return psycopg2.connect(
+
+def connection_kwargs() -> dict:
+    """Return Aiven Postgres connection settings from the environment."""
+    return dict(
         host=os.getenv("PG_HOST"),
         port=os.getenv("PG_PORT"),
         dbname=os.getenv("PG_DB"),
@@ -33,28 +61,58 @@ def get_connection():
     )
 
 
+def get_connection():
+    """Connect to Aiven Postgres."""
+    return psycopg2.connect(**connection_kwargs())
+
+
+def create_pool(max_parallelism: int = MAX_PARALLELISM, persistent: bool = False) -> ThreadedConnectionPool:
+    """Return a bounded connection pool sized for max_parallelism tables.
+
+    Each running table holds one source and one target connection. psycopg2
+    closes returned connections beyond minconn, so persistent pools keep
+    every connection open between runs.
+    """
+    maxconn = 2 * max_parallelism
+    return ThreadedConnectionPool(maxconn if persistent else 1, maxconn, **connection_kwargs())
+
+
+# "engine" selects how changes are captured:
+#   "polling" - keyset scans over updated_at / deleted_at (default)
+#   "logical" - a pgoutput replication slot; also needs "slot_name" and
+#               "publication", and captures hard deletes
+# Targets partitioned by month set "partition_column" and a "conflict_key"
+# of the primary key plus that column (see analytics.ensure_monthly_partitions).
 TABLES_CONFIG = {
     "savings_plan": {
         "source_table": "public.savings_plan",
         "target_table": "analytics.raw_savings_plan",
         "primary_key": "plan_id",
         "metadata_name": "postgres_savings_plan",
+        "engine": "polling",
     },
     "savingstransaction": {
         "source_table": "public.savingstransaction",
         "target_table": "analytics.raw_savingstransaction",
         "primary_key": "txn_id",
         "metadata_name": "postgres_savingstransaction",
+        "engine": "polling",
+        "conflict_key": ["txn_id", "txn_timestamp"],
+        "partition_column": "txn_timestamp",
     },
 }
 
 
-def get_last_extraction_ts(conn, metadata_name: str) -> datetime:
-    """Get last_extracted_timestamp from analytics.cdc_metadata."""
+def get_watermark(conn, metadata_name: str):
+    """Return the (change_ts, primary_key) cursor from analytics.cdc_metadata.
+
+    The key is None for sources that have only a timestamp watermark, in
+    which case extraction resumes strictly after that timestamp.
+    """
     with conn.cursor() as cur:
         cur.execute(
             """
-            SELECT last_extracted_timestamp
+            SELECT last_extracted_timestamp, last_extracted_key
             FROM analytics.cdc_metadata
             WHERE source_name = %s
             """,
@@ -63,119 +121,504 @@ def get_last_extraction_ts(conn, metadata_name: str) -> datetime:
         row = cur.fetchone()
 
     if row and row[0]:
-        logger.info("Last extraction for %s: %s", metadata_name, row[0])
-        return row[0]
+        logger.info("Last extraction for %s: %s (key %s)", metadata_name, row[0], row[1])
+        return row[0], row[1]
 
     logger.info("No previous extraction for %s. Starting from epoch.", metadata_name)
-    return datetime(1970, 1, 1)
-
-
-def extract_changes(conn, source_table: str, last_ts: datetime):
-    """Extract rows changed since last_ts based on updated_at or deleted_at."""
-    query = f"""
-        SELECT *
-        FROM {source_table}
-        WHERE
-            (updated_at IS NOT NULL AND updated_at > %s)
-            OR
-            (deleted_at IS NOT NULL AND deleted_at > %s)
-        ORDER BY COALESCE(updated_at, deleted_at)
+    return datetime(1970, 1, 1), None
+
+
+def build_change_query(source_table: str, primary_key: str, with_key: bool) -> str:
+    """Build one keyset page of the change stream.
+
+    Each branch is a range scan over a (change column, primary key) index:
+    rows whose latest change is an update come from updated_at, rows whose
+    latest change is a delete come from deleted_at. Together they order
+    every changed row exactly once by (GREATEST(updated_at, deleted_at), pk).
     """
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(query, (last_ts, last_ts))
-        rows = cur.fetchall()
+    pk = primary_key
 
-    logger.info("Extracted %d changed rows from %s", len(rows), source_table)
-    return rows
+    def after(col):
+        if with_key:
+            return f"(s.{col}, s.{pk}) > (%(ts)s, %(key)s)"
+        return f"s.{col} > %(ts)s"
 
+    return f"""
+        SELECT * FROM (
+            (
+                SELECT s.*, s.updated_at AS _change_ts
+                FROM {source_table} s
+                WHERE {after("updated_at")}
+                  AND (s.deleted_at IS NULL OR s.deleted_at <= s.updated_at)
+                ORDER BY s.updated_at, s.{pk}
+                LIMIT %(limit)s
+            )
+            UNION ALL
+            (
+                SELECT s.*, s.deleted_at AS _change_ts
+                FROM {source_table} s
+                WHERE s.deleted_at IS NOT NULL
+                  AND {after("deleted_at")}
+                  AND (s.updated_at IS NULL OR s.updated_at < s.deleted_at)
+                ORDER BY s.deleted_at, s.{pk}
+                LIMIT %(limit)s
+            )
+        ) changes
+        ORDER BY _change_ts, {pk}
+        LIMIT %(limit)s
+    """
 
-def upsert_into_raw(conn, target_table: str, primary_key: str, records: list):
-    """Upsert changed records into analytics raw tables."""
-    if not records:
-        return 0
 
-    columns = list(records[0].keys())
-    columns_str = ", ".join(columns + ["extracted_at"])
-    pk = primary_key
+def iter_changes(conn, cfg: dict, watermark: tuple, chunk_size: int = CHUNK_SIZE):
+    """Yield (columns, rows, watermark) pages of rows changed after watermark.
 
-    update_cols = [c for c in columns if c != pk]
-    update_str = ", ".join([f"{c} = EXCLUDED.{c}" for c in update_cols] + ["extracted_at = EXCLUDED.extracted_at"])
+    Rows are tuples ordered like columns; the trailing _change_ts column is
+    not included in columns. watermark is the (change_ts, pk) of the last
+    row in the page, which is where the next page starts.
+    """
+    pk = cfg["primary_key"]
+    ts, key = watermark
+    while True:
+        query = build_change_query(cfg["source_table"], pk, key is not None)
+        with instrumentation.stage("extract"), conn.cursor() as cur:
+            cur.execute(query, {"ts": ts, "key": key, "limit": chunk_size})
+            columns = [d.name for d in cur.description][:-1]
+            rows = cur.fetchall()
+
+        if not rows:
+            return
+
+        instrumentation.count("rows_extracted", len(rows))
+
+        last = rows[-1]
+        ts, key = last[-1], str(last[columns.index(pk)])
+        logger.info("Extracted page of %d changed rows from %s", len(rows), cfg["source_table"])
+        yield columns, rows, (ts, key)
+
+        if len(rows) < chunk_size:
+            return
+
+
+def upsert_kwargs(cfg: dict) -> dict:
+    """copy_upsert key and partition arguments for a TABLES_CONFIG entry."""
+    return dict(
+        key_columns=cfg.get("conflict_key", cfg["primary_key"]),
+        identity_columns=cfg["primary_key"],
+        partition_column=cfg.get("partition_column"),
+        partition_months_ahead=PARTITION_MONTHS_AHEAD,
+    )
 
-    values = []
+
+def upsert_into_raw(conn, cfg: dict, columns: list, rows: list):
+    """Upsert changed records into analytics raw tables.
+
+    rows may carry trailing extraction-only columns beyond columns; they are
+    dropped before loading.
+    """
+    if not rows:
+        return 0
+
+    width = len(columns)
     now = datetime.utcnow()
-    for r in records:
-        row_values = [r.get(c) for c in columns]
-        row_values.append(now)
-        values.append(tuple(row_values))
-
-    insert_sql = f"""
-        INSERT INTO {target_table} ({columns_str})
-        VALUES %s
-        ON CONFLICT ({pk})
-        DO UPDATE SET {update_str}
+    values = (tuple(r[:width]) + (now,) for r in rows)
+
+    count = copy_upsert(conn, cfg["target_table"], columns + ["extracted_at"], values, **upsert_kwargs(cfg))
+    if len(rows[0]) > width:
+        # Pages are ordered by their trailing change timestamp: the first row is the oldest.
+        instrumentation.observe_lag(rows[0][-1])
+    logger.info("Upserted %d rows into %s", count, cfg["target_table"])
+    return count
+
+
+def polled_ops(columns: list, rows: list) -> list:
+    """Classify polled rows for the landing zone.
+
+    Rows whose change came from deleted_at are deletes. Without a history
+    of the row, an insert is only recognisable where created_at equals
+    updated_at; tables without created_at report "upsert".
     """
-    with conn.cursor() as cur:
-        execute_values(cur, insert_sql, values)
+    deleted_at = columns.index("deleted_at") if "deleted_at" in columns else None
+    created_at = columns.index("created_at") if "created_at" in columns else None
+    updated_at = columns.index("updated_at")
+
+    ops = []
+    for r in rows:
+        if deleted_at is not None and r[deleted_at] is not None and r[-1] == r[deleted_at]:
+            ops.append("delete")
+        elif created_at is None:
+            ops.append("upsert")
+        else:
+            ops.append("insert" if r[created_at] == r[updated_at] else "update")
+    return ops
+
+
+def land_page(conn, cfg: dict, columns: list, rows: list, watermark: tuple):
+    """Write a polled page to the Parquet landing zone, if enabled."""
+    if parquet_sink.get_sink() is None:
+        return
+    width = len(columns)
+    parquet_sink.land(
+        cfg["metadata_name"],
+        parquet_sink.column_types(conn, cfg["target_table"]),
+        columns,
+        [r[:width] for r in rows],
+        polled_ops(columns, rows),
+        f"{watermark[0].isoformat()},{watermark[1]}",
+    )
 
-    logger.info("Upserted %d rows into %s", len(records), target_table)
-    return len(records)
 
+def update_metadata(conn, metadata_name: str, record_count: int, watermark: tuple, status: str = "success"):
+    """Update analytics.cdc_metadata with job stats and the exact source watermark.
 
-def update_metadata(conn, metadata_name: str, record_count: int):
-    """Update analytics.cdc_metadata with job stats."""
+    Also maintains the freshness columns read by monitoring: last load time,
+    rows loaded in this run and the run's largest source-to-warehouse lag.
+    """
+    watermark_ts, watermark_key = watermark
     with conn.cursor() as cur:
         cur.execute(
             """
             UPDATE analytics.cdc_metadata
             SET last_extracted_timestamp = %s,
+                last_extracted_key = %s,
                 last_extraction_status = %s,
                 records_extracted = %s,
+                last_loaded_at = CASE WHEN %s > 0 THEN now() ELSE last_loaded_at END,
+                rows_last_run = %s,
+                max_lag_seconds = COALESCE(%s, max_lag_seconds),
                 updated_at = %s
             WHERE source_name = %s
             """,
             (
-                datetime.utcnow(),
-                "success",
+                watermark_ts,
+                watermark_key,
+                status,
                 record_count,
+                record_count,
+                record_count,
+                instrumentation.max_lag(),
                 datetime.utcnow(),
                 metadata_name,
             ),
         )
 
 
-def run_postgres_cdc():
-    """Run Postgres CDC for configured tables."""
-    start = datetime.now()
-    logger.info("Starting Postgres CDC job")
+def sync_table(source_conn, target_conn, name: str, cfg: dict, chunk_size: int = CHUNK_SIZE,
+               stop_when=None) -> int:
+    """Copy one table's changes into the raw layer, committing per page.
+
+    stop_when, if given, is checked after each committed page; returning
+    True ends the run early with the watermark at that page.
+    """
+    logger.info("Processing %s", name)
+
+    watermark = get_watermark(target_conn, cfg["metadata_name"])
+    processed = 0
+    for columns, rows, watermark in iter_changes(source_conn, cfg, watermark, chunk_size):
+        processed += upsert_into_raw(target_conn, cfg, columns, rows)
+        land_page(target_conn, cfg, columns, rows, watermark)
+        update_metadata(target_conn, cfg["metadata_name"], processed, watermark, status="running")
+        instrumentation.commit(target_conn)
+        if stop_when is not None and stop_when():
+            break
+
+    update_metadata(target_conn, cfg["metadata_name"], processed, watermark)
+    instrumentation.commit(target_conn)
+    return processed
+
 
-    conn = get_connection()
-    conn.autocommit = False
+_PAGES_DONE = object()
 
+
+def _put_page(pages: queue.Queue, item, cancelled: threading.Event) -> bool:
+    """Block until item is queued or the writer has gone away."""
+    while not cancelled.is_set():
+        try:
+            pages.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_pages(source_conn, cfg: dict, watermark: tuple, chunk_size: int,
+                pages: queue.Queue, cancelled: threading.Event):
+    """Reader stage of a pipelined run: queue pages, then a done marker or the error."""
     try:
-        total_processed = 0
-        for name, cfg in TABLES_CONFIG.items():
-            logger.info("Processing %s", name)
-
-            last_ts = get_last_extraction_ts(conn, cfg["metadata_name"])
-            changed = extract_changes(conn, cfg["source_table"], last_ts)
-            count = upsert_into_raw(conn, cfg["target_table"], cfg["primary_key"], changed)
-            update_metadata(conn, cfg["metadata_name"], count)
-            total_processed += count
-
-        conn.commit()
-        elapsed = (datetime.now() - start).total_seconds()
-        logger.info(
-            "Postgres CDC complete. Total rows processed: %d in %.2fs",
-            total_processed,
-            elapsed,
-        )
+        for page in iter_changes(source_conn, cfg, watermark, chunk_size):
+            if not _put_page(pages, page, cancelled):
+                return
+        last = _PAGES_DONE
     except Exception as exc:
-        conn.rollback()
-        logger.error("Postgres CDC failed: %s", exc, exc_info=True)
-        raise
+        last = exc
+    _put_page(pages, last, cancelled)
+
+
+def sync_table_pipelined(source_conn, target_conn, name: str, cfg: dict, chunk_size: int = CHUNK_SIZE,
+                         depth: int = PIPELINE_DEPTH, stop_when=None) -> int:
+    """Like sync_table, but reads the next page while the current one loads.
+
+    A reader thread runs the keyset scan on source_conn and hands pages to
+    this thread through a queue holding at most depth pages, so the reader
+    blocks when loading falls behind. Pages are still loaded and committed
+    in order with their own watermark. Time spent waiting on the queue is
+    reported as the extract stage.
+    """
+    logger.info("Processing %s (pipelined, depth %d)", name, depth)
+
+    watermark = get_watermark(target_conn, cfg["metadata_name"])
+    pages = queue.Queue(maxsize=max(depth, 1))
+    cancelled = threading.Event()
+    reader = threading.Thread(
+        target=_read_pages,
+        args=(source_conn, cfg, watermark, chunk_size, pages, cancelled),
+        name=f"{threading.current_thread().name}-reader",
+        daemon=True,
+    )
+    reader.start()
+
+    processed = 0
+    try:
+        while True:
+            with instrumentation.stage("extract"):
+                item = pages.get()
+            if item is _PAGES_DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            columns, rows, watermark = item
+            instrumentation.count("rows_extracted", len(rows))
+            processed += upsert_into_raw(target_conn, cfg, columns, rows)
+            land_page(target_conn, cfg, columns, rows, watermark)
+            update_metadata(target_conn, cfg["metadata_name"], processed, watermark, status="running")
+            instrumentation.commit(target_conn)
+            if stop_when is not None and stop_when():
+                break
     finally:
-        conn.close()
+        cancelled.set()
+        reader.join()
+
+    update_metadata(target_conn, cfg["metadata_name"], processed, watermark)
+    instrumentation.commit(target_conn)
+    return processed
+
+
+def ensure_indexes(conn, cfg: dict) -> bool:
+    """Create the source indexes the change query relies on and check its plan.
+
+    conn must be in autocommit mode for CREATE INDEX CONCURRENTLY. Returns
+    False if EXPLAIN still reports a sequential scan on the source table.
+    """
+    source_table = cfg["source_table"]
+    pk = cfg["primary_key"]
+    base = source_table.split(".")[-1]
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{base}_updated_at_{pk} "
+            f"ON {source_table} (updated_at, {pk})"
+        )
+        cur.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{base}_deleted_at_{pk} "
+            f"ON {source_table} (deleted_at, {pk}) WHERE deleted_at IS NOT NULL"
+        )
+        cur.execute(f"ANALYZE {source_table}")
+
+        cur.execute(
+            "EXPLAIN " + build_change_query(source_table, pk, with_key=False),
+            {"ts": datetime.utcnow(), "limit": CHUNK_SIZE},
+        )
+        plan = "\n".join(row[0] for row in cur.fetchall())
+
+    if "Seq Scan" in plan:
+        logger.warning("Change query on %s still plans a sequential scan:\n%s", source_table, plan)
+        return False
+
+    logger.info("Change query on %s is index-backed", source_table)
+    return True
+
+
+def mark_failed(conn, metadata_name: str):
+    """Record a failed run in analytics.cdc_metadata, keeping the watermark."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE analytics.cdc_metadata
+            SET last_extraction_status = %s,
+                updated_at = %s
+            WHERE source_name = %s
+            """,
+            ("failed", datetime.utcnow(), metadata_name),
+        )
+    conn.commit()
+
+
+def record_run(conn, stats):
+    """Append stats to analytics.cdc_run_history without failing the sync."""
+    try:
+        instrumentation.record_run(conn, stats)
+    except psycopg2.Error as exc:
+        if not conn.closed:
+            conn.rollback()
+        logger.warning("Could not record run history for %s: %s", stats.source_name, exc)
+
+
+def run_table(pool, name: str, cfg: dict, chunk_size: int = CHUNK_SIZE, stop_when=None,
+              record_idle: bool = True, pipeline_depth: int = PIPELINE_DEPTH, streams: dict = None,
+              idle_timeout: float = IDLE_TIMEOUT) -> dict:
+    """Sync one table on its own pooled connections and return its run summary.
+
+    Failures, including failing to get a connection, are reported in the
+    summary rather than raised, so one table cannot abort the others.
+
+    Polling tables are pipelined when pipeline_depth > 0. With
+    record_idle=False, successful runs that moved no rows are left out of
+    analytics.cdc_run_history and the log.
+
+    Logical tables open a replication stream per run and wait idle_timeout
+    seconds for changes. Callers that poll repeatedly pass a streams dict
+    instead: the table's stream is kept there between runs and only closed
+    when a run fails.
+    """
+    started = time.perf_counter()
+    summary = {"table": name, "rows": 0, "status": "success", "error": None}
+    source_conn = target_conn = None
+
+    with instrumentation.track_run(cfg["metadata_name"], "postgres") as stats:
+        try:
+            with instrumentation.stage("connect"):
+                source_conn = pool.getconn()
+                target_conn = pool.getconn()
+            # Every keyset page is its own short read; no long-lived source snapshot.
+            source_conn.autocommit = True
+            target_conn.autocommit = False
+
+            if cfg.get("engine", "polling") == "logical":
+                stream = streams.get(name) if streams is not None else None
+                if stream is None or stream.closed:
+                    ensure_publication(source_conn, cfg)
+                    with instrumentation.stage("connect"):
+                        stream = open_stream(target_conn, cfg, **connection_kwargs())
+                keep = False
+                try:
+                    summary["rows"] = sync_logical_table(
+                        stream, target_conn, name, cfg, idle_timeout=idle_timeout, stop_when=stop_when,
+                        partition_months_ahead=PARTITION_MONTHS_AHEAD,
+                    )
+                    keep = streams is not None
+                finally:
+                    if keep:
+                        streams[name] = stream
+                    else:
+                        if streams is not None:
+                            streams.pop(name, None)
+                        stream.close()
+            elif pipeline_depth > 0:
+                summary["rows"] = sync_table_pipelined(
+                    source_conn, target_conn, name, cfg, chunk_size, pipeline_depth, stop_when
+                )
+            else:
+                summary["rows"] = sync_table(source_conn, target_conn, name, cfg, chunk_size, stop_when)
+        except Exception as exc:
+            logger.error("CDC for %s failed: %s", name, exc, exc_info=True)
+            summary.update(status="failed", error=str(exc))
+            stats.fail(exc)
+            if target_conn is not None and not target_conn.closed:
+                try:
+                    target_conn.rollback()
+                    mark_failed(target_conn, cfg["metadata_name"])
+                except psycopg2.Error as mark_exc:
+                    logger.warning("Could not mark %s failed: %s", name, mark_exc)
+                    if not target_conn.closed:
+                        target_conn.rollback()
+
+    idle = stats.status == "success" and not summary["rows"]
+    try:
+        if (record_idle or not idle) and target_conn is not None and not target_conn.closed:
+            record_run(target_conn, stats)
+    finally:
+        # A failed run may have left its connections broken; the pool opens new ones.
+        failed = stats.status == "failed"
+        for conn in (source_conn, target_conn):
+            if conn is not None:
+                pool.putconn(conn, close=failed or bool(conn.closed))
+
+    if record_idle or not idle:
+        instrumentation.log_run(stats)
+    summary["seconds"] = time.perf_counter() - started
+    summary["stats"] = stats
+    return summary
+
+
+def run_postgres_cdc(chunk_size: int = CHUNK_SIZE, max_parallelism: int = MAX_PARALLELISM,
+                     pipeline_depth: int = PIPELINE_DEPTH):
+    """Run Postgres CDC for configured tables, up to max_parallelism at a time.
+
+    Each table commits independently, so one failing table does not roll
+    back the others. Raises RuntimeError after the summary if any failed.
+    """
+    start = datetime.now()
+    logger.info("Starting Postgres CDC job (max parallelism %d)", max_parallelism)
+
+    pool = create_pool(max_parallelism)
+    try:
+        with ThreadPoolExecutor(max_workers=max_parallelism, thread_name_prefix="cdc") as executor:
+            futures = [
+                executor.submit(run_table, pool, name, cfg, chunk_size, pipeline_depth=pipeline_depth)
+                for name, cfg in TABLES_CONFIG.items()
+            ]
+            summaries = [f.result() for f in futures]
+    finally:
+        pool.closeall()
+
+    for summary in summaries:
+        logger.info(
+            "%-24s %-8s %10d rows %8.2fs",
+            summary["table"],
+            summary["status"],
+            summary["rows"],
+            summary["seconds"],
+        )
+
+    instrumentation.export_metrics("postgres", [s["stats"] for s in summaries])
+
+    total_processed = sum(s["rows"] for s in summaries)
+    elapsed = (datetime.now() - start).total_seconds()
+    logger.info(
+        "Postgres CDC complete. Total rows processed: %d in %.2fs",
+        total_processed,
+        elapsed,
+    )
+
+    failed = [s["table"] for s in summaries if s["status"] == "failed"]
+    if failed:
+        raise RuntimeError(f"Postgres CDC failed for: {', '.join(failed)}")
+    return summaries
 
 
 if __name__ == "__main__":
-    run_postgres_cdc()
+    parser = argparse.ArgumentParser(description="Aiven Postgres to analytics CDC")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--max-parallelism", type=int, default=MAX_PARALLELISM)
+    parser.add_argument("--parquet-dir", default=parquet_sink.PARQUET_DIR,
+                        help="also land each change page as Parquet under this path or URI")
+    parser.add_argument("--pipeline-depth", type=int, default=PIPELINE_DEPTH,
+                        help="read ahead this many pages while loading (0 = sequential)")
+    parser.add_argument(
+        "--ensure-indexes",
+        action="store_true",
+        help="create the source indexes used by the change query and verify its plan first",
+    )
+    args = parser.parse_args()
+
+    if args.ensure_indexes:
+        index_conn = get_connection()
+        index_conn.autocommit = True
+        try:
+            for table_cfg in TABLES_CONFIG.values():
+                ensure_indexes(index_conn, table_cfg)
+        finally:
+            index_conn.close()
+
+    parquet_sink.configure(args.parquet_dir)
+    run_postgres_cdc(args.chunk_size, args.max_parallelism, args.pipeline_depth)
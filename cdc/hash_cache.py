@@ -0,0 +1,331 @@
+"""
+User Hash Cache
+---------------
+Local, memory-mapped copy of (uid, record_hash) from analytics.raw_users
+for the in-memory Mongo diff. With it a run re-reads only the raw_users
+rows changed since the previous run, not every stored hash, and holds no
+Python objects per cached user.
+
+The file is a fixed header followed by one fixed-width record per uid,
+sorted by the uid's UTF-8 bytes (the order of uid COLLATE "C"):
+
+    uid, NUL-padded to the header's width | format code (1 byte) | digest (16 bytes)
+
+The format code stands for the hash tag ("blake2b", "md5-full", ...). Two
+codes are special: the untagged legacy MD5, and "no usable hash", which
+always compares as changed. Lookups bisect the mapped uid column with
+numpy.searchsorted.
+
+The header keeps the newest COALESCE(updated_at, extracted_at) read from
+raw_users. Each refresh re-reads the rows after that watermark, minus an
+overlap for transactions that committed late. Known uids are updated in
+place; new uids are merged into a rewritten file. Hash rewrites do not
+touch updated_at, so the Mongo job writes them through with update().
+
+Soft-deleted users are cached without a hash, so a user who reappears in
+Mongo is rewritten. A missing or unreadable file, a different warehouse,
+a change to the cached query or a format change triggers a full rebuild.
+So does configure(rebuild=True), e.g. after rows were deleted outright
+from raw_users; the CDC jobs only soft-delete. One process at a time
+should use a cache file.
+"""
+
+import os
+import struct
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import instrumentation
+
+logger = logging.getLogger("mongodb_cdc")
+
+CACHE_PATH = os.getenv("MONGO_HASH_CACHE")
+OVERLAP_SECONDS = float(os.getenv("MONGO_HASH_CACHE_OVERLAP_SECONDS", "300"))
+FETCH_SIZE = 50000
+
+MAGIC = b"NHC1"
+VERSION = 1
+# magic, version, uid width, record count, warehouse fingerprint, watermark (ISO 8601)
+HEADER = struct.Struct("<4sHHQ16s32s")
+DIGEST_SIZE = 16
+
+# Format codes: 0 is "no usable hash", 1 the untagged legacy MD5.
+TAGS = (None, "", "md5", "md5-full", "blake2b", "blake2b-full", "xxh3", "xxh3-full")
+TAG_CODES = {tag: code for code, tag in enumerate(TAGS) if tag is not None}
+
+# Matches fetch_existing_hashes: soft-deleted rows have no usable hash.
+_HASH_SQL = "CASE WHEN deleted_at IS NULL THEN record_hash END"
+_CHANGE_TS_SQL = "COALESCE(updated_at, extracted_at)"
+
+_cache = None
+_configured = False
+_cache_lock = threading.Lock()
+
+
+def record_dtype(width: int) -> np.dtype:
+    return np.dtype([("uid", f"S{width}"), ("code", "u1"), ("digest", "u1", (DIGEST_SIZE,))])
+
+
+def encode_hash(stored_hash) -> tuple:
+    """Return (format code, 16-byte digest) for a stored record_hash."""
+    if stored_hash:
+        tag, sep, digest = stored_hash.partition(":")
+        if not sep:
+            tag, digest = "", stored_hash
+        if tag in TAG_CODES and len(digest) == 2 * DIGEST_SIZE:
+            try:
+                return TAG_CODES[tag], bytes.fromhex(digest)
+            except ValueError:
+                pass
+    return 0, bytes(DIGEST_SIZE)
+
+
+def decode_hash(code: int, digest) -> str:
+    """Inverse of encode_hash; None for code 0."""
+    tag = TAGS[code]
+    if tag is None:
+        return None
+    hex_digest = bytes(digest).hex()
+    return f"{tag}:{hex_digest}" if tag else hex_digest
+
+
+def warehouse_fingerprint() -> str:
+    """Identify the warehouse raw_users lives in, from the connection settings."""
+    return f"{os.getenv('PG_HOST')}:{os.getenv('PG_PORT')}/{os.getenv('PG_DB')}"
+
+
+def _records(pairs, width: int) -> np.ndarray:
+    """Build a record array from (uid, stored_hash) pairs."""
+    records = np.zeros(len(pairs), dtype=record_dtype(width))
+    if pairs:
+        encoded = [encode_hash(h) for _, h in pairs]
+        records["uid"] = [uid.encode() for uid, _ in pairs]
+        records["code"] = [code for code, _ in encoded]
+        records["digest"] = np.frombuffer(b"".join(d for _, d in encoded), "u1").reshape(-1, DIGEST_SIZE)
+    return records
+
+
+class HashCache:
+    """Sorted, memory-mapped (uid -> record_hash) cache of analytics.raw_users.
+
+    With rebuild, the first refresh reloads every hash.
+    """
+
+    def __init__(self, path: str, fingerprint: str = None, overlap_seconds: float = OVERLAP_SECONDS,
+                 rebuild: bool = False):
+        self.path = path
+        # The cached query is part of the fingerprint, so changing it rebuilds old files.
+        identity = f"{fingerprint or warehouse_fingerprint()}|{_HASH_SQL}"
+        self.fingerprint = hashlib.md5(identity.encode()).digest()
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.pending_rebuild = rebuild
+        self.width = 0
+        self.watermark = None
+        self.records = np.zeros(0, dtype=record_dtype(1))
+
+    def __len__(self):
+        return len(self.records)
+
+    def _load(self) -> bool:
+        """Map an existing cache file; False when it is missing or unusable."""
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+        except OSError:
+            return False
+        if len(header) < HEADER.size:
+            return False
+        magic, version, width, count, fingerprint, watermark = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or fingerprint != self.fingerprint:
+            logger.info("Hash cache %s is stale or from another warehouse; rebuilding", self.path)
+            return False
+        if os.path.getsize(self.path) != HEADER.size + count * record_dtype(width).itemsize:
+            logger.warning("Hash cache %s is truncated; rebuilding", self.path)
+            return False
+
+        self.width = width
+        watermark = watermark.rstrip(b"\0").decode()
+        self.watermark = datetime.fromisoformat(watermark) if watermark else None
+        self.records = self._map(count)
+        return True
+
+    def _map(self, count: int):
+        if not count:
+            return np.zeros(0, dtype=record_dtype(self.width))
+        return np.memmap(self.path, dtype=record_dtype(self.width), mode="r+", offset=HEADER.size, shape=(count,))
+
+    def _header(self, count: int) -> bytes:
+        watermark = self.watermark.isoformat().encode() if self.watermark else b""
+        return HEADER.pack(MAGIC, VERSION, self.width, count, self.fingerprint, watermark)
+
+    def _write_header(self):
+        with open(self.path, "r+b") as f:
+            f.write(self._header(len(self.records)))
+
+    def _replace(self, write_records):
+        """Write a new cache file through write_records(f), which returns the record count."""
+        self.records = np.zeros(0, dtype=record_dtype(self.width))
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(self._header(0))
+            count = write_records(f)
+            f.seek(0)
+            f.write(self._header(count))
+        os.replace(tmp, self.path)
+        self.records = self._map(count)
+
+    def rebuild(self, conn) -> int:
+        """Reload every stored hash from raw_users; returns rows read."""
+        with instrumentation.stage("extract"), conn.cursor() as cur:
+            cur.execute(
+                f"SELECT COALESCE(MAX(octet_length(uid)), 1), MAX({_CHANGE_TS_SQL}) FROM analytics.raw_users"
+            )
+            self.width, self.watermark = cur.fetchone()
+
+        # uids inserted while streaming can be wider than the width read above.
+        wider = []
+
+        def write_records(f):
+            written = 0
+            with conn.cursor(name="raw_users_hash_cache") as cur:
+                cur.itersize = FETCH_SIZE
+                cur.execute(f'SELECT uid, {_HASH_SQL} FROM analytics.raw_users ORDER BY uid COLLATE "C"')
+                while True:
+                    with instrumentation.stage("extract"):
+                        rows = cur.fetchmany(FETCH_SIZE)
+                    if not rows:
+                        return written
+                    fitting = [row for row in rows if len(row[0].encode()) <= self.width]
+                    wider.extend(row for row in rows if len(row[0].encode()) > self.width)
+                    _records(fitting, self.width).tofile(f)
+                    written += len(fitting)
+
+        self._replace(write_records)
+        if wider:
+            self.update(wider)
+        logger.info("Rebuilt hash cache %s with %d users", self.path, len(self.records))
+        return len(self.records)
+
+    def refresh(self, conn, rebuild: bool = False) -> int:
+        """Bring the cache up to date with raw_users; returns rows read."""
+        rebuild, self.pending_rebuild = rebuild or self.pending_rebuild, False
+        if rebuild or not self._load():
+            return self.rebuild(conn)
+
+        since = self.watermark - self.overlap if self.watermark else datetime(1970, 1, 1)
+        with instrumentation.stage("extract"), conn.cursor() as cur:
+            cur.execute(
+                f"SELECT uid, {_HASH_SQL}, {_CHANGE_TS_SQL} FROM analytics.raw_users WHERE {_CHANGE_TS_SQL} > %s",
+                (since,),
+            )
+            rows = cur.fetchall()
+
+        if rows:
+            newest = max(row[2] for row in rows)
+            self.watermark = newest if self.watermark is None else max(self.watermark, newest)
+        self.update([row[:2] for row in rows])
+        logger.info("Refreshed hash cache %s: %d users changed since %s", self.path, len(rows), since)
+        return len(rows)
+
+    def _positions(self, keys: np.ndarray) -> tuple:
+        """Return (index, found) arrays for uid keys of the cache's uid dtype."""
+        if not len(self.records):
+            return np.zeros(len(keys), dtype=np.intp), np.zeros(len(keys), dtype=bool)
+        column = self.records["uid"]
+        index = np.searchsorted(column, keys)
+        return index, column[np.minimum(index, len(column) - 1)] == keys
+
+    def _lookup(self, uids: list) -> tuple:
+        """Like _positions, for str uids; uids wider than the cache are not found."""
+        encoded = [uid.encode() for uid in uids]
+        fits = np.array([len(key) <= self.width for key in encoded], dtype=bool)
+        keys = np.array([key if ok else b"" for key, ok in zip(encoded, fits)], dtype=self.records.dtype["uid"])
+        index, found = self._positions(keys)
+        return index, found & fits
+
+    def get_many(self, uids: list, default=None) -> list:
+        """Return the stored hash for each uid, or default when it is not cached."""
+        result = [default] * len(uids)
+        if not uids or not len(self.records):
+            return result
+        index, found = self._lookup(uids)
+        hits = np.flatnonzero(found)
+        for i, record in zip(hits, self.records[index[hits]]):
+            result[i] = decode_hash(int(record["code"]), record["digest"])
+        return result
+
+    def get(self, uid: str, default=None):
+        return self.get_many([uid], default)[0]
+
+    def update(self, pairs):
+        """Set (uid, stored_hash) pairs: in place for cached uids, by merge for new ones."""
+        pairs = dict(pairs)
+        if pairs and len(self.records):
+            uids = list(pairs)
+            index, found = self._lookup(uids)
+            hits = np.flatnonzero(found)
+            if len(hits):
+                updates = _records([(uids[i], pairs[uids[i]]) for i in hits], self.width)
+                self.records["code"][index[hits]] = updates["code"]
+                self.records["digest"][index[hits]] = updates["digest"]
+                self.records.flush()
+                for i in hits:
+                    del pairs[uids[i]]
+
+        if pairs:
+            self._merge(sorted(pairs.items(), key=lambda item: item[0].encode()))
+        self._write_header()
+
+    def _merge(self, new_pairs: list):
+        """Rewrite the file with new uids merged in order, widening uids if needed."""
+        old = self.records
+        width = max(self.width, max(len(uid.encode()) for uid, _ in new_pairs))
+        dtype = record_dtype(width)
+        new = _records(new_pairs, width)
+        if len(old):
+            column = old["uid"] if width == self.width else old["uid"].astype(dtype["uid"])
+            positions = np.searchsorted(column, new["uid"])
+        else:
+            positions = np.zeros(len(new), dtype=np.intp)
+        # new is sorted, so uids inserted at the same position are adjacent.
+        starts = np.r_[0, np.flatnonzero(np.diff(positions)) + 1]
+        ends = np.r_[starts[1:], len(new)]
+
+        def write_records(f):
+            copied = 0
+            for start, end in zip(starts, ends):
+                position = positions[start]
+                old[copied:position].astype(dtype).tofile(f)
+                new[start:end].tofile(f)
+                copied = position
+            old[copied:].astype(dtype).tofile(f)
+            return len(old) + len(new)
+
+        self.width = width
+        self._replace(write_records)
+
+    def close(self):
+        if isinstance(self.records, np.memmap):
+            self.records.flush()
+        self.records = np.zeros(0, dtype=record_dtype(max(self.width, 1)))
+
+
+def configure(path: str = None, rebuild: bool = False):
+    """Enable the cache at path, or disable it when path is empty."""
+    global _cache, _configured
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = HashCache(path, rebuild=rebuild) if path else None
+        _configured = True
+
+
+def get_cache():
+    """Return the configured cache, or None. Without configure() it follows MONGO_HASH_CACHE."""
+    if not _configured:
+        configure(CACHE_PATH)
+    return _cache
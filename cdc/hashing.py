@@ -0,0 +1,143 @@
+"""
+Record Hashing
+--------------
+Canonical change-detection hashes for Mongo user documents.
+
+Hashes are stored as "<algorithm>:<hex digest>", or "<algorithm>-full:<hex>"
+when the whole document (minus _id) is hashed. Untagged 32-character values
+are the legacy MD5 of the JSON-serialised document written by earlier
+versions of the job. A stored hash in another format is verified with its
+own algorithm, so switching algorithms does not register every user as
+changed; matching rows are simply rewritten in the new format.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import instrumentation
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+logger = logging.getLogger("mongodb_cdc")
+
+# Document fields that feed analytics.raw_users, in canonical order.
+HASH_FIELDS = ("firstName", "lastName", "occupation", "state")
+
+HASH_ALGORITHM = os.getenv("CDC_HASH_ALGORITHM", "blake2b")
+HASH_FULL_DOCUMENT = os.getenv("CDC_HASH_FULL_DOCUMENT", "false").lower() == "true"
+HASH_WORKERS = int(os.getenv("CDC_HASH_WORKERS", "0"))
+ALGORITHMS = ("md5", "blake2b", "xxh3")
+
+UNCHANGED, CHANGED, REHASH = "unchanged", "changed", "rehash"
+
+_NULL = "\x00"
+_SEP = "\x1f"
+
+
+def legacy_record_hash(document: dict) -> str:
+    """Return MD5 hash of document excluding _id (pre-tagging format)."""
+    doc_copy = {k: v for k, v in document.items() if k != "_id"}
+    doc_string = json.dumps(doc_copy, sort_keys=True, default=str)
+    return hashlib.md5(doc_string.encode()).hexdigest()
+
+
+def _digest(algorithm: str, data: bytes) -> str:
+    if algorithm == "blake2b":
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+    if algorithm == "xxh3":
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.md5(data).hexdigest()
+
+
+def _payload(document: dict, full_document: bool) -> bytes:
+    if full_document:
+        doc_copy = {k: v for k, v in document.items() if k != "_id"}
+        return json.dumps(doc_copy, sort_keys=True, default=str, separators=(",", ":")).encode()
+    return _SEP.join(
+        _NULL if document.get(field) is None else str(document.get(field))
+        for field in HASH_FIELDS
+    ).encode()
+
+
+def _hash_chunk(args) -> list:
+    """Process-pool entry point: hash a chunk of documents."""
+    algorithm, full_document, prefix, documents = args
+    return [prefix + _digest(algorithm, _payload(doc, full_document)) for doc in documents]
+
+
+class RecordHasher:
+    """Hash user documents with a chosen digest and compare stored hashes."""
+
+    def __init__(self, algorithm: str = HASH_ALGORITHM, full_document: bool = HASH_FULL_DOCUMENT,
+                 workers: int = HASH_WORKERS):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm {algorithm!r}; expected one of {ALGORITHMS}")
+        if algorithm == "xxh3" and xxhash is None:
+            raise ValueError(
+                "CDC_HASH_ALGORITHM=xxh3 requires the xxhash package; pip install -r requirements.txt"
+            )
+        self.algorithm = algorithm
+        self.full_document = full_document
+        self.workers = workers
+        self.prefix = f"{algorithm}{'-full' if full_document else ''}:"
+        self._executor = None
+
+    def __call__(self, document: dict) -> str:
+        return self.prefix + _digest(self.algorithm, _payload(document, self.full_document))
+
+    def hash_many(self, documents: list) -> list:
+        """Hash a batch, spread over the process pool when workers > 1."""
+        with instrumentation.stage("transform"):
+            return self._hash_many(documents)
+
+    def _hash_many(self, documents: list) -> list:
+        if self.workers <= 1 or len(documents) < 2 * self.workers:
+            return [self(doc) for doc in documents]
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        if not self.full_document:
+            # Ship only the hashed fields to the workers.
+            documents = [{f: doc.get(f) for f in HASH_FIELDS} for doc in documents]
+        size = -(-len(documents) // self.workers)
+        chunks = [
+            (self.algorithm, self.full_document, self.prefix, documents[i:i + size])
+            for i in range(0, len(documents), size)
+        ]
+        return [h for chunk in self._executor.map(_hash_chunk, chunks) for h in chunk]
+
+    def compare(self, document: dict, stored_hash, current_hash: str = None) -> str:
+        """Classify stored_hash against document as UNCHANGED, CHANGED or REHASH.
+
+        REHASH means the content is unchanged but stored_hash uses an older
+        format and should be rewritten with current_hash.
+        """
+        if stored_hash is None:
+            return CHANGED
+        if current_hash is None:
+            current_hash = self(document)
+        if stored_hash == current_hash:
+            return UNCHANGED
+        if stored_hash.startswith(self.prefix):
+            return CHANGED
+
+        tag, sep, _ = stored_hash.partition(":")
+        if not sep:
+            previous = legacy_record_hash(document)
+        else:
+            algorithm = tag[:-len("-full")] if tag.endswith("-full") else tag
+            if algorithm not in ALGORITHMS or (algorithm == "xxh3" and xxhash is None):
+                return CHANGED
+            previous = RecordHasher(algorithm, tag.endswith("-full"))(document)
+        return REHASH if previous == stored_hash else CHANGED
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
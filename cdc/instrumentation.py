@@ -0,0 +1,273 @@
+"""
+CDC Run Instrumentation
+-----------------------
+Per-stage timings and row/byte counters for the CDC jobs.
+
+A run is tracked per thread with track_run(); code anywhere below it wraps
+work in stage("connect" | "extract" | "transform" | "load" | "commit") and
+bumps counters with count(). Stage time is exclusive: a stage opened inside
+another (a COPY issued while a lazy source cursor is being drained, say)
+pauses the outer one, so no time is counted twice. Outside a tracked run
+both are no-ops. observe_lag() keeps the run's largest source-to-warehouse
+lag: the age of a loaded change's source timestamp when it was loaded.
+
+Finished runs are appended to analytics.cdc_run_history and, when
+CDC_METRICS_DIR is set, exported as a Prometheus textfile (for the
+node_exporter textfile collector) or as JSON.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger("cdc_metrics")
+
+STAGES = ("connect", "extract", "transform", "load", "commit")
+COUNTERS = ("rows_extracted", "rows_loaded", "bytes_extracted", "bytes_loaded")
+
+METRICS_DIR = os.getenv("CDC_METRICS_DIR")
+METRICS_FORMAT = os.getenv("CDC_METRICS_FORMAT", "prometheus")
+
+_local = threading.local()
+
+
+class RunStats:
+    """Timings and counters for one source's CDC run."""
+
+    def __init__(self, source_name: str, job: str):
+        self.source_name = source_name
+        self.job = job
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.status = "success"
+        self.error = None
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.max_lag_seconds = None
+        self._started = time.perf_counter()
+        self._stack = []
+        self.wall_seconds = 0.0
+
+    def enter(self, name: str):
+        now = time.perf_counter()
+        if self._stack:
+            outer = self._stack[-1]
+            self.seconds[outer[0]] += now - outer[1]
+        self._stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        name, started = self._stack.pop()
+        self.seconds[name] = self.seconds.get(name, 0.0) + now - started
+        if self._stack:
+            self._stack[-1][1] = now
+
+    def fail(self, exc: Exception):
+        self.status = "failed"
+        self.error = str(exc)
+
+    def finish(self):
+        self.finished_at = datetime.now(timezone.utc)
+        self.wall_seconds = time.perf_counter() - self._started
+
+    def as_dict(self) -> dict:
+        return {
+            "source_name": self.source_name,
+            "job": self.job,
+            "status": self.status,
+            "error": self.error,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "stage_seconds": {k: round(v, 3) for k, v in self.seconds.items()},
+            **self.counters,
+            "max_lag_seconds": round(self.max_lag_seconds, 3) if self.max_lag_seconds is not None else None,
+        }
+
+
+def current_run():
+    """Return the RunStats tracked on this thread, or None."""
+    return getattr(_local, "run", None)
+
+
+@contextmanager
+def track_run(source_name: str, job: str):
+    """Track a run on this thread; exceptions mark it failed and propagate."""
+    stats = RunStats(source_name, job)
+    previous = current_run()
+    _local.run = stats
+    try:
+        yield stats
+    except Exception as exc:
+        stats.fail(exc)
+        raise
+    finally:
+        _local.run = previous
+        stats.finish()
+
+
+@contextmanager
+def stage(name: str):
+    """Attribute the enclosed time to stage name of the current run."""
+    stats = current_run()
+    if stats is None:
+        yield
+        return
+    stats.enter(name)
+    try:
+        yield
+    finally:
+        stats.exit()
+
+
+def count(counter: str, amount: int = 1):
+    """Add amount to a counter of the current run."""
+    stats = current_run()
+    if stats is not None:
+        stats.counters[counter] = stats.counters.get(counter, 0) + amount
+
+
+def observe_lag(source_ts: datetime):
+    """Record a change with source timestamp source_ts as loaded now.
+
+    Naive timestamps are taken as UTC.
+    """
+    stats = current_run()
+    if stats is None or source_ts is None:
+        return
+    if source_ts.tzinfo is None:
+        source_ts = source_ts.replace(tzinfo=timezone.utc)
+    lag = max((datetime.now(timezone.utc) - source_ts).total_seconds(), 0.0)
+    if stats.max_lag_seconds is None or lag > stats.max_lag_seconds:
+        stats.max_lag_seconds = lag
+
+
+def max_lag():
+    """Largest lag observed in the current run, or None."""
+    stats = current_run()
+    return stats.max_lag_seconds if stats is not None else None
+
+
+def timed(iterable, name: str = "extract"):
+    """Yield from iterable, attributing the time spent fetching to stage name.
+
+    Used for lazy source cursors, where the fetch happens inside next().
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def commit(conn):
+    """Commit conn inside the commit stage."""
+    with stage("commit"):
+        conn.commit()
+
+
+def record_run(conn, stats: RunStats):
+    """Append a finished run to analytics.cdc_run_history and commit."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO analytics.cdc_run_history (
+                source_name, job, status, error, started_at, finished_at,
+                wall_seconds, connect_seconds, extract_seconds, transform_seconds,
+                load_seconds, commit_seconds, rows_extracted, rows_loaded,
+                bytes_extracted, bytes_loaded, max_lag_seconds
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (
+                stats.source_name,
+                stats.job,
+                stats.status,
+                stats.error,
+                stats.started_at,
+                stats.finished_at,
+                stats.wall_seconds,
+                *(stats.seconds[s] for s in STAGES),
+                *(stats.counters[c] for c in COUNTERS),
+                stats.max_lag_seconds,
+            ),
+        )
+    conn.commit()
+
+
+def _prometheus_text(runs: list) -> str:
+    lines = [
+        "# HELP cdc_stage_seconds Time spent in each CDC stage during the last run.",
+        "# TYPE cdc_stage_seconds gauge",
+    ]
+    for run in runs:
+        for name in STAGES:
+            lines.append(f'cdc_stage_seconds{{source="{run.source_name}",stage="{name}"}} {run.seconds[name]:.6f}')
+
+    gauges = [
+        ("cdc_run_seconds", "Wall time of the last run.", lambda r: f"{r.wall_seconds:.6f}"),
+        ("cdc_run_success", "1 if the last run succeeded, else 0.", lambda r: int(r.status == "success")),
+        ("cdc_run_finished_timestamp_seconds", "Unix time the last run finished.",
+         lambda r: f"{r.finished_at.timestamp():.3f}"),
+    ]
+    gauges += [
+        (f"cdc_{counter}", f"{counter.replace('_', ' ').capitalize()} in the last run.",
+         lambda r, c=counter: r.counters[c])
+        for counter in COUNTERS
+    ]
+    for metric, help_text, value in gauges:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for run in runs:
+            lines.append(f'{metric}{{source="{run.source_name}"}} {value(run)}')
+
+    lagged = [run for run in runs if run.max_lag_seconds is not None]
+    if lagged:
+        lines.append("# HELP cdc_max_lag_seconds Largest source-to-warehouse lag of a change loaded in the last run.")
+        lines.append("# TYPE cdc_max_lag_seconds gauge")
+        for run in lagged:
+            lines.append(f'cdc_max_lag_seconds{{source="{run.source_name}"}} {run.max_lag_seconds:.3f}')
+    return "\n".join(lines) + "\n"
+
+
+def export_metrics(job: str, runs: list, metrics_dir: str = METRICS_DIR, fmt: str = METRICS_FORMAT):
+    """Write the job's runs to <metrics_dir>/cdc_<job>.prom (or .json).
+
+    The file is replaced atomically so a scraper never reads a partial
+    write. Does nothing when metrics_dir is unset.
+    """
+    if not metrics_dir:
+        return None
+
+    if fmt == "json":
+        path = os.path.join(metrics_dir, f"cdc_{job}.json")
+        body = json.dumps([run.as_dict() for run in runs], indent=2)
+    else:
+        path = os.path.join(metrics_dir, f"cdc_{job}.prom")
+        body = _prometheus_text(runs)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(body)
+    os.replace(tmp, path)
+    logger.info("Wrote %s metrics to %s", job, path)
+    return path
+
+
+def log_run(stats: RunStats):
+    """Log a one-line stage breakdown of a finished run."""
+    logger.info(
+        "%s %s in %.2fs: %s | %s",
+        stats.source_name,
+        stats.status,
+        stats.wall_seconds,
+        " ".join(f"{name}={stats.seconds[name]:.2f}s" for name in STAGES),
+        " ".join(f"{name}={stats.counters[name]}" for name in COUNTERS),
+    )
@@ -0,0 +1,211 @@
+"""
+Raw Layer Bulk Loader
+---------------------
+Shared COPY-based upsert used by the CDC jobs. Each batch is streamed with
+COPY into a session-local staging table, duplicates are coalesced to the
+latest version per key, and a single set-based upsert is applied to the
+analytics.raw_* target.
+"""
+
+import io
+import json
+import logging
+import time
+
+import instrumentation
+
+logger = logging.getLogger("raw_loader")
+
+
+def _copy_value(value) -> str:
+    """Render a Python value in COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, default=str)
+    text = str(value)
+    return (
+        text.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_buffer(rows):
+    """Serialise row tuples into an in-memory COPY text buffer.
+
+    Returns the rewound buffer and its size in characters.
+    """
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_value(v) for v in row))
+        buf.write("\n")
+    size = buf.tell()
+    buf.seek(0)
+    return buf, size
+
+
+def copy_rows(cur, table: str, columns: list, rows) -> tuple:
+    """COPY row tuples into table; returns (rows copied, payload size)."""
+    with instrumentation.stage("transform"):
+        buf, payload_bytes = _copy_buffer(rows)
+    if not payload_bytes:
+        return 0, 0
+    with instrumentation.stage("load"):
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+    instrumentation.count("bytes_loaded", payload_bytes)
+    return cur.rowcount, payload_bytes
+
+
+def _staging_table(target_table: str) -> str:
+    return "_stage_" + target_table.replace(".", "_")
+
+
+def ensure_staging_table(cur, target_table: str) -> str:
+    """Create (once per session) a temp staging table shaped like target_table."""
+    stage = _staging_table(target_table)
+    cur.execute(
+        f"""
+        CREATE TEMP TABLE IF NOT EXISTS {stage} (
+            LIKE {target_table},
+            _stage_seq BIGSERIAL
+        ) ON COMMIT DELETE ROWS
+        """
+    )
+    return stage
+
+
+def ensure_partitions(cur, target_table: str, stage: str, partition_column: str, months_ahead: int):
+    """Create the monthly partitions of target_table that the staged rows need.
+
+    Also creates months_ahead months past the present, so routine loads
+    never fall into the default partition.
+    """
+    cur.execute(
+        f"""
+        SELECT analytics.ensure_monthly_partitions(
+            %s, %s,
+            COALESCE(min({partition_column}), now()),
+            GREATEST(max({partition_column}), now() + make_interval(months => %s))
+        )
+        FROM {stage}
+        """,
+        (target_table, partition_column, months_ahead),
+    )
+    created = cur.fetchone()[0]
+    if created:
+        logger.info("Created %d monthly partition(s) of %s", created, target_table)
+
+
+def _reject_null_partition_keys(rows, columns: list, partition_column: str, identity_columns: list,
+                                rejected: list):
+    """Yield rows whose partition key is set; append the identity of the others to rejected.
+
+    The partition key is part of a partitioned target's NOT NULL primary
+    key, so one such row would fail the whole COPY and stall the table.
+    """
+    position = columns.index(partition_column)
+    identity = [columns.index(c) for c in identity_columns if c in columns]
+    for row in rows:
+        if row[position] is None:
+            rejected.append(tuple(row[i] for i in identity))
+            continue
+        yield row
+
+
+def copy_upsert(conn, target_table: str, columns: list, rows, key_columns, update_columns=None,
+                identity_columns=None, partition_column: str = None, partition_months_ahead: int = 3) -> int:
+    """COPY rows into staging and merge them into target_table.
+
+    rows is an iterable of tuples ordered like columns. When a key appears
+    more than once in a batch, the last occurrence wins. update_columns
+    defaults to every non-key column. Returns the number of rows merged.
+
+    For partitioned targets, key_columns must include the partition key.
+    identity_columns then names the row identity within it (e.g. the source
+    primary key). Rows are deduplicated on the identity, and a stored
+    version whose partition key changed is deleted before the new one is
+    inserted into its partition. partition_column makes sure the monthly
+    partitions the batch needs exist first; rows with no value in it are
+    rejected (logged and left out) rather than failing the batch.
+    """
+    if isinstance(key_columns, str):
+        key_columns = [key_columns]
+    if isinstance(identity_columns, str):
+        identity_columns = [identity_columns]
+    if update_columns is None:
+        update_columns = [c for c in columns if c not in key_columns]
+
+    started = time.perf_counter()
+    columns_str = ", ".join(columns)
+    keys_str = ", ".join(key_columns)
+    dedup_str = ", ".join(identity_columns or key_columns)
+    if update_columns:
+        conflict_action = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in update_columns)
+    else:
+        conflict_action = "DO NOTHING"
+
+    moved = ""
+    moved_keys = [c for c in key_columns if c not in (identity_columns or key_columns)]
+    if moved_keys:
+        moved = f"""
+            , moved AS (
+                DELETE FROM {target_table} t
+                USING latest s
+                WHERE {" AND ".join(f"t.{c} = s.{c}" for c in identity_columns)}
+                  AND ({", ".join(f"t.{c}" for c in moved_keys)})
+                      IS DISTINCT FROM ({", ".join(f"s.{c}" for c in moved_keys)})
+            )"""
+
+    rejected = []
+    if partition_column:
+        rows = _reject_null_partition_keys(
+            rows, columns, partition_column, identity_columns or key_columns, rejected
+        )
+
+    with conn.cursor() as cur:
+        stage = ensure_staging_table(cur, target_table)
+        copied, payload_bytes = copy_rows(cur, stage, columns, rows)
+        if rejected:
+            logger.error(
+                "Rejected %d rows with no %s, which %s requires: %s",
+                len(rejected),
+                partition_column,
+                target_table,
+                ", ".join(str(key[0] if len(key) == 1 else key) for key in rejected[:20]),
+            )
+        if not copied:
+            return 0
+
+        with instrumentation.stage("load"):
+            if partition_column:
+                ensure_partitions(cur, target_table, stage, partition_column, partition_months_ahead)
+            cur.execute(
+                f"""
+                WITH latest AS (
+                    SELECT DISTINCT ON ({dedup_str}) {columns_str}
+                    FROM {stage}
+                    ORDER BY {dedup_str}, _stage_seq DESC
+                ){moved}
+                INSERT INTO {target_table} ({columns_str})
+                SELECT {columns_str} FROM latest
+                ON CONFLICT ({keys_str})
+                {conflict_action}
+                """
+            )
+            merged = cur.rowcount
+            cur.execute(f"TRUNCATE {stage}")
+        instrumentation.count("rows_loaded", merged)
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Loaded %d rows (%d after dedup, %.1f KiB) into %s in %.2fs (%.0f rows/s)",
+        copied,
+        merged,
+        payload_bytes / 1024,
+        target_table,
+        elapsed,
+        copied / elapsed if elapsed else 0.0,
+    )
+    return merged
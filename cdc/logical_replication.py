@@ -0,0 +1,450 @@
+"""
+Postgres Logical Replication CDC
+--------------------------------
+Alternative engine for TABLES_CONFIG entries with "engine": "logical".
+Consumes a pgoutput logical replication slot, decodes inserts, updates and
+deletes, and applies them in batches to the analytics raw tables. Hard
+deletes are recorded as deleted_at = commit time, so downstream models keep
+their soft-delete semantics. The confirmed LSN is stored in cdc_metadata.
+
+Requires wal_level=logical on the source and a role with REPLICATION.
+"""
+
+import os
+import time
+import select
+import struct
+import logging
+from datetime import datetime, timedelta, timezone
+import psycopg2
+from psycopg2.errors import DuplicateObject
+from psycopg2.extras import LogicalReplicationConnection, execute_values
+
+import instrumentation
+import parquet_sink
+from loader import copy_upsert
+
+logger = logging.getLogger("postgres_cdc")
+
+REPLICATION_BATCH_SIZE = int(os.getenv("CDC_REPLICATION_BATCH_SIZE", "5000"))
+IDLE_TIMEOUT = float(os.getenv("CDC_REPLICATION_IDLE_TIMEOUT", "5"))
+
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+class UnchangedToastError(ValueError):
+    """Raised when pgoutput omits an unchanged TOASTed column value."""
+
+
+class _Reader:
+    """Sequential reader over a pgoutput message payload."""
+
+    def __init__(self, payload: bytes):
+        self.buf = payload
+        self.pos = 0
+
+    def _unpack(self, fmt: str):
+        (value,) = struct.unpack_from(fmt, self.buf, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def int8(self) -> int:
+        return self._unpack("!b")
+
+    def int16(self) -> int:
+        return self._unpack("!h")
+
+    def int32(self) -> int:
+        return self._unpack("!i")
+
+    def int64(self) -> int:
+        return self._unpack("!q")
+
+    def char(self) -> str:
+        value = chr(self.buf[self.pos])
+        self.pos += 1
+        return value
+
+    def string(self) -> str:
+        end = self.buf.index(b"\0", self.pos)
+        value = self.buf[self.pos:end].decode()
+        self.pos = end + 1
+        return value
+
+    def text(self, length: int) -> str:
+        value = self.buf[self.pos:self.pos + length].decode()
+        self.pos += length
+        return value
+
+
+def _pg_timestamp(micros: int) -> datetime:
+    return PG_EPOCH + timedelta(microseconds=micros)
+
+
+def format_lsn(lsn: int) -> str:
+    """Render an integer LSN in Postgres X/Y notation."""
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+
+
+def parse_lsn(lsn: str) -> int:
+    """Parse an X/Y LSN into an integer."""
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class PgOutputDecoder:
+    """Decode pgoutput protocol v1 messages.
+
+    decode() returns one of:
+        ("begin", commit_ts)
+        ("commit", end_lsn, commit_ts)
+        ("insert" | "update", relation, {column: text_value})
+        ("delete", relation, {key_column: text_value})
+    or None for messages the CDC engine does not use. relation is a
+    (schema, table, columns) tuple from the most recent Relation message.
+    """
+
+    def __init__(self):
+        self.relations = {}
+
+    def decode(self, payload: bytes):
+        reader = _Reader(payload)
+        kind = reader.char()
+
+        if kind == "B":
+            reader.int64()  # final LSN
+            return ("begin", _pg_timestamp(reader.int64()))
+        if kind == "C":
+            reader.int8()  # flags
+            reader.int64()  # commit LSN
+            end_lsn = reader.int64()
+            return ("commit", end_lsn, _pg_timestamp(reader.int64()))
+        if kind == "R":
+            self._relation(reader)
+            return None
+        if kind == "I":
+            relation = self.relations[reader.int32()]
+            reader.char()  # 'N'
+            return ("insert", relation, self._tuple(reader, relation))
+        if kind == "U":
+            relation = self.relations[reader.int32()]
+            marker = reader.char()
+            if marker in ("K", "O"):
+                self._tuple(reader, relation, allow_unchanged=True)
+                reader.char()  # 'N'
+            return ("update", relation, self._tuple(reader, relation))
+        if kind == "D":
+            relation = self.relations[reader.int32()]
+            reader.char()  # 'K' or 'O'
+            values = self._tuple(reader, relation, allow_unchanged=True)
+            return ("delete", relation, {k: v for k, v in values.items() if v is not None})
+        # Origin, Type, Truncate and logical Message records are not applied.
+        return None
+
+    def _relation(self, reader: _Reader):
+        rel_id = reader.int32()
+        schema = reader.string()
+        table = reader.string()
+        reader.int8()  # replica identity setting
+        columns = []
+        for _ in range(reader.int16()):
+            reader.int8()  # flags
+            columns.append(reader.string())
+            reader.int32()  # type oid
+            reader.int32()  # type modifier
+        self.relations[rel_id] = (schema, table, columns)
+
+    def _tuple(self, reader: _Reader, relation, allow_unchanged: bool = False) -> dict:
+        columns = relation[2]
+        values = {}
+        for i in range(reader.int16()):
+            kind = reader.char()
+            if kind == "n":
+                values[columns[i]] = None
+            elif kind == "u":
+                if not allow_unchanged:
+                    raise UnchangedToastError(
+                        f"Unchanged TOAST value for {relation[0]}.{relation[1]}.{columns[i]}; "
+                        "set REPLICA IDENTITY FULL on the source table"
+                    )
+                values[columns[i]] = None
+            else:
+                values[columns[i]] = reader.text(reader.int32())
+        return values
+
+
+def get_replication_connection(**connect_kwargs):
+    """Open a logical replication connection to the source."""
+    return psycopg2.connect(connection_factory=LogicalReplicationConnection, **connect_kwargs)
+
+
+def ensure_publication(conn, cfg: dict):
+    """Create the table's publication on the source if it does not exist."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_publication WHERE pubname = %s", (cfg["publication"],))
+        if cur.fetchone() is None:
+            cur.execute(f"CREATE PUBLICATION {cfg['publication']} FOR TABLE {cfg['source_table']}")
+            logger.info("Created publication %s", cfg["publication"])
+
+
+def ensure_slot(repl_cur, slot_name: str):
+    """Create the pgoutput replication slot if it does not exist."""
+    try:
+        repl_cur.create_replication_slot(slot_name, output_plugin="pgoutput")
+        logger.info("Created replication slot %s", slot_name)
+    except DuplicateObject:
+        pass
+
+
+def get_confirmed_lsn(conn, metadata_name: str):
+    """Return the last applied LSN from analytics.cdc_metadata, or None."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT last_lsn FROM analytics.cdc_metadata WHERE source_name = %s",
+            (metadata_name,),
+        )
+        row = cur.fetchone()
+    return row[0] if row and row[0] else None
+
+
+def _key_type(conn, target_table: str, primary_key: str) -> str:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attname = %s
+            """,
+            (target_table, primary_key),
+        )
+        return cur.fetchone()[0]
+
+
+def apply_changes(conn, cfg: dict, changes: list, partition_months_ahead: int = 3) -> int:
+    """Apply decoded changes to the raw table; the last change per key wins.
+
+    A key inserted or updated and then deleted within the batch is loaded
+    as its last row with deleted_at set, so the tombstone is kept even when
+    the row never reached the raw table. partition_months_ahead is passed
+    to copy_upsert for partitioned targets.
+    """
+    pk = cfg["primary_key"]
+    latest = {}
+    for op, values, commit_ts in changes:
+        key = values[pk]
+        previous = latest.get(key)
+        if op == "delete" and previous is not None and previous[0] != "delete":
+            op, values = "tombstone", {**previous[1], **values, "deleted_at": commit_ts}
+        latest[key] = (op, values, commit_ts)
+
+    instrumentation.observe_lag(min((ts for _, _, ts in changes if ts is not None), default=None))
+
+    now = datetime.utcnow()
+    upserts = [values for op, values, _ in latest.values() if op != "delete"]
+    deletes = [(key, commit_ts, now) for key, (op, _, commit_ts) in latest.items() if op == "delete"]
+
+    applied = 0
+    if upserts:
+        # Tombstones add deleted_at when the source table has no such column.
+        columns = list(dict.fromkeys(c for values in upserts for c in values))
+        rows = (tuple(v.get(c) for c in columns) + (now,) for v in upserts)
+        applied += copy_upsert(
+            conn,
+            cfg["target_table"],
+            columns + ["extracted_at"],
+            rows,
+            cfg.get("conflict_key", pk),
+            identity_columns=pk,
+            partition_column=cfg.get("partition_column"),
+            partition_months_ahead=partition_months_ahead,
+        )
+
+    if deletes:
+        key_type = _key_type(conn, cfg["target_table"], pk)
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                f"""
+                UPDATE {cfg['target_table']} t
+                SET deleted_at = v.deleted_at,
+                    extracted_at = v.extracted_at
+                FROM (VALUES %s) AS v (key, deleted_at, extracted_at)
+                WHERE t.{pk} = v.key::{key_type}
+                """,
+                deletes,
+            )
+            applied += cur.rowcount
+        logger.info("Marked %d rows deleted in %s", len(deletes), cfg["target_table"])
+
+    return applied
+
+
+def land_changes(conn, cfg: dict, changes: list, lsn: int):
+    """Write every decoded change, in commit order, to the Parquet landing zone."""
+    if parquet_sink.get_sink() is None or not changes:
+        return
+    column_types = parquet_sink.column_types(conn, cfg["target_table"])
+    columns = list(column_types)
+    rows = [tuple(values.get(c) for c in columns) for _, values, _ in changes]
+    parquet_sink.land(
+        cfg["metadata_name"], column_types, columns, rows, [op for op, _, _ in changes], format_lsn(lsn), text=True
+    )
+
+
+def update_lsn_metadata(conn, metadata_name: str, record_count: int, lsn: int, status: str = "success",
+                        commit_ts: datetime = None):
+    """Store the confirmed LSN and job stats in analytics.cdc_metadata.
+
+    commit_ts, the source commit time of the last applied change, becomes
+    the source's timestamp watermark for monitoring.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE analytics.cdc_metadata
+            SET last_lsn = %s,
+                last_extracted_timestamp = COALESCE(%s, last_extracted_timestamp),
+                last_extraction_status = %s,
+                records_extracted = %s,
+                last_loaded_at = CASE WHEN %s > 0 THEN now() ELSE last_loaded_at END,
+                rows_last_run = %s,
+                max_lag_seconds = COALESCE(%s, max_lag_seconds),
+                updated_at = %s
+            WHERE source_name = %s
+            """,
+            (
+                format_lsn(lsn),
+                commit_ts,
+                status,
+                record_count,
+                record_count,
+                record_count,
+                instrumentation.max_lag(),
+                datetime.utcnow(),
+                metadata_name,
+            ),
+        )
+
+
+class ReplicationStream:
+    """A started pgoutput stream on one table's slot, reusable across syncs.
+
+    The server sends Relation messages once per stream and does not resend
+    a transaction that is still being received, so the decoder and any
+    unfinished transaction carry over from one sync_logical_table call to
+    the next. Close the stream after a failed sync; a new one restarts
+    from the LSN confirmed in cdc_metadata.
+    """
+
+    def __init__(self, repl_conn, cfg: dict, start_lsn: str = None):
+        self.conn = repl_conn
+        self.cfg = cfg
+        self.cur = repl_conn.cursor()
+        ensure_slot(self.cur, cfg["slot_name"])
+        self.cur.start_replication(
+            slot_name=cfg["slot_name"],
+            decode=False,
+            start_lsn=start_lsn or 0,
+            options={"proto_version": "1", "publication_names": cfg["publication"]},
+        )
+        self.decoder = PgOutputDecoder()
+        self.txn = []
+        self.commit_ts = None
+        self.confirmed_lsn = parse_lsn(start_lsn) if start_lsn else 0
+
+    @property
+    def closed(self) -> bool:
+        return bool(self.conn.closed)
+
+    def close(self):
+        if self.txn:
+            # Not committed yet; a new stream replays it from confirmed_lsn.
+            logger.info("Discarding %d changes of an unfinished transaction on %s",
+                        len(self.txn), self.cfg["source_table"])
+        self.conn.close()
+
+
+def open_stream(target_conn, cfg: dict, **connect_kwargs) -> ReplicationStream:
+    """Start streaming the table's slot from the LSN confirmed in cdc_metadata."""
+    start_lsn = get_confirmed_lsn(target_conn, cfg["metadata_name"])
+    repl_conn = get_replication_connection(**connect_kwargs)
+    try:
+        return ReplicationStream(repl_conn, cfg, start_lsn)
+    except Exception:
+        repl_conn.close()
+        raise
+
+
+def sync_logical_table(stream: ReplicationStream, target_conn, name: str, cfg: dict,
+                       batch_size: int = REPLICATION_BATCH_SIZE,
+                       idle_timeout: float = IDLE_TIMEOUT, stop_when=None,
+                       partition_months_ahead: int = 3) -> int:
+    """Drain the table's replication stream into the raw layer.
+
+    Changes are applied at transaction boundaries once batch_size changes
+    have accumulated, then the LSN is committed to cdc_metadata and
+    confirmed to the source. Returns after idle_timeout seconds without
+    new messages (at once when it is 0), or after the first flush for
+    which stop_when() is True.
+    """
+    logger.info("Processing %s via logical replication slot %s", name, cfg["slot_name"])
+
+    cur = stream.cur
+    decoder = stream.decoder
+    source = tuple(cfg["source_table"].split("."))
+    pending = []
+    pending_lsn = stream.confirmed_lsn
+    processed = 0
+
+    def flush():
+        nonlocal processed
+        processed += apply_changes(target_conn, cfg, pending, partition_months_ahead)
+        land_changes(target_conn, cfg, pending, pending_lsn)
+        update_lsn_metadata(target_conn, cfg["metadata_name"], processed, pending_lsn, status="running",
+                            commit_ts=pending[-1][2] if pending else None)
+        instrumentation.commit(target_conn)
+        cur.send_feedback(flush_lsn=pending_lsn)
+        stream.confirmed_lsn = pending_lsn
+        pending.clear()
+
+    # Also keeps a stream that sat idle between daemon polls alive.
+    cur.send_feedback()
+    last_message = time.monotonic()
+    while True:
+        with instrumentation.stage("extract"):
+            msg = cur.read_message()
+        if msg is None:
+            waited = time.monotonic() - last_message
+            if waited >= idle_timeout:
+                break
+            cur.send_feedback()
+            select.select([cur], [], [], idle_timeout - waited)
+            continue
+
+        last_message = time.monotonic()
+        instrumentation.count("bytes_extracted", len(msg.payload))
+        with instrumentation.stage("transform"):
+            event = decoder.decode(msg.payload)
+        if event is None:
+            continue
+
+        kind = event[0]
+        if kind == "begin":
+            stream.txn, stream.commit_ts = [], event[1]
+        elif kind == "commit":
+            pending.extend(stream.txn)
+            stream.txn = []
+            pending_lsn = event[1]
+            if len(pending) >= batch_size:
+                flush()
+                if stop_when is not None and stop_when():
+                    break
+        elif event[1][:2] == source:
+            stream.txn.append((kind, event[2], stream.commit_ts))
+            instrumentation.count("rows_extracted")
+
+    if pending or pending_lsn != stream.confirmed_lsn:
+        flush()
+    update_lsn_metadata(target_conn, cfg["metadata_name"], processed, stream.confirmed_lsn)
+    instrumentation.commit(target_conn)
+    return processed
@@ -0,0 +1,158 @@
+"""
+Pipeline Orchestrator
+---------------------
+One entry point for a scheduled pipeline run:
+
+  1. MongoDB (sync_users) and Postgres (run_postgres_cdc) CDC run
+     concurrently.
+  2. analytics.cdc_metadata tells which sources actually loaded rows: their
+     last_loaded_at moved during the run.
+  3. dbt builds only the models (and tests) downstream of those raw tables,
+     e.g. `dbt build --select source:analytics.raw_users+`. When nothing
+     loaded, dbt is skipped.
+
+dbt still runs for the sources that loaded when the other CDC job failed;
+the orchestrator then exits non-zero.
+
+    python cdc/orchestrate.py
+    python cdc/orchestrate.py --dry-run          # run CDC, only log the dbt command
+    python cdc/orchestrate.py --target prod      # unknown flags are passed to dbt
+"""
+
+import os
+import sys
+import argparse
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import extract_mongo
+import extract_postgres
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(threadName)s - %(levelname)s - %(message)s",
+    force=True,
+)
+logger = logging.getLogger("orchestrator")
+
+DBT_PROJECT_DIR = os.getenv(
+    "DBT_PROJECT_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dbt_project")
+)
+DBT_SOURCE = "analytics"
+
+# cdc_metadata source_name -> raw table declared in the dbt sources
+SOURCE_TABLES = {
+    extract_mongo.METADATA_NAME: "raw_users",
+    **{
+        cfg["metadata_name"]: cfg["target_table"].split(".")[-1]
+        for cfg in extract_postgres.TABLES_CONFIG.values()
+    },
+}
+
+
+def last_loads(conn) -> dict:
+    """Return {source_name: last_loaded_at} from analytics.cdc_metadata."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT source_name, last_loaded_at FROM analytics.cdc_metadata")
+        return dict(cur.fetchall())
+
+
+def changed_sources(before: dict, after: dict) -> list:
+    """Sources whose last_loaded_at advanced between two last_loads() reads."""
+    return sorted(
+        name for name, loaded_at in after.items()
+        if loaded_at is not None and (before.get(name) is None or loaded_at > before[name])
+    )
+
+
+def dbt_command(sources: list, project_dir: str = DBT_PROJECT_DIR, extra_args=()) -> list:
+    """dbt build limited to the models downstream of the given cdc_metadata sources."""
+    selectors = [f"source:{DBT_SOURCE}.{SOURCE_TABLES[name]}+" for name in sources if name in SOURCE_TABLES]
+    return ["dbt", "build", "--project-dir", project_dir, "--select", *selectors, *extra_args]
+
+
+def run_cdc(mongo_mode: str, diff_strategy: str, chunk_size: int, max_parallelism: int,
+            pipeline_depth: int, snapshot_workers: int = extract_mongo.SNAPSHOT_WORKERS) -> dict:
+    """Run both CDC jobs concurrently; returns {job: exception or None}."""
+    jobs = {
+        "mongodb": (extract_mongo.sync_users, (mongo_mode, diff_strategy, None, snapshot_workers)),
+        "postgres": (extract_postgres.run_postgres_cdc, (chunk_size, max_parallelism, pipeline_depth)),
+    }
+    errors = {}
+    with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="orchestrator") as executor:
+        futures = {job: executor.submit(fn, *args) for job, (fn, args) in jobs.items()}
+        for job, future in futures.items():
+            try:
+                future.result()
+                errors[job] = None
+            except Exception as exc:
+                logger.error("%s CDC failed: %s", job, exc)
+                errors[job] = exc
+    return errors
+
+
+def run_pipeline(mongo_mode: str = extract_mongo.CDC_MODE, diff_strategy: str = extract_mongo.DIFF_STRATEGY,
+                 chunk_size: int = extract_postgres.CHUNK_SIZE,
+                 max_parallelism: int = extract_postgres.MAX_PARALLELISM,
+                 pipeline_depth: int = extract_postgres.PIPELINE_DEPTH,
+                 project_dir: str = DBT_PROJECT_DIR, dbt_args=(), dry_run: bool = False,
+                 snapshot_workers: int = extract_mongo.SNAPSHOT_WORKERS) -> int:
+    """Run CDC, then dbt for the affected models; returns the process exit code."""
+    conn = extract_postgres.get_connection()
+    try:
+        before = last_loads(conn)
+        conn.rollback()
+
+        errors = run_cdc(mongo_mode, diff_strategy, chunk_size, max_parallelism, pipeline_depth, snapshot_workers)
+
+        changed = changed_sources(before, last_loads(conn))
+        conn.rollback()
+    finally:
+        conn.close()
+
+    failed = [job for job, exc in errors.items() if exc is not None]
+    exit_code = 1 if failed else 0
+
+    if not changed:
+        logger.info("No source loaded new rows; skipping dbt")
+        return exit_code
+
+    command = dbt_command(changed, project_dir, dbt_args)
+    logger.info("Sources with new rows: %s", ", ".join(changed))
+    logger.info("Running %s", " ".join(command))
+    if dry_run:
+        return exit_code
+
+    result = subprocess.run(command)
+    if result.returncode != 0:
+        logger.error("dbt build failed with exit code %d", result.returncode)
+        return result.returncode
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run both CDC jobs, then dbt for the models they affected")
+    parser.add_argument("--mongo-mode", choices=["snapshot", "changestream"], default=extract_mongo.CDC_MODE)
+    parser.add_argument("--diff-strategy", choices=extract_mongo.DIFF_STRATEGIES,
+                        default=extract_mongo.DIFF_STRATEGY)
+    parser.add_argument("--chunk-size", type=int, default=extract_postgres.CHUNK_SIZE)
+    parser.add_argument("--max-parallelism", type=int, default=extract_postgres.MAX_PARALLELISM)
+    parser.add_argument("--pipeline-depth", type=int, default=extract_postgres.PIPELINE_DEPTH)
+    parser.add_argument("--snapshot-workers", type=int, default=extract_mongo.SNAPSHOT_WORKERS,
+                        help="read Mongo snapshots on this many parallel Uid-range cursors")
+    parser.add_argument("--project-dir", default=DBT_PROJECT_DIR, help="dbt project directory")
+    parser.add_argument("--dry-run", action="store_true", help="run CDC but only log the dbt command")
+    args, dbt_args = parser.parse_known_args()
+
+    sys.exit(run_pipeline(
+        args.mongo_mode,
+        args.diff_strategy,
+        args.chunk_size,
+        args.max_parallelism,
+        args.pipeline_depth,
+        args.project_dir,
+        dbt_args,
+        args.dry_run,
+        args.snapshot_workers,
+    ))
@@ -0,0 +1,201 @@
+"""
+Parquet Landing Zone
+--------------------
+Optional columnar change log written next to the analytics.raw_* loads.
+
+Each extracted change batch becomes one Parquet file under
+
+    <CDC_PARQUET_DIR>/source=<source>/extract_date=<YYYY-MM-DD>/part-<time>-<id>.parquet
+
+holding the batch's columns plus:
+  _op          insert, update or delete; "upsert" for polled rows where an
+               insert cannot be told apart from an update
+  _watermark   the source watermark the batch was committed with (keyset
+               timestamp and key, replication LSN, or change-stream resume
+               token)
+  _extracted_at  when the batch was landed
+
+Every file of a source has the same schema: the warehouse table's columns,
+typed from their Postgres types (text for anything unmapped), followed by
+the three columns above. Columns a batch does not carry are null, so an
+all-None column or a delete batch holding only keys does not change it.
+
+Rows are converted column-wise straight into an Arrow record batch. Files
+are written under a temporary name and renamed, so readers never see a
+partial file. A batch is landed before its watermark is committed, so a
+crash can leave a file that is extracted again later. Replays should keep
+the last row per key and watermark.
+
+CDC_PARQUET_DIR may be a local path or any URI pyarrow's filesystem layer
+understands (s3://, gs://, ...). Needs the pyarrow package (in
+requirements.txt); configuring a path without it fails at once.
+"""
+
+import os
+import uuid
+import logging
+import threading
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pyarrow import fs as pafs
+except ImportError:
+    pa = None
+
+import instrumentation
+
+logger = logging.getLogger("parquet_sink")
+
+PARQUET_DIR = os.getenv("CDC_PARQUET_DIR")
+PARQUET_COMPRESSION = os.getenv("CDC_PARQUET_COMPRESSION", "zstd")
+
+_sink = None
+_configured = False
+_sink_lock = threading.Lock()
+_column_types = {}
+
+
+def arrow_type(sql_type: str):
+    """Arrow type for a Postgres format_type() name; string when unmapped."""
+    if sql_type.startswith("numeric("):
+        precision, scale = sql_type[len("numeric("):-1].split(",")
+        return pa.decimal128(int(precision), int(scale))
+    return {
+        "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+        "timestamp without time zone": pa.timestamp("us"),
+        "date": pa.date32(),
+        "smallint": pa.int16(),
+        "integer": pa.int32(),
+        "bigint": pa.int64(),
+        "real": pa.float32(),
+        "double precision": pa.float64(),
+        "boolean": pa.bool_(),
+    }.get(sql_type, pa.string())
+
+
+def column_types(conn, table: str) -> dict:
+    """Return {column: formatted type} for a warehouse table, read once per process."""
+    with _sink_lock:
+        if table in _column_types:
+            return _column_types[table]
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT attname, format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+            ORDER BY attnum
+            """,
+            (table,),
+        )
+        types = dict(cur.fetchall())
+    with _sink_lock:
+        _column_types[table] = types
+    return types
+
+
+def _array(values: list, arrow_type, text: bool):
+    """Arrow array of arrow_type; with text, values are Postgres text output."""
+    if not text or pa.types.is_string(arrow_type):
+        return pa.array(values, arrow_type)
+    if pa.types.is_boolean(arrow_type):
+        return pa.array([None if v is None else v == "t" for v in values], arrow_type)
+    return pa.array(values, pa.string()).cast(arrow_type)
+
+
+class ParquetSink:
+    """Write change batches as Parquet files partitioned by source and date."""
+
+    def __init__(self, root: str, compression: str = PARQUET_COMPRESSION):
+        if pa is None:
+            raise ValueError(
+                f"Parquet landing is configured ({root}) but pyarrow is not installed; "
+                "pip install -r requirements.txt or unset CDC_PARQUET_DIR/--parquet-dir"
+            )
+        if "://" not in root:
+            root = os.path.abspath(root)
+        self.filesystem, self.root = pafs.FileSystem.from_uri(root)
+        self.compression = compression
+
+    def record_batch(self, column_types: dict, columns: list, rows: list, ops, watermark: str,
+                     extracted_at: datetime, text: bool = False):
+        """Build an Arrow record batch from row tuples ordered like columns.
+
+        The batch has one column per entry of column_types, null where rows
+        do not carry it. ops is a single op for the whole batch or one op
+        per row.
+        """
+        count = len(rows)
+        index = {column: i for i, column in enumerate(columns)}
+        fields = [pa.field(column, arrow_type(sql_type)) for column, sql_type in column_types.items()]
+        arrays = [
+            _array([r[index[f.name]] for r in rows] if f.name in index else [None] * count, f.type, text)
+            for f in fields
+        ]
+        if isinstance(ops, str):
+            ops = [ops] * count
+        fields += [
+            pa.field("_op", pa.dictionary(pa.int32(), pa.string())),
+            pa.field("_watermark", pa.string()),
+            pa.field("_extracted_at", pa.timestamp("us", tz="UTC")),
+        ]
+        arrays += [
+            pa.array(ops, pa.string()).dictionary_encode(),
+            pa.array([watermark] * count, pa.string()),
+            pa.array([extracted_at] * count, pa.timestamp("us", tz="UTC")),
+        ]
+        return pa.RecordBatch.from_arrays(arrays, schema=pa.schema(fields))
+
+    def write(self, source: str, column_types: dict, columns: list, rows: list, ops, watermark,
+              text: bool = False) -> str:
+        """Land one change batch; returns the file path."""
+        extracted_at = datetime.now(timezone.utc)
+        with instrumentation.stage("transform"):
+            batch = self.record_batch(column_types, columns, rows, ops, str(watermark), extracted_at, text)
+
+        directory = f"{self.root}/source={source}/extract_date={extracted_at:%Y-%m-%d}"
+        name = f"part-{extracted_at:%H%M%S%f}-{uuid.uuid4().hex[:8]}.parquet"
+        path = f"{directory}/{name}"
+        tmp = f"{directory}/.{name}.tmp"
+
+        with instrumentation.stage("load"):
+            self.filesystem.create_dir(directory, recursive=True)
+            with self.filesystem.open_output_stream(tmp) as out:
+                pq.write_table(pa.Table.from_batches([batch]), out, compression=self.compression)
+            self.filesystem.move(tmp, path)
+
+        logger.info("Landed %d %s changes in %s", len(rows), source, path)
+        return path
+
+
+def configure(root: str = None, compression: str = PARQUET_COMPRESSION):
+    """Enable the landing zone at root, or disable it when root is empty."""
+    global _sink, _configured
+    with _sink_lock:
+        _sink = ParquetSink(root, compression) if root else None
+        _configured = True
+
+
+def get_sink():
+    """Return the configured sink, or None when landing is disabled.
+
+    Without an explicit configure() call the sink follows CDC_PARQUET_DIR.
+    """
+    if not _configured:
+        configure(PARQUET_DIR)
+    return _sink
+
+
+def land(source: str, column_types: dict, columns: list, rows: list, ops, watermark,
+         text: bool = False) -> str:
+    """Land a change batch if the landing zone is enabled.
+
+    column_types ({column: Postgres type}) fixes the file schema; with
+    text, row values are Postgres text output and are cast to it.
+    """
+    sink = get_sink()
+    if sink is None or not rows:
+        return None
+    return sink.write(source, column_types, columns, rows, ops, watermark, text)
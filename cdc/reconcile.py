@@ -0,0 +1,406 @@
+"""
+Source / Raw Layer Reconciliation
+---------------------------------
+Checks that the analytics.raw_* tables match their sources without copying
+either side.
+
+Each table is split into primary-key ranges. Both sides compute a row count
+and an order-independent checksum for each range on the server: the sum of
+the first 60 bits of every row's md5. Ranges that agree are done. Ranges
+that differ are split again at percentiles of the key on the larger side,
+until they hold at most --leaf-rows rows. Only those leaf ranges are read
+row by row, as (key, md5) pairs, to find the keys that are missing, extra
+or different in the raw layer.
+
+Only live rows (deleted_at IS NULL) are compared. That way soft deletes,
+and hard deletes captured through logical replication, both match.
+Timestamps are compared in UTC, matching how the CDC job loads naive
+source timestamps.
+
+--repair copies the mismatched keys from the source again and marks keys
+the source no longer has as deleted. Each leaf range commits on its own.
+
+MongoDB cannot compute the warehouse's record_hash on the server. For
+raw_users, ranges are therefore compared on counts (index-backed on Uid in
+Mongo). Leaf ranges are checked against the stored record_hash by
+re-hashing the mapped fields. --verify-hashes checks every range that way.
+That reads the hashed fields of every user, though not whole documents.
+
+Rows changed while the check runs can show up as mismatches. Run it with
+the CDC jobs caught up, or let --repair fix them.
+
+    python cdc/reconcile.py --tables savings_plan savingstransaction users
+    python cdc/reconcile.py --tables savingstransaction --repair
+"""
+
+import os
+import sys
+import argparse
+import logging
+from datetime import datetime
+
+import extract_mongo
+import extract_postgres
+from hashing import CHANGED, RecordHasher
+
+logger = logging.getLogger("reconcile")
+
+LEAF_ROWS = int(os.getenv("RECONCILE_LEAF_ROWS", "10000"))
+FANOUT = int(os.getenv("RECONCILE_FANOUT", "16"))
+USERS = "users"
+
+_LIVE = "deleted_at IS NULL"
+
+
+def column_types(conn, table: str) -> dict:
+    """Return {column: formatted type} for table, in column order."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT attname, format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+            ORDER BY attnum
+            """,
+            (table,),
+        )
+        return dict(cur.fetchall())
+
+
+def canonical_text(column: str, type_name: str) -> str:
+    """SQL rendering a column as text that is equal across timestamp types."""
+    if type_name == "timestamp with time zone":
+        return f"to_char({column} AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS.US')"
+    if type_name == "timestamp without time zone":
+        return f"to_char({column}, 'YYYY-MM-DD HH24:MI:SS.US')"
+    return f"{column}::text"
+
+
+class PostgresSide:
+    """Range checksums, split points and row values for one Postgres table.
+
+    value_sql is the per-row value compared at the leaves; with
+    checksum=False ranges are compared on counts only.
+    """
+
+    def __init__(self, conn, table: str, key_sql: str, value_sql: str, checksum: bool = True):
+        self.conn = conn
+        self.table = table
+        self.key_sql = key_sql
+        self.value_sql = value_sql
+        self.checksum_enabled = checksum
+
+    def _where(self, lo, hi):
+        clauses, params = [_LIVE], []
+        if lo is not None:
+            clauses.append(f"{self.key_sql} >= %s")
+            params.append(lo)
+        if hi is not None:
+            clauses.append(f"{self.key_sql} < %s")
+            params.append(hi)
+        return " AND ".join(clauses), params
+
+    def checksum(self, lo, hi) -> tuple:
+        where, params = self._where(lo, hi)
+        if self.checksum_enabled:
+            query = f"""
+                SELECT count(*), COALESCE(sum(('x' || substr(h, 1, 15))::bit(60)::bigint), 0)
+                FROM (SELECT {self.value_sql} AS h FROM {self.table} WHERE {where}) r
+            """
+        else:
+            query = f"SELECT count(*), NULL FROM {self.table} WHERE {where}"
+        with self.conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchone()
+
+    def split(self, lo, hi, parts: int) -> list:
+        where, params = self._where(lo, hi)
+        fractions = [i / parts for i in range(1, parts)]
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT (percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY {self.key_sql}))::text[]
+                FROM {self.table}
+                WHERE {where}
+                """,
+                [fractions] + params,
+            )
+            return cur.fetchone()[0] or []
+
+    def values(self, lo, hi) -> dict:
+        where, params = self._where(lo, hi)
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT ({self.key_sql})::text, {self.value_sql} FROM {self.table} WHERE {where}", params)
+            return dict(cur.fetchall())
+
+
+class MongoSide:
+    """Range counts, split points and documents for the Mongo users collection.
+
+    Keys are Uids as text, as raw_users stores them. String bounds only
+    match string Uids, so the few documents whose Uid is not a string are
+    read once up front and placed among the string Uids by their text.
+    """
+
+    def __init__(self, coll, projection):
+        self.coll = coll
+        self.projection = projection
+        self.non_string = {
+            str(doc["Uid"]): doc
+            for doc in extract_mongo.read_range_cursor(coll, *extract_mongo.NON_STRING_UIDS, projection)
+            if doc.get("Uid") is not None
+        }
+
+    def original(self, key: str):
+        """Return the Uid value stored in Mongo for a text key."""
+        doc = self.non_string.get(key)
+        return key if doc is None else doc["Uid"]
+
+    def _non_string_between(self, lo, hi) -> dict:
+        return {
+            key: doc for key, doc in self.non_string.items()
+            if (lo is None or key >= lo) and (hi is None or key < hi)
+        }
+
+    @staticmethod
+    def _filter(lo, hi) -> dict:
+        condition = {"$type": "string"}
+        if lo is not None:
+            condition["$gte"] = lo
+        if hi is not None:
+            condition["$lt"] = hi
+        return {"Uid": condition}
+
+    def checksum(self, lo, hi) -> tuple:
+        count = self.coll.count_documents(self._filter(lo, hi)) + len(self._non_string_between(lo, hi))
+        return count, None
+
+    def split(self, lo, hi, parts: int) -> list:
+        buckets = self.coll.aggregate(
+            [
+                {"$match": self._filter(lo, hi)},
+                {"$bucketAuto": {"groupBy": "$Uid", "buckets": parts}},
+            ],
+            allowDiskUse=True,
+        )
+        return [bucket["_id"]["min"] for bucket in list(buckets)[1:]]
+
+    def values(self, lo, hi) -> dict:
+        docs = {doc["Uid"]: doc for doc in self.coll.find(self._filter(lo, hi), self.projection)}
+        docs.update(self._non_string_between(lo, hi))
+        return docs
+
+
+def diff_values(source: dict, target: dict, matches) -> dict:
+    """Split keys into missing (source only), extra (target only) and changed."""
+    return {
+        "missing": [k for k in source if k not in target],
+        "extra": [k for k in target if k not in source],
+        "changed": [k for k, v in source.items() if k in target and not matches(v, target[k])],
+    }
+
+
+def compare_ranges(source, target, matches, leaf_rows: int = LEAF_ROWS, fanout: int = FANOUT,
+                   check_all: bool = False, stats: dict = None):
+    """Yield (lo, hi, diff) for each leaf range whose rows had to be compared.
+
+    Ranges are [lo, hi) over the key; None is unbounded. With check_all,
+    ranges are descended and compared row by row even when their
+    checksums agree.
+    """
+    stats = stats if stats is not None else {}
+    stack = [(None, None)]
+    while stack:
+        lo, hi = stack.pop()
+        s_count, s_sum = source.checksum(lo, hi)
+        t_count, t_sum = target.checksum(lo, hi)
+        stats["ranges"] = stats.get("ranges", 0) + 1
+        if lo is None and hi is None:
+            stats["source_rows"], stats["target_rows"] = s_count, t_count
+
+        if s_count == t_count and s_sum == t_sum and not (check_all and s_count):
+            continue
+
+        if max(s_count, t_count) > leaf_rows:
+            larger = source if s_count >= t_count else target
+            bounds = []
+            for bound in larger.split(lo, hi, fanout):
+                if bound != lo and bound not in bounds:
+                    bounds.append(bound)
+            if bounds:
+                edges = [lo, *bounds, hi]
+                stack.extend(zip(edges, edges[1:]))
+                continue
+
+        stats["leaves"] = stats.get("leaves", 0) + 1
+        yield lo, hi, diff_values(source.values(lo, hi), target.values(lo, hi), matches)
+
+
+def repair_table(source_conn, target_conn, cfg: dict, keys: list) -> int:
+    """Re-copy keys from the source table; keys it no longer has are marked deleted."""
+    pk = cfg["primary_key"]
+    key_type = column_types(source_conn, cfg["source_table"])[pk]
+    with source_conn.cursor() as cur:
+        cur.execute(f"SELECT * FROM {cfg['source_table']} WHERE {pk} = ANY(%s::{key_type}[])", (keys,))
+        columns = [d.name for d in cur.description]
+        rows = cur.fetchall()
+
+    repaired = extract_postgres.upsert_into_raw(target_conn, cfg, columns, rows)
+    found = {str(r[columns.index(pk)]) for r in rows}
+    gone = [k for k in keys if k not in found]
+    if gone:
+        now = datetime.utcnow()
+        with target_conn.cursor() as cur:
+            cur.execute(
+                f"""
+                UPDATE {cfg['target_table']}
+                SET deleted_at = %s,
+                    extracted_at = %s
+                WHERE {pk} = ANY(%s::{key_type}[])
+                  AND deleted_at IS NULL
+                """,
+                (now, now, gone),
+            )
+            repaired += cur.rowcount
+    target_conn.commit()
+    return repaired
+
+
+def repair_users(conn, coll, hasher: RecordHasher, keys: list, extra: list) -> int:
+    """Reload keys from Mongo and mark extra uids deleted in raw_users.
+
+    keys are Uid values as stored in Mongo (see MongoSide.original); extra
+    are raw_users uids.
+    """
+    now = datetime.utcnow()
+    docs = coll.find({"Uid": {"$in": keys}}, extract_mongo.user_projection(hasher)) if keys else []
+    rows = [extract_mongo.user_row(doc, hasher(doc), now) for doc in docs]
+    repaired = extract_mongo.load_users(conn, rows) if rows else 0
+    if extra:
+        repaired += extract_mongo.mark_users_deleted(conn, extra, now, key_column="uid")
+    conn.commit()
+    return repaired
+
+
+def _summarise(name: str, stats: dict, totals: dict) -> dict:
+    summary = {"table": name, **stats, **totals}
+    logger.info(
+        "%s: %d source / %d raw rows, %d ranges checked, %d compared row by row; "
+        "%d missing, %d extra, %d changed, %d repaired",
+        name,
+        summary.get("source_rows", 0),
+        summary.get("target_rows", 0),
+        summary.get("ranges", 0),
+        summary.get("leaves", 0),
+        totals["missing"],
+        totals["extra"],
+        totals["changed"],
+        totals["repaired"],
+    )
+    return summary
+
+
+def reconcile_table(name: str, cfg: dict, leaf_rows: int = LEAF_ROWS, fanout: int = FANOUT,
+                    repair: bool = False) -> dict:
+    """Reconcile one TABLES_CONFIG table against its raw table."""
+    source_conn = extract_postgres.get_connection()
+    source_conn.autocommit = True
+    target_conn = extract_postgres.get_connection()
+    try:
+        source_types = column_types(source_conn, cfg["source_table"])
+        target_types = column_types(target_conn, cfg["target_table"])
+        columns = [c for c in source_types if c in target_types and c != "extracted_at"]
+
+        def row_md5(types):
+            return f"md5(ROW({', '.join(canonical_text(c, types[c]) for c in columns)})::text)"
+
+        pk = cfg["primary_key"]
+        source = PostgresSide(source_conn, cfg["source_table"], pk, row_md5(source_types))
+        target = PostgresSide(target_conn, cfg["target_table"], pk, row_md5(target_types))
+
+        stats = {}
+        totals = dict.fromkeys(("missing", "extra", "changed", "repaired"), 0)
+        for lo, hi, diff in compare_ranges(source, target, lambda a, b: a == b, leaf_rows, fanout, stats=stats):
+            for kind in ("missing", "extra", "changed"):
+                totals[kind] += len(diff[kind])
+            keys = diff["missing"] + diff["extra"] + diff["changed"]
+            if keys:
+                logger.info("%s: range [%s, %s) has %d mismatched keys", name, lo, hi, len(keys))
+                if repair:
+                    totals["repaired"] += repair_table(source_conn, target_conn, cfg, keys)
+            target_conn.rollback()
+        return _summarise(name, stats, totals)
+    finally:
+        source_conn.close()
+        target_conn.close()
+
+
+def reconcile_users(leaf_rows: int = LEAF_ROWS, fanout: int = FANOUT, repair: bool = False,
+                    verify_hashes: bool = False, hasher: RecordHasher = None) -> dict:
+    """Reconcile analytics.raw_users against the Mongo users collection."""
+    hasher = hasher or RecordHasher()
+    client = extract_mongo.get_mongo_client()
+    conn = extract_mongo.get_pg_connection()
+    try:
+        source = MongoSide(extract_mongo.get_users_collection(client), extract_mongo.user_projection(hasher, conn))
+        target = PostgresSide(
+            conn,
+            "analytics.raw_users",
+            'uid COLLATE "C"',
+            "record_hash",
+            checksum=False,
+        )
+
+        def matches(doc, stored_hash):
+            return hasher.compare(doc, stored_hash) != CHANGED
+
+        stats = {}
+        totals = dict.fromkeys(("missing", "extra", "changed", "repaired"), 0)
+        for lo, hi, diff in compare_ranges(source, target, matches, leaf_rows, fanout, verify_hashes, stats):
+            for kind in ("missing", "extra", "changed"):
+                totals[kind] += len(diff[kind])
+            stale = diff["missing"] + diff["changed"]
+            if stale or diff["extra"]:
+                logger.info("users: range [%s, %s) has %d mismatched uids", lo, hi, len(stale) + len(diff["extra"]))
+                if repair:
+                    keys = [source.original(key) for key in stale]
+                    totals["repaired"] += repair_users(conn, source.coll, hasher, keys, diff["extra"])
+            conn.rollback()
+        return _summarise(USERS, stats, totals)
+    finally:
+        conn.close()
+        client.close()
+        hasher.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - reconcile - %(levelname)s - %(message)s",
+                        force=True)
+
+    choices = list(extract_postgres.TABLES_CONFIG) + [USERS]
+    parser = argparse.ArgumentParser(description="Reconcile the analytics raw tables against their sources")
+    parser.add_argument("--tables", nargs="*", choices=choices, default=choices)
+    parser.add_argument("--leaf-rows", type=int, default=LEAF_ROWS,
+                        help="compare ranges row by row once they hold at most this many rows")
+    parser.add_argument("--fanout", type=int, default=FANOUT, help="sub-ranges per differing range")
+    parser.add_argument("--repair", action="store_true", help="re-copy mismatched rows from the source")
+    parser.add_argument("--verify-hashes", action="store_true",
+                        help="check record_hash for every user, not only in ranges whose counts differ")
+    args = parser.parse_args()
+
+    summaries = []
+    for table in args.tables:
+        if table == USERS:
+            summaries.append(reconcile_users(args.leaf_rows, args.fanout, args.repair, args.verify_hashes))
+        else:
+            summaries.append(reconcile_table(
+                table, extract_postgres.TABLES_CONFIG[table], args.leaf_rows, args.fanout, args.repair
+            ))
+
+    unresolved = [
+        s["table"] for s in summaries
+        if s["missing"] + s["extra"] + s["changed"] and not args.repair
+    ]
+    if unresolved:
+        logger.error("Raw layer differs from source for: %s", ", ".join(unresolved))
+        sys.exit(1)
@@ -3,13 +3,20 @@ Nomba Data Engineer Assessment - Sample Data Generator
 -------------------------------------------------------
 Generates realistic test data for MongoDB (users)
 and PostgreSQL (savings transactions and plans).
-Supports incremental updates for CDC simulation.
+Supports incremental updates for CDC simulation, and a --scale mode that
+generates columns with NumPy in deterministic, seed-derived chunks and
+COPYs them straight into Postgres for million-row load tests.
 """
 
+import io
+import json
+import time
 import random
 import uuid
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+from multiprocessing import Pool
+import numpy as np
+from pymongo import ASCENDING, MongoClient
 import psycopg2
 from psycopg2.extras import execute_values
 from faker import Faker
@@ -20,11 +27,10 @@ import os
 
 # CONFIGURATION
 
-# MongoDB Atlas connection
-MONGO_URI = (
-    "mongodb+srv://myekini:muhammadyk@"
-    "nomba-cluster.mtjrdmh.mongodb.net/?retryWrites=true&w=majority&appName=nomba-cluster"
-)
+# MongoDB connection, read from the environment like the CDC jobs
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "nomba_users")
+MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "nomba")
 
 # PostgreSQL (Aiven) connection
 POSTGRES_SOURCE_URI = (
@@ -156,17 +162,13 @@ def insert_users_to_mongodb(users):
 
     coll.delete_many({})
     coll.insert_many(users)
+    coll.create_index([("Uid", ASCENDING)])
     print(f"Inserted {len(users)} users into MongoDB collection 'nomba_users.nomba'")
     client.close()
 
 
-def insert_data_to_postgres(plans, transactions):
-    """Insert generated savings plans and transactions into PostgreSQL."""
-    print("Connecting to PostgreSQL (Aiven)...")
-    conn = psycopg2.connect(POSTGRES_SOURCE_URI)
-    cur = conn.cursor()
-
-    # Create tables if they do not exist
+def create_source_tables(cur):
+    """Create the source savings tables if they do not exist."""
     cur.execute("""
         CREATE TABLE IF NOT EXISTS savings_plan (
             plan_id UUID PRIMARY KEY,
@@ -197,6 +199,15 @@ def insert_data_to_postgres(plans, transactions):
         )
     """)
 
+
+def insert_data_to_postgres(plans, transactions):
+    """Insert generated savings plans and transactions into PostgreSQL."""
+    print("Connecting to PostgreSQL (Aiven)...")
+    conn = psycopg2.connect(POSTGRES_SOURCE_URI)
+    cur = conn.cursor()
+
+    create_source_tables(cur)
+
     # Reset tables for clean data load
     cur.execute("TRUNCATE savingstransaction, savings_plan RESTART IDENTITY CASCADE")
 
@@ -262,6 +273,477 @@ def generate_incremental_updates(user_count=5, txn_count=20):
     print(f"Inserted {txn_count} new transactions into PostgreSQL.")
 
 
+# SCALE MODE (NumPy chunks + COPY)
+
+KIND_USERS, KIND_PLANS, KIND_TRANSACTIONS = 1, 2, 3
+NAME_POOL_SIZE = 2000
+RATE_RANGES = {"USD": (1500, 1650), "GBP": (1900, 2100), "EUR": (1600, 1800)}
+
+
+def _chunk_rng(seed, kind, chunk_index):
+    """Return the RNG for one chunk; output does not depend on worker count."""
+    return np.random.default_rng([seed, kind, chunk_index])
+
+
+def _splitmix64(x):
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def _index_hex(seed, kind, indices):
+    """Return 32-char hex strings derived from (seed, kind, row index).
+
+    Plans are generated in different chunks than the transactions that
+    reference them, so their ids must be computable from the index alone.
+    """
+    with np.errstate(over="ignore"):
+        key = indices.astype(np.uint64) * np.uint64(8) + np.uint64(kind) + (np.uint64(seed) << np.uint64(40))
+    halves = np.stack([_splitmix64(key), _splitmix64(key ^ np.uint64(0xA5A5A5A5A5A5A5A5))], axis=1)
+    raw = halves.astype(">u8").view(np.uint8).reshape(-1, 16)
+    hexed = raw.tobytes().hex()
+    return [hexed[i:i + 32] for i in range(0, len(hexed), 32)]
+
+
+def _index_uuids(seed, kind, indices):
+    """Return version-4 formatted UUID strings derived from row indices."""
+    return np.array([
+        f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{'89ab'[int(h[16], 16) & 3]}{h[17:20]}-{h[20:]}"
+        for h in _index_hex(seed, kind, indices)
+    ])
+
+
+def _uids(indices):
+    return np.char.add("user_", np.char.zfill((indices + 1).astype(str), 6))
+
+
+def _timestamps(anchor, seconds):
+    """Format anchor + seconds as ISO timestamps; NaN seconds become NULL."""
+    base = np.datetime64(anchor, "s")
+    stamps = base + np.nan_to_num(seconds).astype("timedelta64[s]")
+    return np.where(np.isnan(seconds), "\\N", stamps.astype(str))
+
+
+def _copy_text(columns):
+    """Join equal-length string columns into COPY text format."""
+    rows = columns[0]
+    for col in columns[1:]:
+        rows = np.char.add(np.char.add(rows, "\t"), col)
+    return "\n".join(rows.tolist()) + "\n"
+
+
+def _name_pools(seed):
+    pool_fake = Faker()
+    pool_fake.seed_instance(seed)
+    first = np.array([pool_fake.first_name() for _ in range(NAME_POOL_SIZE)])
+    last = np.array([pool_fake.last_name() for _ in range(NAME_POOL_SIZE)])
+    return first, last
+
+
+def scale_user_docs(seed, chunk_index, start, count, first_names, last_names):
+    """Generate one chunk of Mongo user documents."""
+    rng = _chunk_rng(seed, KIND_USERS, chunk_index)
+    idx = np.arange(start, start + count)
+    ids = [h[:24] for h in _index_hex(seed, KIND_USERS, idx)]
+    uids = _uids(idx)
+    firsts = first_names[rng.integers(0, len(first_names), count)]
+    lasts = last_names[rng.integers(0, len(last_names), count)]
+    occupations = np.array(OCCUPATIONS)[rng.integers(0, len(OCCUPATIONS), count)]
+    states = np.array(NIGERIAN_STATES)[rng.integers(0, len(NIGERIAN_STATES), count)]
+    return [
+        {"_id": _id, "Uid": uid, "firstName": f, "lastName": l, "occupation": o, "state": st}
+        for _id, uid, f, l, o, st in zip(
+            ids, uids.tolist(), firsts.tolist(), lasts.tolist(), occupations.tolist(), states.tolist()
+        )
+    ]
+
+
+def scale_plan_copy(seed, chunk_index, start, count, user_count, anchor):
+    """Generate one chunk of savings_plan rows as COPY text."""
+    rng = _chunk_rng(seed, KIND_PLANS, chunk_index)
+    day = 86_400
+    window_start = anchor - timedelta(days=730)
+    start_days = rng.integers(0, 701, count)
+    end_days = start_days + rng.integers(30, 366, count)
+    ended = np.datetime64(window_start, "D") + end_days.astype("timedelta64[D]") < np.datetime64(anchor, "D")
+
+    status = np.where(
+        ended,
+        np.array(["completed", "cancelled"])[rng.integers(0, 2, count)],
+        np.array(["active", "active", "active", "paused"])[rng.integers(0, 4, count)],
+    )
+    created = start_days * float(day)
+    updated = created + rng.integers(0, 31, count) * float(day)
+    deleted = np.where(status == "cancelled", end_days * float(day), np.nan)
+
+    start_dates = (np.datetime64(window_start, "D") + start_days.astype("timedelta64[D]")).astype(str)
+    end_dates = (np.datetime64(window_start, "D") + end_days.astype("timedelta64[D]")).astype(str)
+
+    return _copy_text([
+        np.array(_index_uuids(seed, KIND_PLANS, np.arange(start, start + count))),
+        np.array(PRODUCT_TYPES)[rng.integers(0, len(PRODUCT_TYPES), count)],
+        _uids(rng.integers(0, user_count, count)),
+        np.char.mod("%.2f", rng.uniform(5_000, 1_000_000, count)),
+        np.array(FREQUENCIES)[rng.integers(0, len(FREQUENCIES), count)],
+        start_dates,
+        end_dates,
+        status,
+        _timestamps(window_start, created),
+        _timestamps(window_start, updated),
+        _timestamps(window_start, deleted),
+    ])
+
+
+def scale_transaction_copy(seed, chunk_index, start, count, plan_count, anchor):
+    """Generate one chunk of savingstransaction rows as COPY text."""
+    rng = _chunk_rng(seed, KIND_TRANSACTIONS, chunk_index)
+    window_start = anchor - timedelta(days=730)
+    offsets = (
+        rng.integers(0, 731, count) * 86_400
+        + rng.integers(0, 24, count) * 3_600
+        + rng.integers(0, 60, count) * 60
+    ).astype(float)
+
+    currency_idx = rng.integers(0, len(CURRENCIES), count)
+    currency = np.array(CURRENCIES)[currency_idx]
+    is_ngn = currency == "NGN"
+    amount = np.where(is_ngn, rng.uniform(1_000, 500_000, count), rng.uniform(10, 5_000, count))
+    low = np.array([RATE_RANGES.get(c, (1, 1))[0] for c in CURRENCIES])[currency_idx]
+    high = np.array([RATE_RANGES.get(c, (1, 1))[1] for c in CURRENCIES])[currency_idx]
+    rate = np.where(is_ngn, 1.0, rng.uniform(low, high))
+
+    deleted = np.where(
+        rng.random(count) < 0.05,
+        offsets + rng.integers(1, 49, count) * 3_600,
+        np.nan,
+    )
+    txn_times = _timestamps(window_start, offsets)
+
+    return _copy_text([
+        np.array(_index_uuids(seed, KIND_TRANSACTIONS, np.arange(start, start + count))),
+        np.array(_index_uuids(seed, KIND_PLANS, rng.integers(0, plan_count, count))),
+        np.char.mod("%.2f", amount),
+        currency,
+        np.array(TRANSACTION_SIDES)[rng.integers(0, len(TRANSACTION_SIDES), count)],
+        np.char.mod("%.2f", rate),
+        txn_times,
+        txn_times,
+        _timestamps(window_start, deleted),
+    ])
+
+
+def _run_scale_task(task):
+    """Generate and load one chunk; runs in a worker process when --workers > 1."""
+    kind, args, (mongo_uri, mongo_db, mongo_collection) = task
+    if kind == KIND_USERS:
+        client = MongoClient(mongo_uri)
+        try:
+            client[mongo_db][mongo_collection].insert_many(scale_user_docs(*args), ordered=False)
+        finally:
+            client.close()
+        return kind, args[3]
+
+    if kind == KIND_PLANS:
+        table, text = "savings_plan", scale_plan_copy(*args)
+    else:
+        table, text = "savingstransaction", scale_transaction_copy(*args)
+
+    conn = psycopg2.connect(POSTGRES_SOURCE_URI)
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(f"COPY {table} FROM STDIN", io.StringIO(text))
+        conn.commit()
+    finally:
+        conn.close()
+    return kind, args[3]
+
+
+def _chunks(kind, total, chunk_size, *extra):
+    return [
+        (kind, (extra[0], i, start, min(chunk_size, total - start)) + extra[1:])
+        for i, start in enumerate(range(0, total, chunk_size))
+    ]
+
+
+def generate_at_scale(users, plans, transactions, seed=42, chunk_size=100_000, workers=1, anchor=None,
+                      mongo_uri=None, mongo_db=MONGO_DB, mongo_collection=MONGO_COLLECTION):
+    """Generate and load a production-sized dataset in deterministic chunks.
+
+    Users go to mongo_db.mongo_collection at mongo_uri (MONGO_URI when
+    None), which is dropped first.
+    """
+    mongo_uri = mongo_uri or MONGO_URI
+    if not mongo_uri:
+        raise ValueError("MONGO_URI is not set; --scale drops and reloads the users collection it names")
+    anchor = anchor or datetime.combine(datetime.now().date(), datetime.min.time())
+    first_names, last_names = _name_pools(seed)
+
+    client = MongoClient(mongo_uri)
+    coll = client[mongo_db][mongo_collection]
+    coll.drop()
+
+    conn = psycopg2.connect(POSTGRES_SOURCE_URI)
+    with conn.cursor() as cur:
+        create_source_tables(cur)
+        cur.execute("TRUNCATE savingstransaction, savings_plan RESTART IDENTITY CASCADE")
+    conn.commit()
+
+    target = (mongo_uri, mongo_db, mongo_collection)
+    tasks = [
+        task + (target,)
+        for task in _chunks(KIND_USERS, users, chunk_size, seed, first_names, last_names)
+        + _chunks(KIND_PLANS, plans, chunk_size, seed, users, anchor)
+        + _chunks(KIND_TRANSACTIONS, transactions, chunk_size, seed, plans, anchor)
+    ]
+    names = {KIND_USERS: "users", KIND_PLANS: "plans", KIND_TRANSACTIONS: "transactions"}
+    loaded = {name: 0 for name in names.values()}
+
+    print(f"Generating {users:,} users, {plans:,} plans and {transactions:,} transactions "
+          f"in {len(tasks)} chunks with {workers} worker(s)...")
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = pool.imap_unordered(_run_scale_task, tasks)
+            for kind, count in results:
+                loaded[names[kind]] += count
+    else:
+        for kind, count in map(_run_scale_task, tasks):
+            loaded[names[kind]] += count
+
+    coll.create_index([("Uid", ASCENDING)])
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE savings_plan")
+        cur.execute("ANALYZE savingstransaction")
+    conn.commit()
+    conn.close()
+    client.close()
+
+    print("Scale load complete:", ", ".join(f"{v:,} {k}" for k, v in loaded.items()))
+
+
+# CDC WORKLOAD SIMULATOR
+
+SIM_OPS = ("insert", "update", "soft_delete", "hard_delete")
+SIM_SOURCES = ("mongodb_users", "savings_plan", "savingstransaction")
+DEFAULT_MIX = "insert=0.4,update=0.4,soft_delete=0.15,hard_delete=0.05"
+SIM_KEY_SAMPLE = 10_000
+
+RAW_LAG_QUERIES = {
+    "mongodb_users": """
+        SELECT uid, GREATEST(extracted_at, updated_at) AT TIME ZONE 'UTC'
+        FROM analytics.raw_users WHERE uid = ANY(%s)
+    """,
+    "savings_plan": """
+        SELECT plan_id::text, extracted_at AT TIME ZONE 'UTC'
+        FROM analytics.raw_savings_plan WHERE plan_id = ANY(%s::uuid[])
+    """,
+    "savingstransaction": """
+        SELECT txn_id::text, extracted_at AT TIME ZONE 'UTC'
+        FROM analytics.raw_savingstransaction WHERE txn_id = ANY(%s::uuid[])
+    """,
+}
+
+
+def parse_mix(spec):
+    """Parse "insert=0.4,update=0.4,..." into normalised operation weights."""
+    weights = dict.fromkeys(SIM_OPS, 0.0)
+    for part in spec.split(","):
+        op, _, weight = part.partition("=")
+        if op.strip() not in weights:
+            raise ValueError(f"Unknown operation {op!r} in mix; expected {SIM_OPS}")
+        weights[op.strip()] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Operation mix must have a positive weight")
+    return {op: w / total for op, w in weights.items()}
+
+
+class CdcSimulator:
+    """Applies a paced mix of changes to all three sources and logs commit times."""
+
+    def __init__(self, changelog_path, mix):
+        # Write to the collection the CDC job reads (MONGO_URI, MONGO_DB,
+        # MONGO_COLLECTION), or measure_lag could never see Mongo changes.
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdc"))
+        import extract_mongo
+
+        self.mix = mix
+        self.changelog = open(changelog_path, "a")
+        self.client = extract_mongo.get_mongo_client()
+        self.users = extract_mongo.get_users_collection(self.client)
+        self.conn = psycopg2.connect(POSTGRES_SOURCE_URI)
+        self.conn.autocommit = True
+        self.keys = {source: [] for source in SIM_SOURCES}
+        self._load_keys()
+
+    def _load_keys(self):
+        sample = self.users.aggregate([{"$sample": {"size": SIM_KEY_SAMPLE}}, {"$project": {"Uid": 1}}])
+        self.keys["mongodb_users"] = [d["Uid"] for d in sample if d.get("Uid")]
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT plan_id::text FROM savings_plan WHERE deleted_at IS NULL LIMIT %s",
+                        (SIM_KEY_SAMPLE,))
+            self.keys["savings_plan"] = [r[0] for r in cur.fetchall()]
+            cur.execute("SELECT txn_id::text FROM savingstransaction WHERE deleted_at IS NULL LIMIT %s",
+                        (SIM_KEY_SAMPLE,))
+            self.keys["savingstransaction"] = [r[0] for r in cur.fetchall()]
+
+    def _pick(self, source, remove=False):
+        keys = self.keys[source]
+        if not keys:
+            return None
+        i = random.randrange(len(keys))
+        if remove:
+            keys[i], keys[-1] = keys[-1], keys[i]
+            return keys.pop()
+        return keys[i]
+
+    def _log(self, source, key, op):
+        self.changelog.write(json.dumps({
+            "source": source,
+            "key": key,
+            "op": op,
+            "committed_at": datetime.utcnow().isoformat(),
+        }) + "\n")
+
+    def _mongo_op(self, op):
+        if op == "insert":
+            user = generate_users(1)[0]
+            user["Uid"] = f"user_sim_{uuid.uuid4().hex[:12]}"
+            self.users.insert_one(user)
+            self.keys["mongodb_users"].append(user["Uid"])
+            return user["Uid"]
+        # Mongo users have no soft-delete flag, so both delete kinds remove the document.
+        uid = self._pick("mongodb_users", remove=op != "update")
+        if uid is None:
+            return None
+        if op == "update":
+            self.users.update_one({"Uid": uid}, {"$set": {
+                "occupation": random.choice(OCCUPATIONS),
+                "state": random.choice(NIGERIAN_STATES),
+            }})
+        else:
+            self.users.delete_one({"Uid": uid})
+        return uid
+
+    def _postgres_op(self, source, op):
+        now = datetime.utcnow()
+        pk = "plan_id" if source == "savings_plan" else "txn_id"
+        with self.conn.cursor() as cur:
+            if op == "insert":
+                if source == "savings_plan":
+                    row = generate_savings_plans(self.keys["mongodb_users"] or ["user_000001"], 1)[0]
+                else:
+                    plan_id = self._pick("savings_plan")
+                    if plan_id is None:
+                        return None
+                    row = generate_savings_transactions([plan_id], 1)[0]
+                    row["deleted_at"] = None
+                row["updated_at"] = now
+                cur.execute(
+                    f"INSERT INTO {source} ({', '.join(row)}) VALUES ({', '.join(['%s'] * len(row))})",
+                    list(row.values()),
+                )
+                key = str(row[pk])
+                self.keys[source].append(key)
+                return key
+
+            key = self._pick(source, remove=op != "update")
+            if key is None:
+                return None
+            if op == "update":
+                cur.execute(
+                    f"UPDATE {source} SET amount = ROUND((amount * %s)::numeric, 2), updated_at = %s "
+                    f"WHERE {pk} = %s",
+                    (random.uniform(0.9, 1.1), now, key),
+                )
+            elif op == "soft_delete":
+                cur.execute(f"UPDATE {source} SET deleted_at = %s WHERE {pk} = %s", (now, key))
+            else:
+                cur.execute(f"DELETE FROM {source} WHERE {pk} = %s", (key,))
+            return key
+
+    def step(self):
+        """Apply one randomly chosen change and log its commit time."""
+        op = random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        source = random.choice(SIM_SOURCES)
+        if source == "mongodb_users":
+            key = self._mongo_op(op)
+        else:
+            key = self._postgres_op(source, op)
+        if key is not None:
+            self._log(source, key, op)
+        return key is not None
+
+    def run(self, ops_per_sec, duration):
+        """Emit changes at ops_per_sec for duration seconds (0 runs until interrupted)."""
+        interval = 1.0 / ops_per_sec
+        started = time.monotonic()
+        next_at = started
+        applied = 0
+        try:
+            while not duration or time.monotonic() - started < duration:
+                applied += self.step()
+                next_at += interval
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if applied and applied % max(1, int(ops_per_sec * 10)) == 0:
+                    rate = applied / (time.monotonic() - started)
+                    print(f"{applied:,} changes applied ({rate:.1f} ops/s)")
+                    self.changelog.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+        print(f"Simulation finished: {applied:,} changes logged")
+
+    def close(self):
+        self.changelog.close()
+        self.conn.close()
+        self.client.close()
+
+
+def measure_lag(changelog_path):
+    """Report end-to-end lag from the logged commit times to the raw layer.
+
+    Lag is measured to the latest load of each key, so repeated changes to
+    one key make earlier changes look slower than they were. Hard deletes
+    only show up with the logical replication engine or a Mongo sync.
+    """
+    entries = {source: [] for source in SIM_SOURCES}
+    with open(changelog_path) as f:
+        for line in f:
+            entry = json.loads(line)
+            entries[entry["source"]].append(entry)
+
+    conn = psycopg2.connect(POSTGRES_SOURCE_URI)
+    try:
+        for source, logged in entries.items():
+            if not logged:
+                continue
+            with conn.cursor() as cur:
+                cur.execute(RAW_LAG_QUERIES[source], (list({e["key"] for e in logged}),))
+                loaded_at = dict(cur.fetchall())
+
+            lags, missing = [], 0
+            for e in logged:
+                loaded = loaded_at.get(e["key"])
+                committed = datetime.fromisoformat(e["committed_at"])
+                if loaded is None or loaded < committed:
+                    missing += 1
+                else:
+                    lags.append((loaded - committed).total_seconds())
+
+            if lags:
+                p50, p95 = np.percentile(lags, [50, 95])
+                print(f"{source:<20} {len(lags):>8,} captured  p50 {p50:8.2f}s  p95 {p95:8.2f}s  "
+                      f"max {max(lags):8.2f}s  {missing:,} not yet in raw layer")
+            else:
+                print(f"{source:<20} none of {len(logged):,} changes in raw layer yet")
+    finally:
+        conn.close()
+
 
 # MAIN
 def main():
@@ -270,11 +752,30 @@ def main():
     parser.add_argument("--plans", type=int, default=500)
     parser.add_argument("--transactions", type=int, default=5000)
     parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--scale", action="store_true",
+                        help="NumPy chunked generation loaded with COPY, for large datasets")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--simulate", action="store_true",
+                        help="continuously emit a mix of changes across all sources")
+    parser.add_argument("--ops-per-sec", type=float, default=20.0)
+    parser.add_argument("--duration", type=float, default=300.0, help="seconds; 0 runs until interrupted")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--changelog", default="cdc_changelog.jsonl")
+    parser.add_argument("--measure-lag", action="store_true",
+                        help="report lag from --changelog commit times into analytics.raw_*")
 
     args = parser.parse_args()
 
-    if args.incremental:
+    if args.measure_lag:
+        measure_lag(args.changelog)
+    elif args.simulate:
+        CdcSimulator(args.changelog, parse_mix(args.mix)).run(args.ops_per_sec, args.duration)
+    elif args.incremental:
         generate_incremental_updates()
+    elif args.scale:
+        generate_at_scale(args.users, args.plans, args.transactions, args.seed, args.chunk_size, args.workers)
     else:
         users = generate_users(args.users)
         user_ids = [u["Uid"] for u in users]
@@ -0,0 +1,18 @@
+{#
+    Lower bound for an incremental model's CDC filter: the newest value of
+    `column` already in {{ this }}, minus the `incremental_lookback_hours`
+    var. The watermark is looked up first and inlined as a literal so the
+    planner can use the BRIN indexes on the raw tables' CDC columns. It
+    does not prune partitions: raw_savingstransaction is partitioned on
+    txn_timestamp, so each monthly partition's BRIN index is still probed.
+    txn_timestamp is not bounded as well, since a late or backdated
+    transaction can land in any month.
+#}
+{% macro incremental_lower_bound(column='extracted_at') %}
+    {%- set query -%}
+        SELECT COALESCE(MAX({{ column }}), '1970-01-01'::timestamptz) FROM {{ this }}
+    {%- endset -%}
+    {%- set result = run_query(query) if execute else none -%}
+    {%- set watermark = result.columns[0].values()[0] if result else '1970-01-01' -%}
+    ('{{ watermark }}'::timestamptz - INTERVAL '{{ var("incremental_lookback_hours") }} hours')
+{%- endmacro %}
@@ -0,0 +1,33 @@
+{#
+    Watermark kept in a one-row side table, <model>_watermark, for models
+    whose own rows cannot carry it: when every transaction on a date is
+    deleted or moved away, the date's rows are gone, and MAX() over the
+    model would stop advancing. record_watermark() stores the newest value
+    of `column` in `relation` in a post-hook, in the model's transaction.
+#}
+{% macro watermark_relation() %}
+    {{- this.schema }}.{{ this.identifier }}_watermark
+{%- endmacro %}
+
+{#
+    Like incremental_lower_bound(), but from the recorded watermark. Falls
+    back to incremental_lower_bound(fallback_column) until one is recorded.
+#}
+{% macro recorded_lower_bound(fallback_column) %}
+    {%- set state = adapter.get_relation(
+        database=this.database, schema=this.schema, identifier=this.identifier ~ '_watermark'
+    ) if execute else none -%}
+    {%- set result = run_query('SELECT MAX(watermark) FROM ' ~ state) if state is not none else none -%}
+    {%- set watermark = result.columns[0].values()[0] if result else none -%}
+    {%- if watermark is none -%}
+        {{ incremental_lower_bound(fallback_column) }}
+    {%- else -%}
+        ('{{ watermark }}'::timestamptz - INTERVAL '{{ var("incremental_lookback_hours") }} hours')
+    {%- endif -%}
+{%- endmacro %}
+
+{% macro record_watermark(relation, column='extracted_at') %}
+    CREATE TABLE IF NOT EXISTS {{ watermark_relation() }} (watermark TIMESTAMPTZ);
+    DELETE FROM {{ watermark_relation() }};
+    INSERT INTO {{ watermark_relation() }} SELECT MAX({{ column }}) FROM {{ relation }};
+{% endmacro %}
@@ -0,0 +1,19 @@
+{#
+    Transaction dates with a staging row extracted after lower_bound. Soft
+    deletes count too: staging keeps deleted transactions (is_deleted) with
+    a fresh extracted_at even though the fact table drops them. A
+    transaction whose txn_timestamp moved to another day also touches the
+    day it left (previous_transaction_date).
+#}
+{% macro touched_transaction_dates(lower_bound) %}
+    SELECT DATE(txn_timestamp) AS transaction_date
+    FROM {{ ref('stg_savings_transactions') }}
+    WHERE extracted_at > {{ lower_bound }}
+
+    UNION
+
+    SELECT previous_transaction_date
+    FROM {{ ref('stg_savings_transactions') }}
+    WHERE extracted_at > {{ lower_bound }}
+      AND previous_transaction_date IS NOT NULL
+{% endmacro %}
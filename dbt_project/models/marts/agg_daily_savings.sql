@@ -0,0 +1,111 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='append',
+    indexes=[
+        {'columns': ['transaction_date']},
+        {'columns': ['user_id', 'transaction_date']}
+    ],
+    pre_hook="
+        {% if is_incremental() %}
+        DELETE FROM {{ this }}
+        WHERE transaction_date IN (
+            {{ touched_transaction_dates(recorded_lower_bound('source_extracted_at')) }}
+        )
+        {% endif %}
+    ",
+    post_hook="{{ record_watermark(ref('stg_savings_transactions')) }}"
+) }}
+
+-- Daily savings per user, currency and side, with totals in the original
+-- currency and normalised to NGN (amount * rate; NGN rows have rate 1).
+-- Incremental runs rebuild only the dates touched by transactions
+-- extracted since the last run, deletes included: the pre-hook removes
+-- those dates and they are re-aggregated from the fact table in the same
+-- transaction. A transaction whose txn_timestamp moved to another day
+-- touches both days, through staging's previous_transaction_date.
+--
+-- The watermark is the newest staging extraction processed, soft deletes
+-- included, recorded by the post-hook in agg_daily_savings_watermark. The
+-- fact table drops deleted rows, and a date whose transactions were all
+-- deleted or moved keeps no row here, so neither could carry it.
+-- source_extracted_at, the newest staging extraction on each date, is the
+-- fallback before a watermark has been recorded. Users
+-- are grouped by the fact's user_id, which does not depend on a dim_users
+-- version being valid at txn_timestamp.
+
+{% if is_incremental() %}
+    {% set lower_bound = recorded_lower_bound('source_extracted_at') %}
+{% endif %}
+
+WITH staged_dates AS (
+    SELECT
+        DATE(txn_timestamp) AS transaction_date,
+        extracted_at
+    FROM {{ ref('stg_savings_transactions') }}
+    {% if is_incremental() %}
+    WHERE extracted_at > {{ lower_bound }}
+
+    UNION ALL
+
+    SELECT
+        previous_transaction_date,
+        extracted_at
+    FROM {{ ref('stg_savings_transactions') }}
+    WHERE extracted_at > {{ lower_bound }}
+      AND previous_transaction_date IS NOT NULL
+    {% endif %}
+),
+
+touched AS (
+    SELECT
+        transaction_date,
+        MAX(extracted_at) AS source_extracted_at
+    FROM staged_dates
+    GROUP BY transaction_date
+),
+
+tx AS (
+    SELECT
+        f.transaction_date,
+        f.user_id,
+        f.currency,
+        f.side,
+        f.amount,
+        f.rate,
+        f.extracted_at,
+        t.source_extracted_at
+    FROM {{ ref('fact_savings_transactions') }} f
+    JOIN touched t ON t.transaction_date = f.transaction_date
+),
+
+daily AS (
+    SELECT
+        transaction_date,
+        user_id,
+        currency,
+        side,
+        COUNT(*) AS txn_count,
+        SUM(amount) AS total_amount,
+        SUM(amount * rate) AS total_amount_ngn,
+        MAX(extracted_at) AS last_extracted_at,
+        MAX(source_extracted_at) AS source_extracted_at
+    FROM tx
+    GROUP BY transaction_date, user_id, currency, side
+)
+
+SELECT
+    d.transaction_date,
+    dd.year,
+    dd.month,
+    dd.month_name,
+    dd.day_name,
+    d.user_id,
+    d.currency,
+    d.side,
+    d.txn_count,
+    d.total_amount,
+    d.total_amount_ngn,
+    d.last_extracted_at,
+    d.source_extracted_at
+FROM daily d
+LEFT JOIN {{ ref('dim_date') }} dd ON dd.date_day = d.transaction_date
@@ -1,8 +1,24 @@
 {{ config(
     materialized='incremental',
-    unique_key='txn_id'
+    unique_key='txn_id',
+    incremental_strategy='delete+insert',
+    indexes=[
+        {'columns': ['txn_id'], 'unique': True},
+        {'columns': ['transaction_date']}
+    ],
+    post_hook="DELETE FROM {{ this }} WHERE is_deleted"
 ) }}
 
+-- Incremental runs take every staging row extracted since the last run,
+-- deletes included: delete+insert replaces the previous version of each
+-- txn_id, then the post-hook drops the soft-deleted ones. user_key is the
+-- dim_users version valid at txn_timestamp (NULL when none is, e.g. after
+-- the user was deleted); user_id is always the plan's owner.
+
+{% if is_incremental() %}
+    {% set lower_bound = incremental_lower_bound('extracted_at') %}
+{% endif %}
+
 WITH tx AS (
     SELECT
         txn_id,
@@ -13,36 +29,54 @@ WITH tx AS (
         side,
         rate,
         txn_timestamp,
-        is_deleted
+        is_deleted,
+        extracted_at
     FROM {{ ref('stg_savings_transactions') }}
-    WHERE NOT is_deleted
-),
+    {% if is_incremental() %}
+    WHERE extracted_at > {{ lower_bound }}
 
-users AS (
+    UNION
+
+    -- Transactions on or after a user version opened or closed since the
+    -- last run now resolve to a different user_key.
     SELECT
-        user_key,
-        user_id
-    FROM {{ ref('dim_users') }}
-    WHERE is_current = TRUE
+        t.txn_id,
+        t.plan_id,
+        t.user_id,
+        t.amount,
+        t.currency,
+        t.side,
+        t.rate,
+        t.txn_timestamp,
+        t.is_deleted,
+        t.extracted_at
+    FROM {{ ref('dim_users') }} d
+    JOIN {{ ref('stg_savings_transactions') }} t
+        ON t.user_id = d.user_id
+       AND t.txn_timestamp >= CASE WHEN d.is_current THEN d.effective_start_date ELSE d.effective_end_date END
+    WHERE d.source_updated_at > {{ lower_bound }}
+    {% endif %}
 ),
 
 joined AS (
     SELECT
         t.txn_id,
         u.user_key,
+        t.user_id,
         t.plan_id,
         t.amount,
         t.currency,
         t.side,
         t.rate,
         t.txn_timestamp,
-        DATE(t.txn_timestamp) AS transaction_date
+        DATE(t.txn_timestamp) AS transaction_date,
+        t.is_deleted,
+        t.extracted_at
     FROM tx t
-    LEFT JOIN users u ON t.user_id = u.user_id
+    LEFT JOIN {{ ref('dim_users') }} u
+        ON u.user_id = t.user_id
+       AND t.txn_timestamp >= u.effective_start_date
+       AND t.txn_timestamp < u.effective_end_date
 )
 
 SELECT * FROM joined
-
-{% if is_incremental() %}
-WHERE txn_timestamp > (SELECT COALESCE(MAX(txn_timestamp), '1970-01-01') FROM {{ this }})
-{% endif %}
\ No newline at end of file
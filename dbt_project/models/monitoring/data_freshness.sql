@@ -1,31 +1,19 @@
 {{ config(materialized='view') }}
 
--- Check data freshness across all raw tables
-WITH user_freshness AS (
-    SELECT
-        'raw_users' AS table_name,
-        MAX(extracted_at) AS last_update,
-        CURRENT_TIMESTAMP - MAX(extracted_at) AS staleness
-    FROM analytics.raw_users
-),
-plan_freshness AS (
-    SELECT
-        'raw_savings_plan' AS table_name,
-        MAX(extracted_at) AS last_update,
-        CURRENT_TIMESTAMP - MAX(extracted_at) AS staleness
-    FROM analytics.raw_savings_plan
-),
-txn_freshness AS (
-    SELECT
-        'raw_savingstransaction' AS table_name,
-        MAX(extracted_at) AS last_update,
-        CURRENT_TIMESTAMP - MAX(extracted_at) AS staleness
-    FROM analytics.raw_savingstransaction
-)
-
--- Combine all freshness checks
-SELECT * FROM user_freshness
-UNION ALL
-SELECT * FROM plan_freshness
-UNION ALL
-SELECT * FROM txn_freshness
\ No newline at end of file
+-- Freshness, volume and lag per raw table, read from the stats the CDC jobs
+-- keep in cdc_metadata as they load. One row per source: no raw table is
+-- scanned, so the cost does not grow with the data.
+SELECT
+    CASE source_name
+        WHEN 'mongodb_users' THEN 'raw_users'
+        ELSE 'raw_' || SUBSTRING(source_name FROM 'postgres_(.*)')
+    END AS table_name,
+    source_name,
+    last_loaded_at AS last_update,
+    CURRENT_TIMESTAMP - last_loaded_at AS staleness,
+    last_extracted_timestamp AS source_watermark,
+    rows_last_run,
+    max_lag_seconds,
+    last_extraction_status,
+    updated_at AS last_run_at
+FROM {{ source('analytics', 'cdc_metadata') }}
@@ -11,5 +11,5 @@ SELECT
     created_at,
     updated_at,
     extracted_at
-FROM analytics.raw_savings_plan
+FROM {{ source('analytics', 'raw_savings_plan') }}
 WHERE deleted_at IS NULL
\ No newline at end of file
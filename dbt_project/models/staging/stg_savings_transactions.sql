@@ -1,35 +1,86 @@
-{{ config(materialized='incremental', unique_key='txn_id') }}
-WITH base AS (
+{{ config(
+    materialized='incremental',
+    unique_key='txn_id',
+    incremental_strategy='delete+insert',
+    indexes=[
+        {'columns': ['txn_id'], 'unique': True},
+        {'columns': ['user_id', 'txn_timestamp']},
+        {'columns': ['extracted_at'], 'type': 'brin'}
+    ]
+) }}
+
+-- Incremental runs pick up transactions extracted since the last run, plus
+-- transactions whose plan was re-extracted (so a plan's owner change
+-- reaches its transactions). Soft deletes flow through as is_deleted.
+-- previous_transaction_date keeps the date a transaction held before its
+-- txn_timestamp last moved to another day, so agg_daily_savings can
+-- re-aggregate the day it left.
+
+{% if is_incremental() %}
+    {% set lower_bound = incremental_lower_bound('extracted_at') %}
+{% endif %}
+
+WITH transactions AS (
+    SELECT
+        t.txn_id,
+        t.plan_id,
+        t.amount,
+        t.side,
+        t.currency,
+        t.rate,
+        t.txn_timestamp,
+        t.updated_at,
+        t.deleted_at,
+        t.extracted_at
+    FROM {{ source('analytics', 'raw_savingstransaction') }} t
+    {% if is_incremental() %}
+    WHERE t.extracted_at > {{ lower_bound }}
+
+    UNION
+
     SELECT
         t.txn_id,
         t.plan_id,
-        p.customer_uid AS user_id,
         t.amount,
-        LOWER(t.side) AS side,
-        UPPER(t.currency) AS currency,
+        t.side,
+        t.currency,
         t.rate,
         t.txn_timestamp,
         t.updated_at,
-        t.deleted_at
-    FROM analytics.raw_savingstransaction t
-    LEFT JOIN analytics.raw_savings_plan p 
-        ON t.plan_id::text = p.plan_id::text  -- ✅ Cast both to text
+        t.deleted_at,
+        t.extracted_at
+    FROM {{ source('analytics', 'raw_savings_plan') }} p
+    JOIN {{ source('analytics', 'raw_savingstransaction') }} t
+        ON t.plan_id = p.plan_id
+    WHERE p.extracted_at > {{ lower_bound }}
+    {% endif %}
 )
+
 SELECT
-    txn_id,
-    plan_id,
-    user_id,
-    amount,
-    side,
-    currency,
-    rate,
-    txn_timestamp,
-    updated_at,
-    deleted_at,
-    (deleted_at IS NOT NULL) AS is_deleted
-FROM base
+    t.txn_id,
+    t.plan_id,
+    p.customer_uid AS user_id,
+    t.amount,
+    LOWER(t.side) AS side,
+    UPPER(t.currency) AS currency,
+    t.rate,
+    t.txn_timestamp,
+    t.updated_at,
+    t.deleted_at,
+    (t.deleted_at IS NOT NULL) AS is_deleted,
+    {% if is_incremental() %}
+    CASE
+        WHEN DATE(s.txn_timestamp) <> DATE(t.txn_timestamp) THEN DATE(s.txn_timestamp)
+        ELSE s.previous_transaction_date
+    END AS previous_transaction_date,
+    {% else %}
+    NULL::date AS previous_transaction_date,
+    {% endif %}
+    GREATEST(t.extracted_at, p.extracted_at) AS extracted_at
+FROM transactions t
+LEFT JOIN {{ source('analytics', 'raw_savings_plan') }} p
+    ON p.plan_id = t.plan_id
 {% if is_incremental() %}
-WHERE
-    updated_at > (SELECT COALESCE(MAX(updated_at), '1970-01-01') FROM {{ this }})
-    OR deleted_at > (SELECT COALESCE(MAX(updated_at), '1970-01-01') FROM {{ this }})
-{% endif %}
\ No newline at end of file
+LEFT JOIN {{ this }} s
+    ON s.txn_id = t.txn_id
+{% endif %}
@@ -1,5 +1,8 @@
 {{ config(materialized='view') }}
 
+-- Deleted users are kept (is_deleted) so dim_users can close their
+-- current version.
+
 WITH source AS (
     SELECT
         uid,
@@ -7,9 +10,11 @@ WITH source AS (
         last_name,
         occupation,
         state,
+        record_hash,
         extracted_at,
-        updated_at
-    FROM analytics.raw_users
+        updated_at,
+        deleted_at
+    FROM {{ source('analytics', 'raw_users') }}
 )
 
 SELECT
@@ -18,7 +23,8 @@ SELECT
     INITCAP(TRIM(last_name)) AS last_name,
     LOWER(TRIM(occupation)) AS occupation,
     UPPER(TRIM(state)) AS state_code,
+    record_hash,
+    (deleted_at IS NOT NULL) AS is_deleted,
     COALESCE(updated_at, extracted_at) AS record_timestamp
 FROM source
 WHERE uid IS NOT NULL
-
@@ -17,9 +17,39 @@ CREATE TABLE IF NOT EXISTS analytics.raw_users (
     state TEXT,
     record_hash TEXT,
     extracted_at TIMESTAMPTZ,
-    updated_at TIMESTAMPTZ
+    updated_at TIMESTAMPTZ,
+    source_id TEXT,
+    deleted_at TIMESTAMPTZ
 );
 
+-- Mongo _id and delete flag for warehouses created before they existed
+ALTER TABLE analytics.raw_users ADD COLUMN IF NOT EXISTS source_id TEXT;
+ALTER TABLE analytics.raw_users ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
+
+-- Change-stream deletes only carry the Mongo _id
+CREATE INDEX IF NOT EXISTS ix_raw_users_source_id ON analytics.raw_users (source_id);
+
+-- Live rows loaded before source_id existed; the Mongo job fills their _id in
+-- place once (backfill_source_ids), after which only rows with no matching
+-- Mongo document are left in this index
+CREATE INDEX IF NOT EXISTS ix_raw_users_missing_source_id
+    ON analytics.raw_users (uid)
+    WHERE source_id IS NULL AND deleted_at IS NULL;
+
+-- dim_users reads users changed since its last run through stg_users'
+-- record_timestamp expression
+CREATE INDEX IF NOT EXISTS ix_raw_users_record_timestamp
+    ON analytics.raw_users ((COALESCE(updated_at, extracted_at)));
+
+-- The Mongo job reads whole documents while any live user still has a
+-- hash of the full document (legacy MD5 or "-full"); this keeps that check
+-- cheap once they are all migrated
+CREATE INDEX IF NOT EXISTS ix_raw_users_full_document_hash
+    ON analytics.raw_users (uid)
+    WHERE deleted_at IS NULL
+      AND source_id IS NOT NULL
+      AND (record_hash NOT LIKE '%:%' OR record_hash LIKE '%-full:%');
+
 -- Savings plans from Aiven PostgreSQL
 CREATE TABLE IF NOT EXISTS analytics.raw_savings_plan (
     plan_id UUID PRIMARY KEY,
@@ -36,18 +66,174 @@ CREATE TABLE IF NOT EXISTS analytics.raw_savings_plan (
     extracted_at TIMESTAMPTZ
 );
 
--- Savings transactions from Aiven PostgreSQL
+-- Savings transactions from Aiven PostgreSQL, range-partitioned by month on
+-- txn_timestamp. The CDC loader creates the partitions a batch needs (plus a
+-- few months ahead) through analytics.ensure_monthly_partitions(); rows with
+-- no partition yet wait in the default partition and are moved when theirs
+-- is created. The primary key must include the partition key.
+
+-- Warehouses created before partitioning keep their rows: the old heap is
+-- renamed here and copied into the partitioned table further down.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'analytics'
+          AND c.relname = 'raw_savingstransaction'
+          AND c.relkind = 'r'
+    ) THEN
+        ALTER TABLE analytics.raw_savingstransaction RENAME TO raw_savingstransaction_unpartitioned;
+        ALTER TABLE analytics.raw_savingstransaction_unpartitioned
+            RENAME CONSTRAINT raw_savingstransaction_pkey TO raw_savingstransaction_unpartitioned_pkey;
+    END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS analytics.raw_savingstransaction (
-    txn_id UUID PRIMARY KEY,
+    txn_id UUID NOT NULL,
     plan_id UUID,
     amount NUMERIC(15, 2),
     currency TEXT,
     side TEXT,
     rate NUMERIC(10, 2),
-    txn_timestamp TIMESTAMPTZ,
+    txn_timestamp TIMESTAMPTZ NOT NULL,
     updated_at TIMESTAMPTZ,
     deleted_at TIMESTAMPTZ,
-    extracted_at TIMESTAMPTZ
+    extracted_at TIMESTAMPTZ,
+    PRIMARY KEY (txn_id, txn_timestamp)
+) PARTITION BY RANGE (txn_timestamp);
+
+CREATE TABLE IF NOT EXISTS analytics.raw_savingstransaction_default
+    PARTITION OF analytics.raw_savingstransaction DEFAULT;
+
+-- Incremental models filter on the CDC timestamps (BRIN stays tiny on
+-- append-mostly data) and join transactions to plans
+CREATE INDEX IF NOT EXISTS ix_raw_savingstransaction_updated_at
+    ON analytics.raw_savingstransaction USING brin (updated_at);
+CREATE INDEX IF NOT EXISTS ix_raw_savingstransaction_extracted_at
+    ON analytics.raw_savingstransaction USING brin (extracted_at);
+CREATE INDEX IF NOT EXISTS ix_raw_savingstransaction_plan_id
+    ON analytics.raw_savingstransaction (plan_id);
+
+-- ----------------------------------------------------------
+-- MONTHLY PARTITION MANAGEMENT
+-- ----------------------------------------------------------
+
+-- Create the monthly partitions <table>_pYYYYMM of p_parent covering
+-- p_from .. p_to (UTC months). Rows already parked in <table>_default for a
+-- new month are moved into it. Returns the number of partitions created.
+CREATE OR REPLACE FUNCTION analytics.ensure_monthly_partitions(
+    p_parent TEXT,
+    p_column TEXT,
+    p_from TIMESTAMPTZ,
+    p_to TIMESTAMPTZ
+) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_schema TEXT := split_part(p_parent, '.', 1);
+    v_table TEXT := split_part(p_parent, '.', 2);
+    v_month DATE := date_trunc('month', COALESCE(p_from, now()) AT TIME ZONE 'UTC')::date;
+    v_last DATE := date_trunc('month', GREATEST(COALESCE(p_to, p_from, now()), p_from) AT TIME ZONE 'UTC')::date;
+    v_lower TIMESTAMPTZ;
+    v_upper TIMESTAMPTZ;
+    v_name TEXT;
+    v_locked BOOLEAN := FALSE;
+    v_created INTEGER := 0;
+BEGIN
+    WHILE v_month <= v_last LOOP
+        v_name := format('%s_p%s', v_table, to_char(v_month, 'YYYYMM'));
+        IF to_regclass(format('%I.%I', v_schema, v_name)) IS NULL THEN
+            -- Serialise creation per parent across concurrent loaders
+            IF NOT v_locked THEN
+                PERFORM pg_advisory_xact_lock(hashtext(p_parent));
+                v_locked := TRUE;
+            END IF;
+            IF to_regclass(format('%I.%I', v_schema, v_name)) IS NULL THEN
+                v_lower := v_month::timestamp AT TIME ZONE 'UTC';
+                v_upper := (v_month + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+                EXECUTE format(
+                    'CREATE TABLE %I.%I (LIKE %I.%I INCLUDING DEFAULTS)',
+                    v_schema, v_name, v_schema, v_table
+                );
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM %I.%I WHERE %I >= %L AND %I < %L RETURNING *) '
+                    'INSERT INTO %I.%I SELECT * FROM moved',
+                    v_schema, v_table || '_default', p_column, v_lower, p_column, v_upper,
+                    v_schema, v_name
+                );
+                EXECUTE format(
+                    'ALTER TABLE %I.%I ATTACH PARTITION %I.%I FOR VALUES FROM (%L) TO (%L)',
+                    v_schema, v_table, v_schema, v_name, v_lower, v_upper
+                );
+                v_created := v_created + 1;
+            END IF;
+        END IF;
+        v_month := (v_month + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN v_created;
+END $$;
+
+-- Retention: drop monthly partitions of p_parent that end on or before
+-- p_before. Returns the number of partitions dropped.
+CREATE OR REPLACE FUNCTION analytics.drop_monthly_partitions(
+    p_parent TEXT,
+    p_before TIMESTAMPTZ
+) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_child RECORD;
+    v_dropped INTEGER := 0;
+BEGIN
+    FOR v_child IN
+        SELECT n.nspname AS schema_name, c.relname AS table_name
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE i.inhparent = p_parent::regclass
+          AND c.relname ~ '_p[0-9]{6}$'
+    LOOP
+        IF (to_date(right(v_child.table_name, 6), 'YYYYMM') + INTERVAL '1 month')::timestamp
+                AT TIME ZONE 'UTC' <= p_before THEN
+            EXECUTE format('DROP TABLE %I.%I', v_child.schema_name, v_child.table_name);
+            v_dropped := v_dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN v_dropped;
+END $$;
+
+-- Copy rows from a pre-partitioning heap, then drop it. Rows without a
+-- txn_timestamp cannot be routed, so the heap is kept if any exist.
+DO $$
+DECLARE
+    v_unrouted BIGINT;
+BEGIN
+    IF to_regclass('analytics.raw_savingstransaction_unpartitioned') IS NOT NULL THEN
+        PERFORM analytics.ensure_monthly_partitions(
+            'analytics.raw_savingstransaction', 'txn_timestamp', min(txn_timestamp), max(txn_timestamp)
+        )
+        FROM analytics.raw_savingstransaction_unpartitioned;
+
+        INSERT INTO analytics.raw_savingstransaction
+        SELECT * FROM analytics.raw_savingstransaction_unpartitioned
+        WHERE txn_timestamp IS NOT NULL
+        ON CONFLICT DO NOTHING;
+
+        SELECT count(*) INTO v_unrouted
+        FROM analytics.raw_savingstransaction_unpartitioned
+        WHERE txn_timestamp IS NULL;
+
+        IF v_unrouted = 0 THEN
+            DROP TABLE analytics.raw_savingstransaction_unpartitioned;
+        ELSE
+            RAISE NOTICE 'Kept analytics.raw_savingstransaction_unpartitioned: % rows have no txn_timestamp',
+                v_unrouted;
+        END IF;
+    END IF;
+END $$;
+
+SELECT analytics.ensure_monthly_partitions(
+    'analytics.raw_savingstransaction', 'txn_timestamp', now(), now() + INTERVAL '3 months'
 );
 
 -- ----------------------------------------------------------
@@ -57,11 +243,67 @@ CREATE TABLE IF NOT EXISTS analytics.raw_savingstransaction (
 CREATE TABLE IF NOT EXISTS analytics.cdc_metadata (
     source_name TEXT PRIMARY KEY,
     last_extracted_timestamp TIMESTAMPTZ,
+    last_extracted_key TEXT,
+    last_lsn TEXT,
+    resume_token TEXT,
+    source_ids_backfilled_at TIMESTAMPTZ,
     last_extraction_status TEXT,
     records_extracted BIGINT,
+    last_loaded_at TIMESTAMPTZ,
+    rows_last_run BIGINT,
+    max_lag_seconds DOUBLE PRECISION,
     updated_at TIMESTAMPTZ
 );
 
+-- Keyset watermark column for warehouses created before it existed
+ALTER TABLE analytics.cdc_metadata ADD COLUMN IF NOT EXISTS last_extracted_key TEXT;
+
+-- Confirmed replication LSN for tables using the logical replication engine
+ALTER TABLE analytics.cdc_metadata ADD COLUMN IF NOT EXISTS last_lsn TEXT;
+
+-- MongoDB change-stream resume token (extended JSON)
+ALTER TABLE analytics.cdc_metadata ADD COLUMN IF NOT EXISTS resume_token TEXT;
+
+-- Set once the Mongo job has backfilled raw_users.source_id, so it runs once
+ALTER TABLE analytics.cdc_metadata ADD COLUMN IF NOT EXISTS source_ids_backfilled_at TIMESTAMPTZ;
+
+-- Freshness stats kept by the CDC jobs as they load, so monitoring never
+-- scans the raw tables: when rows last landed, how many the last run
+-- loaded, and its largest source-to-warehouse lag
+ALTER TABLE analytics.cdc_metadata ADD COLUMN IF NOT EXISTS last_loaded_at TIMESTAMPTZ;
+ALTER TABLE analytics.cdc_metadata ADD COLUMN IF NOT EXISTS rows_last_run BIGINT;
+ALTER TABLE analytics.cdc_metadata ADD COLUMN IF NOT EXISTS max_lag_seconds DOUBLE PRECISION;
+
+-- ----------------------------------------------------------
+-- CDC RUN HISTORY (append-only, one row per source per run)
+-- ----------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS analytics.cdc_run_history (
+    run_id BIGSERIAL PRIMARY KEY,
+    source_name TEXT NOT NULL,
+    job TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    started_at TIMESTAMPTZ NOT NULL,
+    finished_at TIMESTAMPTZ NOT NULL,
+    wall_seconds DOUBLE PRECISION,
+    connect_seconds DOUBLE PRECISION,
+    extract_seconds DOUBLE PRECISION,
+    transform_seconds DOUBLE PRECISION,
+    load_seconds DOUBLE PRECISION,
+    commit_seconds DOUBLE PRECISION,
+    rows_extracted BIGINT,
+    rows_loaded BIGINT,
+    bytes_extracted BIGINT,
+    bytes_loaded BIGINT,
+    max_lag_seconds DOUBLE PRECISION
+);
+
+ALTER TABLE analytics.cdc_run_history ADD COLUMN IF NOT EXISTS max_lag_seconds DOUBLE PRECISION;
+
+CREATE INDEX IF NOT EXISTS ix_cdc_run_history_source_started
+    ON analytics.cdc_run_history (source_name, started_at);
+
 -- ----------------------------------------------------------
 -- SEED INITIAL METADATA ROWS
 -- ----------------------------------------------------------
@@ -78,3 +320,14 @@ VALUES
     ('postgres_savings_plan', '1970-01-01', 'never_run', 0, NOW()),
     ('postgres_savingstransaction', '1970-01-01', 'never_run', 0, NOW())
 ON CONFLICT (source_name) DO NOTHING;
+
+-- Carry the last load time over once for warehouses loaded before
+-- cdc_metadata tracked it
+UPDATE analytics.cdc_metadata m
+SET last_loaded_at = CASE m.source_name
+        WHEN 'mongodb_users' THEN (SELECT MAX(extracted_at) FROM analytics.raw_users)
+        WHEN 'postgres_savings_plan' THEN (SELECT MAX(extracted_at) FROM analytics.raw_savings_plan)
+        WHEN 'postgres_savingstransaction' THEN (SELECT MAX(extracted_at) FROM analytics.raw_savingstransaction)
+    END
+WHERE m.last_loaded_at IS NULL
+  AND m.last_extraction_status <> 'never_run';
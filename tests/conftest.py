@@ -0,0 +1,7 @@
+"""Put the CDC modules on the import path, as the jobs run them from cdc/."""
+
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(ROOT, "cdc"))
@@ -0,0 +1,25 @@
+import pytest
+
+from daemon import AdaptiveInterval
+
+
+@pytest.fixture
+def interval():
+    return AdaptiveInterval(minimum=1.0, maximum=10.0, backoff=2.0)
+
+
+def test_idle_polls_back_off_up_to_the_maximum(interval):
+    assert [interval.next(0) for _ in range(5)] == [2.0, 4.0, 8.0, 10.0, 10.0]
+
+
+def test_a_poll_with_changes_resets_to_the_minimum(interval):
+    interval.next(0)
+    interval.next(0)
+    assert interval.next(5) == 1.0
+    assert interval.next(0) == 2.0
+
+
+def test_a_capped_poll_repolls_immediately(interval):
+    interval.next(0)
+    assert interval.next(100, capped=True) == 0.0
+    assert interval.next(0) == 2.0
@@ -0,0 +1,17 @@
+from extract_mongo import deletes_allowed
+
+
+def test_nothing_missing_is_always_allowed():
+    assert deletes_allowed(seen=0, missing=0, live=100)
+
+
+def test_an_empty_snapshot_deletes_nothing():
+    assert not deletes_allowed(seen=0, missing=100, live=100)
+
+
+def test_missing_beyond_the_fraction_deletes_nothing():
+    assert not deletes_allowed(seen=40, missing=60, live=100, max_fraction=0.5)
+
+
+def test_missing_within_the_fraction_is_allowed():
+    assert deletes_allowed(seen=95, missing=5, live=100, max_fraction=0.5)
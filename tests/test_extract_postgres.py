@@ -0,0 +1,28 @@
+from extract_postgres import build_change_query
+
+
+def test_first_page_filters_on_the_timestamp_only():
+    sql = build_change_query("public.savings_plan", "plan_id", with_key=False)
+    assert "s.updated_at > %(ts)s" in sql
+    assert "s.deleted_at > %(ts)s" in sql
+    assert "%(key)s" not in sql
+
+
+def test_later_pages_resume_after_the_timestamp_and_key():
+    sql = build_change_query("public.savings_plan", "plan_id", with_key=True)
+    assert "(s.updated_at, s.plan_id) > (%(ts)s, %(key)s)" in sql
+    assert "(s.deleted_at, s.plan_id) > (%(ts)s, %(key)s)" in sql
+
+
+def test_both_branches_read_the_source_in_keyset_order():
+    sql = build_change_query("public.savingstransaction", "txn_id", with_key=True)
+    assert sql.count("FROM public.savingstransaction s") == 2
+    assert "ORDER BY s.updated_at, s.txn_id" in sql
+    assert "ORDER BY s.deleted_at, s.txn_id" in sql
+    assert "ORDER BY _change_ts, txn_id" in sql
+
+
+def test_each_row_is_taken_by_one_branch_only():
+    sql = build_change_query("public.savings_plan", "plan_id", with_key=False)
+    assert "(s.deleted_at IS NULL OR s.deleted_at <= s.updated_at)" in sql
+    assert "(s.updated_at IS NULL OR s.updated_at < s.deleted_at)" in sql
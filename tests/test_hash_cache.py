@@ -0,0 +1,80 @@
+from hash_cache import HashCache, decode_hash, encode_hash
+
+BLAKE = "blake2b:" + "ab" * 16
+MD5_FULL = "md5-full:" + "cd" * 16
+LEGACY = "ef" * 16
+
+
+def open_cache(tmp_path):
+    return HashCache(str(tmp_path / "users.cache"), fingerprint="test-warehouse")
+
+
+def test_encode_round_trips_known_formats():
+    for stored in (BLAKE, MD5_FULL, LEGACY):
+        assert decode_hash(*encode_hash(stored)) == stored
+
+
+def test_unusable_hashes_encode_as_no_hash():
+    for stored in (None, "", "sha1:" + "00" * 16, "blake2b:short", "blake2b:" + "zz" * 16):
+        assert decode_hash(*encode_hash(stored)) is None
+
+
+def test_build_update_and_lookup(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.update([("user_b", BLAKE), ("user_a", LEGACY), ("user_c", None)])
+
+    assert len(cache) == 3
+    assert list(cache.records["uid"]) == [b"user_a", b"user_b", b"user_c"]
+    assert cache.get_many(["user_c", "user_a", "user_b", "user_x"], default="missing") == [
+        None, LEGACY, BLAKE, "missing",
+    ]
+
+    # Known uids are rewritten in place, new ones merged in order.
+    cache.update([("user_a", MD5_FULL), ("user_0", BLAKE), ("user_bb", LEGACY)])
+
+    assert list(cache.records["uid"]) == [b"user_0", b"user_a", b"user_b", b"user_bb", b"user_c"]
+    assert cache.get_many(["user_a", "user_0", "user_bb", "user_b"]) == [MD5_FULL, BLAKE, LEGACY, BLAKE]
+
+
+def test_merge_widens_uids(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.update([("u1", BLAKE), ("u3", LEGACY)])
+    cache.update([("u2_much_longer_uid", MD5_FULL)])
+
+    assert cache.width == len("u2_much_longer_uid")
+    assert cache.get_many(["u1", "u2_much_longer_uid", "u3"]) == [BLAKE, MD5_FULL, LEGACY]
+
+
+def test_uids_wider_than_the_cache_are_not_found(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.update([("u1", BLAKE)])
+
+    assert cache.get("u1_but_wider", default="missing") == "missing"
+
+
+def test_uids_sort_by_utf8_bytes(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.update([("é", BLAKE), ("z", LEGACY), ("Z", MD5_FULL)])
+
+    assert [uid.decode() for uid in cache.records["uid"]] == ["Z", "z", "é"]
+    assert cache.get_many(["é", "z", "Z"]) == [BLAKE, LEGACY, MD5_FULL]
+
+
+def test_file_reloads_in_a_new_cache(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.update([("user_a", BLAKE), ("user_b", LEGACY)])
+    cache.update([("user_b", MD5_FULL)])
+    cache.close()
+
+    reopened = open_cache(tmp_path)
+    assert reopened._load()
+    assert reopened.get_many(["user_a", "user_b"]) == [BLAKE, MD5_FULL]
+
+
+def test_file_from_another_warehouse_is_not_loaded(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.update([("user_a", BLAKE)])
+    cache.close()
+
+    other = HashCache(str(tmp_path / "users.cache"), fingerprint="other-warehouse")
+    assert not other._load()
@@ -0,0 +1,81 @@
+import pytest
+
+from hashing import CHANGED, REHASH, UNCHANGED, RecordHasher, legacy_record_hash
+
+USER = {"_id": "65f0", "Uid": "user_000001", "firstName": "Ada", "lastName": "Obi",
+        "occupation": "Teacher", "state": "Lagos"}
+CHANGED_USER = {**USER, "state": "Kano"}
+
+
+@pytest.fixture
+def hasher():
+    return RecordHasher("blake2b")
+
+
+def test_current_format_is_unchanged(hasher):
+    assert hasher.compare(USER, hasher(USER)) == UNCHANGED
+
+
+def test_current_format_with_other_content_is_changed(hasher):
+    assert hasher.compare(CHANGED_USER, hasher(USER)) == CHANGED
+
+
+def test_missing_stored_hash_is_changed(hasher):
+    assert hasher.compare(USER, None) == CHANGED
+
+
+def test_legacy_md5_of_same_document_is_rehashed(hasher):
+    assert hasher.compare(USER, legacy_record_hash(USER)) == REHASH
+
+
+def test_legacy_md5_of_other_document_is_changed(hasher):
+    assert hasher.compare(CHANGED_USER, legacy_record_hash(USER)) == CHANGED
+
+
+@pytest.mark.parametrize("algorithm, full_document", [
+    ("md5", False),
+    ("md5", True),
+    ("blake2b", True),
+])
+def test_other_formats_are_verified_with_their_own_algorithm(hasher, algorithm, full_document):
+    stored = RecordHasher(algorithm, full_document)(USER)
+    assert hasher.compare(USER, stored) == REHASH
+    assert hasher.compare(CHANGED_USER, stored) == CHANGED
+
+
+def test_full_document_hash_covers_unmapped_fields():
+    full = RecordHasher("blake2b", full_document=True)
+    stored = full(USER)
+    assert full.compare({**USER, "email": "ada@example.com"}, stored) == CHANGED
+    assert RecordHasher("blake2b").compare({**USER, "email": "ada@example.com"}, stored) == CHANGED
+
+
+def test_mapped_field_hash_ignores_unmapped_fields(hasher):
+    assert hasher.compare({**USER, "email": "ada@example.com"}, hasher(USER)) == UNCHANGED
+
+
+def test_unknown_tag_is_changed(hasher):
+    assert hasher.compare(USER, "sha1:" + "0" * 32) == CHANGED
+
+
+def test_prefix_marks_algorithm_and_scope():
+    assert RecordHasher("md5")(USER).startswith("md5:")
+    assert RecordHasher("blake2b", full_document=True)(USER).startswith("blake2b-full:")
+
+
+def test_none_and_empty_fields_hash_differently(hasher):
+    assert hasher({**USER, "state": None}) != hasher({**USER, "state": ""})
+
+
+def test_pooled_hashes_match_serial():
+    users = [{**USER, "Uid": f"user_{i:06d}", "state": str(i)} for i in range(8)]
+    pooled = RecordHasher("blake2b", workers=2)
+    try:
+        assert pooled.hash_many(users) == [pooled(user) for user in users]
+    finally:
+        pooled.close()
+
+
+def test_unknown_algorithm_is_rejected():
+    with pytest.raises(ValueError):
+        RecordHasher("sha1")
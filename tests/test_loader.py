@@ -0,0 +1,37 @@
+from loader import _copy_buffer, _copy_value
+
+
+def test_none_is_the_copy_null_marker():
+    assert _copy_value(None) == "\\N"
+
+
+def test_scalars_are_rendered_as_text():
+    assert _copy_value(42) == "42"
+    assert _copy_value(1.5) == "1.5"
+    assert _copy_value("Lagos") == "Lagos"
+
+
+def test_copy_separators_are_escaped():
+    assert _copy_value("a\tb\nc\rd") == "a\\tb\\nc\\rd"
+
+
+def test_backslashes_are_escaped_before_separators():
+    assert _copy_value("C:\\new") == "C:\\\\new"
+
+
+def test_dicts_and_lists_are_rendered_as_json():
+    assert _copy_value({"state": "Kano"}) == '{"state": "Kano"}'
+    assert _copy_value([1, None]) == "[1, null]"
+
+
+def test_buffer_holds_one_line_per_row_and_is_rewound():
+    buf, size = _copy_buffer([(1, "Ada", None), (2, "Obi\tO", 3)])
+    text = buf.read()
+    assert text == "1\tAda\t\\N\n2\tObi\\tO\t3\n"
+    assert size == len(text)
+
+
+def test_empty_rows_give_an_empty_buffer():
+    buf, size = _copy_buffer([])
+    assert size == 0
+    assert buf.read() == ""
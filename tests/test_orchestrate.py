@@ -0,0 +1,31 @@
+from orchestrate import SOURCE_TABLES, changed_sources, dbt_command
+
+
+def test_dbt_builds_downstream_of_each_changed_source():
+    cmd = dbt_command(["mongodb_users", "postgres_savingstransaction"], project_dir="/dbt")
+    assert cmd == [
+        "dbt", "build", "--project-dir", "/dbt", "--select",
+        "source:analytics.raw_users+",
+        "source:analytics.raw_savingstransaction+",
+    ]
+
+
+def test_unknown_sources_are_not_selected():
+    cmd = dbt_command(["postgres_savings_plan", "not_a_source"], project_dir="/dbt")
+    assert cmd[-1] == "source:analytics.raw_savings_plan+"
+    assert "not_a_source" not in " ".join(cmd)
+
+
+def test_extra_args_follow_the_selectors():
+    cmd = dbt_command(["postgres_savings_plan"], project_dir="/dbt", extra_args=["--target", "prod"])
+    assert cmd[-2:] == ["--target", "prod"]
+
+
+def test_every_cdc_source_maps_to_a_raw_table():
+    assert set(SOURCE_TABLES.values()) == {"raw_users", "raw_savings_plan", "raw_savingstransaction"}
+
+
+def test_changed_sources_are_those_whose_load_advanced():
+    before = {"a": 1, "b": 2, "c": None}
+    after = {"a": 1, "b": 3, "c": 4, "d": 5, "e": None}
+    assert changed_sources(before, after) == ["b", "c", "d"]
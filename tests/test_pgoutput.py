@@ -0,0 +1,120 @@
+import struct
+from datetime import datetime, timezone
+
+import pytest
+
+from logical_replication import PgOutputDecoder, UnchangedToastError, format_lsn, parse_lsn
+
+REL_ID = 16390
+COLUMNS = ("txn_id", "amount", "txn_timestamp")
+
+
+def _string(value: str) -> bytes:
+    return value.encode() + b"\0"
+
+
+def _micros(ts: datetime) -> int:
+    return int((ts - datetime(2000, 1, 1, tzinfo=timezone.utc)).total_seconds() * 1_000_000)
+
+
+def relation(rel_id=REL_ID, schema="public", table="savingstransaction", columns=COLUMNS) -> bytes:
+    body = b"R" + struct.pack("!i", rel_id) + _string(schema) + _string(table)
+    body += struct.pack("!bh", ord("d"), len(columns))
+    for name in columns:
+        body += struct.pack("!b", 1) + _string(name) + struct.pack("!ii", 25, -1)
+    return body
+
+
+def tuple_data(values) -> bytes:
+    body = struct.pack("!h", len(values))
+    for value in values:
+        if value is None:
+            body += b"n"
+        elif value is ...:
+            body += b"u"
+        else:
+            encoded = value.encode()
+            body += b"t" + struct.pack("!i", len(encoded)) + encoded
+    return body
+
+
+def test_begin_and_commit():
+    decoder = PgOutputDecoder()
+    ts = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+    begin = b"B" + struct.pack("!qqi", 0x16B3748, _micros(ts), 742)
+    commit = b"C" + struct.pack("!bqqq", 0, 0x16B3748, 0x16B3780, _micros(ts))
+
+    assert decoder.decode(begin) == ("begin", ts)
+    assert decoder.decode(commit) == ("commit", 0x16B3780, ts)
+
+
+def test_relation_then_insert():
+    decoder = PgOutputDecoder()
+    assert decoder.decode(relation()) is None
+
+    kind, rel, values = decoder.decode(b"I" + struct.pack("!i", REL_ID) + b"N" + tuple_data(["t1", "10.50", None]))
+
+    assert kind == "insert"
+    assert rel == ("public", "savingstransaction", list(COLUMNS))
+    assert values == {"txn_id": "t1", "amount": "10.50", "txn_timestamp": None}
+
+
+def test_update_skips_old_tuple():
+    decoder = PgOutputDecoder()
+    decoder.decode(relation())
+    old = b"O" + tuple_data(["t1", "10.50", ...])
+    new = b"N" + tuple_data(["t1", "12.00", "2024-05-01 12:30:00+00"])
+
+    kind, _, values = decoder.decode(b"U" + struct.pack("!i", REL_ID) + old + new)
+
+    assert kind == "update"
+    assert values == {"txn_id": "t1", "amount": "12.00", "txn_timestamp": "2024-05-01 12:30:00+00"}
+
+
+def test_update_without_old_tuple():
+    decoder = PgOutputDecoder()
+    decoder.decode(relation())
+
+    kind, _, values = decoder.decode(b"U" + struct.pack("!i", REL_ID) + b"N" + tuple_data(["t1", "1", "x"]))
+
+    assert kind == "update"
+    assert values["amount"] == "1"
+
+
+def test_delete_keeps_only_key_columns():
+    decoder = PgOutputDecoder()
+    decoder.decode(relation())
+
+    kind, _, values = decoder.decode(b"D" + struct.pack("!i", REL_ID) + b"K" + tuple_data(["t1", None, None]))
+
+    assert kind == "delete"
+    assert values == {"txn_id": "t1"}
+
+
+def test_unchanged_toast_in_new_tuple_is_rejected():
+    decoder = PgOutputDecoder()
+    decoder.decode(relation())
+
+    with pytest.raises(UnchangedToastError):
+        decoder.decode(b"U" + struct.pack("!i", REL_ID) + b"N" + tuple_data(["t1", ..., "x"]))
+
+
+def test_relations_are_tracked_by_id():
+    decoder = PgOutputDecoder()
+    decoder.decode(relation())
+    decoder.decode(relation(rel_id=16400, table="savings_plan", columns=("plan_id",)))
+
+    _, rel, values = decoder.decode(b"I" + struct.pack("!i", 16400) + b"N" + tuple_data(["p1"]))
+
+    assert rel[:2] == ("public", "savings_plan")
+    assert values == {"plan_id": "p1"}
+
+
+def test_unused_messages_decode_to_none():
+    assert PgOutputDecoder().decode(b"O" + struct.pack("!q", 0) + _string("origin")) is None
+
+
+def test_lsn_round_trip():
+    assert format_lsn(0x16B3780) == "0/16B3780"
+    assert parse_lsn("1A/16B3780") == (0x1A << 32) + 0x16B3780
+    assert parse_lsn(format_lsn(0x2F00000123)) == 0x2F00000123